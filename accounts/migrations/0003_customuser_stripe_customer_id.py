@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_profile_description_profile_profile_picture_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='stripe_customer_id',
+            field=models.CharField(blank=True, help_text='Client Stripe associé (créé au premier paiement)', max_length=100, null=True, unique=True),
+        ),
+    ]
@@ -9,6 +9,7 @@ class CustomUser(AbstractUser):
     )
     user_type = models.CharField(max_length=10, choices=USER_TYPE_CHOICES, default='buyer')
     email = models.EmailField(unique=True)
+    stripe_customer_id = models.CharField(max_length=100, blank=True, null=True, unique=True, help_text="Client Stripe associé (créé au premier paiement)")
 
 class Profile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
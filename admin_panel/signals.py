@@ -3,6 +3,7 @@ from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from .models import Report
 from store.models import Notification
+from store.notifications import notify_users
 
 User = get_user_model()
 
@@ -36,10 +37,9 @@ def check_report_count(sender, instance, created, **kwargs):
                 related_object_id=instance.id
             )
             # Notification à tous les admins
-            for admin in User.objects.filter(is_staff=True):
-                Notification.objects.create(
-                    user=admin,
-                    message=f"Le compte de {user.username} a été désactivé pour 10 signalements ouverts.",
-                    notification_type='account_deactivation_alert',
-                    related_object_id=instance.id
-                )
\ No newline at end of file
+            notify_users(
+                User.objects.filter(is_staff=True).values_list('id', flat=True),
+                f"Le compte de {user.username} a été désactivé pour 10 signalements ouverts.",
+                'account_deactivation_alert',
+                related_object_id=instance.id,
+            )
\ No newline at end of file
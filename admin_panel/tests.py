@@ -1,7 +1,7 @@
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from .models import Report, UserModeration
+from .models import Report, UserModeration, ProductModeration
 from store.models import Product, Notification
 from datetime import datetime
 
@@ -153,4 +153,60 @@ class ReportSignalTests(TestCase):
         self.assertEqual(
             moderation.reason,
             f"Désactivation manuelle via signalement {report.id} pour : inappropriate_content"
-        )
\ No newline at end of file
+        )
+
+
+class ProductListingTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='listing_seller', email='listing_seller@example.com', password='testpass123')
+        self.admin_user = User.objects.create_user(
+            username='listing_admin', email='listing_admin@example.com', password='testpass123', is_staff=True
+        )
+        self.product = Product.objects.create(name='Produit', price=10, stock=2, description='Desc', seller=self.seller)
+        self.client.login(username='listing_admin', password='testpass123')
+
+    def test_approval_lists_product_and_stock_out_unlists_it(self):
+        """Teste la maintenance de Product.is_listed par la modération et le stock."""
+        moderation = ProductModeration.objects.create(product=self.product)
+        self.product.refresh_from_db()
+        self.assertFalse(self.product.is_listed)
+
+        self.client.post(reverse('admin_panel:approve_moderation', args=[moderation.id]))
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.is_listed)
+
+        self.product.stock = 0
+        self.product.save()
+        self.product.refresh_from_db()
+        self.assertFalse(self.product.is_listed)
+
+
+from unittest.mock import patch
+from .views import UserListView
+
+
+class CursorListTests(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_user(
+            username='cursor_admin', email='cursor_admin@example.com', password='testpass123', is_staff=True
+        )
+        for index in range(4):
+            User.objects.create_user(username=f'cursor_user{index}', email=f'cursor_user{index}@example.com', password='testpass123')
+        self.client.login(username='cursor_admin', password='testpass123')
+
+    def test_list_without_cursor_is_unchanged(self):
+        response = self.client.get(reverse('admin_panel:user_list'))
+        self.assertEqual(len(response.context['users']), 5)
+        self.assertIsNone(response.context['next_cursor'])
+
+    @patch.object(UserListView, 'cursor_paginate_by', 2)
+    def test_follow_next_cursor(self):
+        seen = []
+        response = self.client.get(reverse('admin_panel:user_list'), {'cursor': ''})
+        while True:
+            seen += [user.username for user in response.context['users']]
+            if not response.context['next_cursor']:
+                break
+            response = self.client.get(reverse('admin_panel:user_list'), {'cursor': response.context['next_cursor']})
+        self.assertEqual(seen, ['cursor_admin'] + [f'cursor_user{index}' for index in range(4)])
+        self.assertIsNotNone(response.context['previous_cursor'])
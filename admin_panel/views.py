@@ -11,6 +11,8 @@ from django.db.models import Sum, Count, Q
 from django.db.models.functions import TruncMonth
 from .models import ProductModeration, Report, UserModeration
 from store.models import Product, Notification, Order, Review
+from store.pagination import CursorPaginationMixin
+from store.images import duplicate_suspects
 from django.core.mail import send_mail
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
@@ -69,10 +71,11 @@ class AdminDashboardView(LoginRequiredMixin, AdminAccessMixin, TemplateView):
         }
         return context
 
-class UserListView(LoginRequiredMixin, AdminAccessMixin, ListView):
+class UserListView(LoginRequiredMixin, AdminAccessMixin, CursorPaginationMixin, ListView):
     model = User
     template_name = 'admin_panel/user_list.html'
     context_object_name = 'users'
+    cursor_ordering = 'id'
 
     def get_queryset(self):
         queryset = User.objects.all()
@@ -102,10 +105,11 @@ class UserListView(LoginRequiredMixin, AdminAccessMixin, ListView):
         context['search_query'] = self.request.GET.get('search', '')
         return context
 
-class ProductListView(LoginRequiredMixin, AdminAccessMixin, ListView):
+class ProductListView(LoginRequiredMixin, AdminAccessMixin, CursorPaginationMixin, ListView):
     model = Product
     template_name = 'admin_panel/product_list.html'
     context_object_name = 'products'
+    cursor_ordering = '-created_at'
 
     def get_queryset(self):
         queryset = Product.objects.select_related('seller', 'category').all()
@@ -154,6 +158,13 @@ class ProductModerationView(LoginRequiredMixin, AdminAccessMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_query'] = self.request.GET.get('search', '')
+        # Produits dont les photos sont identiques ou proches (empreinte perceptuelle, store.images)
+        moderations = list(context['moderations'])
+        suspects = duplicate_suspects([moderation.product for moderation in moderations])
+        for moderation in moderations:
+            moderation.duplicate_suspects = suspects.get(moderation.product_id, [])
+        context['moderations'] = moderations
+        context['duplicate_suspect_count'] = sum(1 for moderation in moderations if moderation.duplicate_suspects)
         return context
 
 class ApproveModerationView(LoginRequiredMixin, AdminAccessMixin, View):
@@ -212,10 +223,11 @@ class RejectModerationView(LoginRequiredMixin, AdminAccessMixin, View):
             messages.error(request, "Ce produit n'est pas en attente d'approbation ou la requête est invalide.")
         return redirect('admin_panel:product_moderation')
 
-class ReportListView(LoginRequiredMixin, AdminAccessMixin, ListView):
+class ReportListView(LoginRequiredMixin, AdminAccessMixin, CursorPaginationMixin, ListView):
     model = Report
     template_name = 'admin_panel/report_list.html'
     context_object_name = 'reports'
+    cursor_ordering = '-created_at'
 
     def get_queryset(self):
         queryset = Report.objects.select_related('product', 'user', 'reporter').all()
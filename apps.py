@@ -8,4 +8,14 @@ class StoreConfig(AppConfig):
         try:
             import store.signals
         except ImportError:
-            pass  # Handle the error or log it if needed
\ No newline at end of file
+            pass  # Handle the error or log it if needed
+        # Modules qui connectent leurs propres récepteurs de signaux
+        import store.search
+        import store.visibility
+        import store.facets
+        import store.pricing
+        import store.similarity
+        import store.ratings
+        import store.fragment_cache
+        import store.session_cart
+        import store.images
\ No newline at end of file
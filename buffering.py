@@ -0,0 +1,96 @@
+"""
+Écritures différées : les événements sont agrégés en mémoire puis écrits en
+base par lots, périodiquement, quand le tampon est plein et à l'arrêt du processus.
+"""
+import atexit
+import logging
+import threading
+
+from django.db import DatabaseError, close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedWriter:
+    """
+    Classe de base. Les sous-classes remplissent leur tampon sous self._lock,
+    appellent self._added() puis implémentent _take(), _restore() et _write().
+
+    flush_interval : secondes entre deux vidages par le thread de fond.
+    max_pending : nombre d'événements au-delà duquel on vide immédiatement ;
+                  0 ou 1 revient à écrire chaque événement tout de suite.
+    """
+
+    def __init__(self, flush_interval=5.0, max_pending=1000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = 0
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def _take(self):
+        """Retourne le contenu du tampon et le vide (appelé sous self._lock)."""
+        raise NotImplementedError
+
+    def _restore(self, snapshot):
+        """Remet dans le tampon un lot dont l'écriture a échoué (appelé sous self._lock)."""
+        raise NotImplementedError
+
+    def _write(self, snapshot):
+        """Écrit un lot en base."""
+        raise NotImplementedError
+
+    def _added(self, count=1):
+        with self._lock:
+            self._pending += count
+            pending = self._pending
+        if pending >= max(self.max_pending, 1):
+            self.flush()
+        else:
+            self._ensure_started()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def flush(self):
+        """Écrit le tampon en base ; retourne False si l'écriture a échoué."""
+        with self._flush_lock:
+            with self._lock:
+                snapshot = self._take()
+                pending, self._pending = self._pending, 0
+            if not pending:
+                return True
+            try:
+                self._write(snapshot)
+            except DatabaseError as e:
+                logger.error(f"{self.__class__.__name__} : écriture différée échouée, nouvel essai au prochain vidage : {e}")
+                with self._lock:
+                    self._restore(snapshot)
+                    self._pending += pending
+                return False
+            return True
+
+    def _ensure_started(self):
+        if self._thread is not None or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=f'{self.__class__.__name__}-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        """Arrête le thread de fond et vide le tampon (enregistré avec atexit)."""
+        self._stopping.set()
+        self.flush()
@@ -0,0 +1,252 @@
+"""
+Paiement d'une commande en saga : aucune transaction n'est ouverte pendant
+les appels à Stripe ou PayPal.
+
+1. start_checkout : transaction courte — réservations converties, commande
+   en attente créée (store.orders.place_order) et CheckoutSaga 'started'.
+2. charge : la saga passe à 'charging' puis le prestataire est appelé, hors
+   transaction ; l'id du PaymentIntent est conservé dès sa création.
+3. confirm ou compensate : transaction courte — commande 'processing' et
+   saga 'confirmed', ou stock restitué, commande 'cancelled' et saga
+   'compensated'.
+
+Si le résultat de l'appel est indéterminé (coupure réseau, worker arrêté),
+la saga reste ouverte : recover_stale_sagas (commande recover_checkout_sagas)
+interroge le prestataire après CHECKOUT_SAGA_TIMEOUT secondes et la termine
+dans un sens ou dans l'autre.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+import paypalrestsdk
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .inventory import restock
+from .models import CheckoutSaga, Notification
+from .orders import place_order
+from .payments import stripe_customer_id
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentFailed(Exception):
+    """Paiement refusé (la saga est compensée) ou non confirmé (la saga reste ouverte)."""
+
+
+class PaymentUnresolved(Exception):
+    """Le prestataire n'a pas permis de conclure : la saga est laissée au balayeur."""
+
+
+def saga_timeout():
+    return timedelta(seconds=getattr(settings, 'CHECKOUT_SAGA_TIMEOUT', 900))
+
+
+def start_checkout(user, priced, payment_method, payment_token, **order_fields):
+    """Étape 1 : commande en attente et saga 'started' ; lève InsufficientStock sans rien écrire."""
+    with transaction.atomic():
+        order = place_order(user, priced, status='pending', payment_method=payment_method, **order_fields)
+        saga = CheckoutSaga.objects.create(order=order, payment_method=payment_method, payment_token=payment_token)
+    return saga
+
+
+def charge(saga, return_url):
+    """
+    Étape 2, hors transaction : débite le client puis confirme la commande.
+    Lève PaymentFailed si le paiement est refusé (commande compensée), si
+    son issue est inconnue (commande laissée au balayeur) ou si la saga a
+    déjà été prise en charge ailleurs (aucun débit n'est alors tenté).
+    """
+    claimed = CheckoutSaga.objects.filter(id=saga.id, state='started').update(state='charging', updated_at=timezone.now())
+    if not claimed:
+        state = CheckoutSaga.objects.filter(id=saga.id).values_list('state', flat=True).first()
+        if state == 'confirmed':
+            return
+        logger.warning(f"Saga {saga.id} ({state}) déjà prise en charge : pas de nouveau débit pour la commande #{saga.order_id}")
+        raise PaymentFailed("Ce paiement est déjà en cours de traitement ou la commande a été annulée.")
+    try:
+        if saga.payment_method == 'card':
+            charge_id = _charge_card(saga, return_url)
+        elif saga.payment_method == 'paypal':
+            charge_id = _approved_paypal_sale(saga)
+        else:
+            raise PaymentFailed("Méthode de paiement non prise en charge.")
+    except PaymentFailed as e:
+        compensate(saga, str(e))
+        raise
+    except (stripe.error.CardError, stripe.error.InvalidRequestError, paypalrestsdk.exceptions.ResourceNotFound) as e:
+        compensate(saga, str(e))
+        raise PaymentFailed(str(e)) from e
+    except Exception as e:
+        logger.error(f"Issue du paiement inconnue pour la commande #{saga.order_id}, saga laissée au balayeur : {str(e)}")
+        CheckoutSaga.objects.filter(id=saga.id).update(error=str(e), updated_at=timezone.now())
+        raise PaymentFailed("Le paiement n'a pas pu être confirmé ; la commande sera vérifiée sous peu.") from e
+    if not confirm(saga, charge_id):
+        raise PaymentFailed("La commande a été annulée avant la confirmation du paiement.")
+
+
+def _charge_card(saga, return_url):
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    order = saga.order
+    customer_id = stripe_customer_id(order.user)
+    stripe.PaymentMethod.attach(saga.payment_token, customer=customer_id)
+    intent = stripe.PaymentIntent.create(
+        amount=int(order.total * 100),
+        currency='eur',
+        customer=customer_id,
+        payment_method=saga.payment_token,
+        confirmation_method='manual',
+        confirm=True,
+        return_url=return_url,
+        # Retrouvable par le balayeur même si la réponse est perdue
+        metadata={'order_id': order.id},
+        idempotency_key=f'checkout-saga-{saga.id}',
+    )
+    CheckoutSaga.objects.filter(id=saga.id).update(intent_id=intent.id, updated_at=timezone.now())
+    if intent.status != 'succeeded':
+        _cancel_intent(intent)
+        raise PaymentFailed(f"Paiement non finalisé (statut : {intent.status}).")
+    return _intent_charge_id(intent)
+
+
+def _intent_charge_id(intent):
+    charge_id = getattr(intent, 'latest_charge', None)
+    if not charge_id:
+        charges = stripe.Charge.list(payment_intent=intent.id, limit=1)
+        if not charges.data:
+            raise PaymentUnresolved(f"Aucune charge associée au PaymentIntent {intent.id}")
+        charge_id = charges.data[0].id
+    return charge_id
+
+
+def _cancel_intent(intent):
+    """Annule un PaymentIntent inabouti pour qu'il ne puisse plus aboutir après la compensation."""
+    if intent.status in ('requires_payment_method', 'requires_confirmation', 'requires_action', 'requires_capture'):
+        try:
+            stripe.PaymentIntent.cancel(intent.id)
+        except stripe.error.StripeError as e:
+            logger.warning(f"Annulation du PaymentIntent {intent.id} impossible : {str(e)}")
+
+
+def _approved_paypal_sale(saga):
+    payment = paypalrestsdk.Payment.find(saga.payment_token)
+    if payment.state != 'approved':
+        raise PaymentFailed("Le paiement PayPal n’a pas été approuvé.")
+    return payment.transactions[0].related_resources[0].sale.id
+
+
+def _lock_open(saga_id):
+    """Saga verrouillée, ou None si elle est déjà terminée (requête concurrente ou balayeur)."""
+    saga = CheckoutSaga.objects.select_for_update().select_related('order__user').get(id=saga_id)
+    return saga if saga.state in CheckoutSaga.OPEN_STATES else None
+
+
+def confirm(saga, charge_id):
+    """Étape 3 (succès) : commande 'processing', points de fidélité et notification du vendeur."""
+    with transaction.atomic():
+        saga = _lock_open(saga.id)
+        if saga is None:
+            logger.error(f"Paiement {charge_id} reçu pour une saga déjà terminée : à rembourser")
+            return False
+        order = saga.order
+        order.charge_id = charge_id
+        order.status = 'processing'
+        order.save(update_fields=['charge_id', 'status', 'updated_at'])
+        saga.state = 'confirmed'
+        saga.error = ''
+        saga.save(update_fields=['state', 'error', 'updated_at'])
+        _reward(order)
+    logger.info(f"Paiement confirmé pour la commande #{order.id}, charge_id: {charge_id}")
+    return True
+
+
+def _reward(order):
+    from marketing.models import LoyaltyPoint
+
+    points = int(order.total // 10)
+    if points > 0:
+        LoyaltyPoint.objects.create(user=order.user, points=points, description=f"Points pour commande #{order.id}")
+        logger.info(f"{points} points de fidélité attribués à {order.user.username}")
+    if order.seller_id:
+        Notification.objects.create(
+            user_id=order.seller_id,
+            message=f"Une nouvelle commande (#{order.id}) contient votre produit.",
+            notification_type='new_order',
+            related_object_id=order.id
+        )
+    else:
+        logger.warning(f"Aucun seller principal défini pour la commande #{order.id}")
+
+
+def compensate(saga, reason):
+    """Étape 3 (échec) : stock restitué et commande annulée."""
+    with transaction.atomic():
+        saga = _lock_open(saga.id)
+        if saga is None:
+            return False
+        order = saga.order
+        quantities = Counter()
+        for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+            quantities[product_id] += quantity
+        restock(quantities)
+        order.charge_id = None
+        order.status = 'cancelled'
+        order.save(update_fields=['charge_id', 'status', 'updated_at'])
+        saga.state = 'compensated'
+        saga.error = reason
+        saga.save(update_fields=['state', 'error', 'updated_at'])
+    logger.info(f"Paiement échoué pour la commande #{order.id}, stock restitué : {reason}")
+    return True
+
+
+def _lookup_charge(saga):
+    """id de la charge si le client a payé, None sinon ; PaymentUnresolved si on ne peut pas conclure."""
+    if saga.payment_method == 'paypal':
+        try:
+            return _approved_paypal_sale(saga)
+        except (PaymentFailed, paypalrestsdk.exceptions.ResourceNotFound):
+            return None
+    if saga.payment_method != 'card':
+        return None
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    if saga.intent_id:
+        intent = stripe.PaymentIntent.retrieve(saga.intent_id)
+    else:
+        found = stripe.PaymentIntent.search(query=f"metadata['order_id']:'{saga.order_id}'", limit=1)
+        if not found.data:
+            return None
+        intent = found.data[0]
+    if intent.status == 'succeeded':
+        return _intent_charge_id(intent)
+    if intent.status == 'processing':
+        raise PaymentUnresolved(f"PaymentIntent {intent.id} encore en cours de traitement")
+    _cancel_intent(intent)
+    return None
+
+
+def recover_stale_sagas(now=None):
+    """
+    Termine les sagas ouvertes depuis plus de CHECKOUT_SAGA_TIMEOUT secondes.
+    Retourne (confirmées, compensées, laissées ouvertes).
+    """
+    cutoff = (now or timezone.now()) - saga_timeout()
+    confirmed = compensated = unresolved = 0
+    for saga in CheckoutSaga.objects.filter(state__in=CheckoutSaga.OPEN_STATES, updated_at__lte=cutoff).order_by('id'):
+        if saga.state == 'started':
+            # Le prestataire n'a jamais été appelé
+            compensated += compensate(saga, "Paiement jamais lancé")
+            continue
+        try:
+            charge_id = _lookup_charge(saga)
+        except Exception as e:
+            logger.error(f"Saga de la commande #{saga.order_id} non résolue : {str(e)}")
+            unresolved += 1
+            continue
+        if charge_id:
+            confirmed += confirm(saga, charge_id)
+        else:
+            compensated += compensate(saga, "Aucun paiement abouti chez le prestataire")
+    return confirmed, compensated, unresolved
@@ -0,0 +1,113 @@
+"""
+Lecture des coordonnées GPS EXIF d'une photo JPEG sans décoder l'image.
+
+Seuls les segments d'en-tête sont parcourus, jusqu'au segment APP1 « Exif »
+(ou au début des données d'image) ; le reste du fichier n'est jamais lu.
+Ce module n'importe pas Django : il est exécuté dans les processus du pool
+de store.media_jobs.
+"""
+import io
+import os
+import struct
+
+# Taille en octets de chaque type de valeur TIFF
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+GPS_IFD_POINTER = 0x8825
+GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+
+NO_GPS = (None, None)
+
+
+def read_exif_gps(source):
+    """
+    (latitude, longitude) en degrés décimaux, ou (None, None) si la photo n'en
+    contient pas. source : chemin, octets (début du fichier) ou fichier ouvert.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return _scan_jpeg(io.BytesIO(source))
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as stream:
+            return _scan_jpeg(stream)
+    return _scan_jpeg(source)
+
+
+def _scan_jpeg(stream):
+    try:
+        if stream.read(2) != b'\xff\xd8':
+            return NO_GPS
+        while True:
+            marker = stream.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return NO_GPS
+            while marker[1] == 0xFF:
+                # Octets de remplissage entre segments
+                marker = marker[1:] + stream.read(1)
+            code = marker[1]
+            if code in (0xD9, 0xDA):
+                # Fin d'image ou début des données compressées : pas d'EXIF
+                return NO_GPS
+            if code == 0x01 or 0xD0 <= code <= 0xD7:
+                continue
+            length, = struct.unpack('>H', stream.read(2))
+            if code == 0xE1:
+                payload = stream.read(length - 2)
+                if payload.startswith(b'Exif\x00\x00'):
+                    return _gps_from_tiff(payload[6:])
+            else:
+                stream.seek(length - 2, io.SEEK_CUR)
+    except (struct.error, ValueError, OSError):
+        return NO_GPS
+
+
+def _read_ifd(data, offset, order):
+    """{tag: (type, nombre, octets de la valeur)} pour l'IFD à l'offset donné."""
+    count, = struct.unpack_from(order + 'H', data, offset)
+    entries = {}
+    for index in range(count):
+        tag, kind, number, raw = struct.unpack_from(order + 'HHI4s', data, offset + 2 + 12 * index)
+        size = TIFF_TYPE_SIZES.get(kind, 1) * number
+        if size > 4:
+            start, = struct.unpack(order + 'I', raw)
+            raw = data[start:start + size]
+            if len(raw) < size:
+                continue
+        entries[tag] = (kind, number, raw[:size])
+    return entries
+
+
+def _degrees(entry, order):
+    """Degrés, minutes, secondes (3 rationnels) → degrés décimaux."""
+    if entry is None or entry[0] != 5 or entry[1] < 3:
+        return None
+    values = struct.unpack(order + 'II' * 3, entry[2][:24])
+    parts = []
+    for numerator, denominator in zip(values[::2], values[1::2]):
+        if denominator == 0:
+            return None
+        parts.append(numerator / denominator)
+    return parts[0] + parts[1] / 60 + parts[2] / 3600
+
+
+def _reference(entry):
+    return entry[2][:1].decode('ascii', 'ignore').upper() if entry else ''
+
+
+def _gps_from_tiff(data):
+    order = {b'II': '<', b'MM': '>'}.get(bytes(data[:2]))
+    if order is None or struct.unpack_from(order + 'H', data, 2)[0] != 42:
+        return NO_GPS
+    ifd0 = _read_ifd(data, struct.unpack_from(order + 'I', data, 4)[0], order)
+    if GPS_IFD_POINTER not in ifd0:
+        return NO_GPS
+    gps = _read_ifd(data, struct.unpack(order + 'I', ifd0[GPS_IFD_POINTER][2][:4])[0], order)
+    latitude = _degrees(gps.get(GPS_LATITUDE), order)
+    longitude = _degrees(gps.get(GPS_LONGITUDE), order)
+    if latitude is None or longitude is None:
+        return NO_GPS
+    if _reference(gps.get(GPS_LATITUDE_REF)) == 'S':
+        latitude = -latitude
+    if _reference(gps.get(GPS_LONGITUDE_REF)) == 'W':
+        longitude = -longitude
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return NO_GPS
+    return latitude, longitude
@@ -0,0 +1,156 @@
+"""
+Compteurs de facettes (taille, marque, couleur, matériau) par catégorie.
+
+L'index vit en mémoire du processus : il est construit en une requête au
+premier usage puis mis à jour produit par produit à chaque changement de
+visibilité (stock, modération) ou d'attributs. Une reconstruction périodique
+(FACET_INDEX_TTL) rattrape les écritures faites par d'autres processus.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product
+from .visibility import LISTING_FIELDS, listing_changed
+
+logger = logging.getLogger(__name__)
+
+FACET_FIELDS = ('size', 'brand', 'color', 'material')
+ALL_CATEGORIES = '*'
+
+
+def facet_key(value):
+    """Clé de regroupement d'une valeur libre : « Coton » et « coton » ne font qu'un."""
+    if not value or not value.strip():
+        return None
+    return sys.intern(value.strip().casefold())
+
+
+class FacetIndex:
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._reset()
+
+    def _reset(self):
+        # catégorie -> facette -> Counter(clé -> nombre de produits)
+        self._counts = {}
+        # facette -> clé -> libellé affiché (première orthographe rencontrée)
+        self._labels = {facet: {} for facet in FACET_FIELDS}
+        # produit -> (catégorie, clés) : permet de retirer l'ancienne contribution
+        self._contributions = {}
+
+    def _apply(self, category_id, keys, delta):
+        for bucket in (category_id, ALL_CATEGORIES):
+            facets = self._counts.setdefault(bucket, {facet: Counter() for facet in FACET_FIELDS})
+            for facet, key in zip(FACET_FIELDS, keys):
+                if key is None:
+                    continue
+                counter = facets[facet]
+                counter[key] += delta
+                if counter[key] <= 0:
+                    del counter[key]
+
+    def _set_product(self, product_id, row):
+        previous = self._contributions.pop(product_id, None)
+        if previous:
+            self._apply(previous[0], previous[1], -1)
+        if row is None:
+            return
+        category_id, values = row[0], row[1:]
+        keys = tuple(facet_key(value) for value in values)
+        for facet, key, value in zip(FACET_FIELDS, keys, values):
+            if key is not None:
+                self._labels[facet].setdefault(key, value.strip())
+        self._contributions[product_id] = (category_id, keys)
+        self._apply(category_id, keys, 1)
+
+    def _listed_rows(self, product_ids=None):
+        queryset = Product.objects.filter(is_listed=True)
+        if product_ids is not None:
+            queryset = queryset.filter(id__in=product_ids)
+        return queryset.values_list('id', 'category_id', *FACET_FIELDS)
+
+    def rebuild(self):
+        rows = list(self._listed_rows().iterator(chunk_size=2000))
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._set_product(row[0], row[1:])
+            self._built_at = time.monotonic()
+        logger.info(f"Index de facettes reconstruit : {len(rows)} produits")
+
+    def update(self, product_ids=None):
+        """Recharge la contribution des produits donnés (ou de tout le catalogue)."""
+        if self._built_at is None:
+            return  # Rien à maintenir tant que l'index n'a pas servi
+        if product_ids is None:
+            self.rebuild()
+            return
+        product_ids = list(product_ids)
+        rows = {row[0]: row[1:] for row in self._listed_rows(product_ids)}
+        with self._lock:
+            for product_id in product_ids:
+                self._set_product(product_id, rows.get(product_id))
+
+    def remove(self, product_id):
+        with self._lock:
+            self._set_product(product_id, None)
+
+    def _ensure_fresh(self):
+        expired = self.ttl and self._built_at is not None and time.monotonic() - self._built_at > self.ttl
+        if self._built_at is None or expired:
+            self.rebuild()
+
+    def counts(self, category_id=None):
+        """Retourne {facette: {clé: nombre}} pour une catégorie (ou tout le catalogue)."""
+        self._ensure_fresh()
+        bucket = ALL_CATEGORIES if category_id is None else category_id
+        with self._lock:
+            facets = self._counts.get(bucket, {})
+            return {facet: dict(facets.get(facet, {})) for facet in FACET_FIELDS}
+
+    def options(self, category_id=None, limit=50):
+        """
+        Options prêtes pour le template : {facette: [(valeur, libellé, nombre), ...]}.
+        Les tailles suivent Product.SIZE_CHOICES et gardent les valeurs à 0 (à désactiver).
+        """
+        counts = self.counts(category_id)
+        sizes = counts['size']
+        options = {
+            'size': [(value, label, sizes.get(facet_key(value), 0)) for value, label in Product.SIZE_CHOICES if value],
+        }
+        for facet in ('brand', 'color', 'material'):
+            labels = self._labels[facet]
+            ranked = sorted(counts[facet].items(), key=lambda item: (-item[1], item[0]))[:limit]
+            options[facet] = [(labels.get(key, key), labels.get(key, key), count) for key, count in ranked]
+        return options
+
+
+facet_index = FacetIndex(ttl=getattr(settings, 'FACET_INDEX_TTL', 300))
+
+
+@receiver(listing_changed)
+def update_facets_on_listing_change(sender, product_ids=None, **kwargs):
+    facet_index.update(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def update_facets_on_attribute_change(sender, instance, update_fields=None, **kwargs):
+    # Une sauvegarde touchant le stock passe déjà par listing_changed (store.visibility)
+    if update_fields is None or LISTING_FIELDS.intersection(update_fields):
+        return
+    if set(update_fields) & {'category', 'category_id', *FACET_FIELDS}:
+        facet_index.update([instance.id])
+
+
+@receiver(post_delete, sender=Product)
+def remove_deleted_product_facets(sender, instance, **kwargs):
+    facet_index.remove(instance.id)
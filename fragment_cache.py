@@ -0,0 +1,139 @@
+"""
+Cache de fragments pour product_detail (avis, prix, produits similaires,
+recommandés, populaires, compteur de favoris).
+
+Chaque fragment déclare des étiquettes de dépendance (ex. 'reviews:12') ;
+la clé du fragment contient la version courante de chacune, si bien
+qu'invalider une étiquette revient à incrémenter sa version : les fragments
+concernés ne sont plus jamais lus et expirent d'eux-mêmes.
+
+Le stockage est un cache Django (FRAGMENT_CACHE_ALIAS, 'default' par défaut) :
+LocMemCache, FileBasedCache ou RedisCache selon CACHES ; DummyCache désactive
+le cache de fragments.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Discount, Favorite, Product, Review
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class FragmentCache:
+    def __init__(self, alias='default', timeout=300, prefix='fragment'):
+        self.alias = alias
+        self.timeout = timeout
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def _tag_key(self, tag):
+        return f'{self.prefix}:tag:{tag}'
+
+    def _versions(self, tags):
+        keys = [self._tag_key(tag) for tag in tags]
+        found = self.backend.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            # Version initiale horodatée : une étiquette évincée du cache ne retombe pas sur une ancienne version
+            initial = {key: time.time_ns() for key in missing}
+            self.backend.set_many(initial, timeout=None)
+            found.update(initial)
+        return [found[key] for key in keys]
+
+    def get_or_set(self, section, key, compute, tags=(), timeout=None):
+        """
+        Retourne le fragment `section` pour `key`, calculé par compute() en cas d'absence.
+        timeout peut être une fonction de la valeur calculée (durée en secondes ou None).
+        """
+        versions = self._versions(tags)
+        cache_key = ':'.join([self.prefix, section, str(key), *map(str, versions)])
+        value = self.backend.get(cache_key, MISSING)
+        if value is not MISSING:
+            with self._lock:
+                self.hits[section] += 1
+            return value
+        with self._lock:
+            self.misses[section] += 1
+        value = compute()
+        if callable(timeout):
+            timeout = timeout(value)
+        self.backend.set(cache_key, value, self.timeout if timeout is None else timeout)
+        return value
+
+    def timeout_until(self, moment):
+        """Durée de cache bornée par un instant (ex. fin de réduction), au plus self.timeout."""
+        if moment is None:
+            return self.timeout
+        return max(1, min(self.timeout, int((moment - timezone.now()).total_seconds()) + 1))
+
+    def invalidate(self, *tags):
+        """Périme les fragments dépendant des étiquettes données, après le commit en cours."""
+        transaction.on_commit(lambda: self._bump(tags))
+
+    def _bump(self, tags):
+        for tag in tags:
+            key = self._tag_key(tag)
+            try:
+                self.backend.incr(key)
+            except ValueError:
+                self.backend.set(key, time.time_ns(), timeout=None)
+
+    def stats(self):
+        """{section: (succès, échecs, taux de succès)} pour ce processus."""
+        with self._lock:
+            sections = set(self.hits) | set(self.misses)
+            return {
+                section: (
+                    self.hits[section],
+                    self.misses[section],
+                    self.hits[section] / (self.hits[section] + self.misses[section]),
+                )
+                for section in sorted(sections)
+            }
+
+
+fragment_cache = FragmentCache(
+    alias=getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default'),
+    timeout=getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 300),
+)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_reviews(sender, instance, **kwargs):
+    fragment_cache.invalidate(f'reviews:{instance.product_id}')
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def invalidate_discount_price(sender, instance, **kwargs):
+    fragment_cache.invalidate(f'price:{instance.product_id}')
+
+
+@receiver(post_save, sender=Product)
+def invalidate_product_price(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'price' in update_fields:
+        fragment_cache.invalidate(f'price:{instance.id}')
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def invalidate_favorites(sender, instance, **kwargs):
+    fragment_cache.invalidate(f'favorites:{instance.product_id}', f'favorites:user:{instance.user_id}')
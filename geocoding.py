@@ -0,0 +1,279 @@
+"""
+Géocodage inverse (coordonnées → adresse) pour checkout et la vue geocode.
+
+Les coordonnées sont arrondies à GEOCODE_PRECISION décimales (4 par défaut,
+une dizaine de mètres) ; chaque clé arrondie est servie, dans l'ordre, par :
+1. un cache LRU en mémoire (GEOCODE_LRU_SIZE entrées), qui ne garde pas
+   les réponses du gazetier servies en repli de Nominatim ;
+2. la table GeocodeCacheEntry (entrées de moins de GEOCODE_CACHE_DAYS jours) ;
+3. le backend : Nominatim via une session HTTP partagée (pool de connexions,
+   délais GEOCODE_TIMEOUT, nouvelles tentatives sur 429/5xx), ou un
+   gazetier local (GEOCODE_GAZETTEER_PATH) indexé par un k-d tree.
+
+Avec GEOCODE_BACKEND = 'gazetteer', aucun appel réseau n'est fait ; avec
+'nominatim' (défaut), le gazetier, s'il est configuré, sert de repli quand
+Nominatim ne répond pas. Seules les réponses de Nominatim sont persistées.
+Une erreur de géocodage (gazetier illisible, base indisponible…) ne fait
+jamais échouer la vue : reverse_geocode retourne None.
+
+Le gazetier est un CSV avec les colonnes latitude, longitude, city,
+postal_code, country (par exemple un export GeoNames des villes).
+"""
+import csv
+import logging
+import math
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import GeocodeCacheEntry
+
+logger = logging.getLogger(__name__)
+
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org/reverse'
+EARTH_RADIUS_KM = 6371.0
+
+
+class GeocodingError(Exception):
+    pass
+
+
+def coordinate_key(latitude, longitude):
+    """Clé 'lat,lon' arrondie ; + 0.0 évite une clé distincte pour -0.0."""
+    precision = getattr(settings, 'GEOCODE_PRECISION', 4)
+    return f'{round(latitude, precision) + 0.0:.{precision}f},{round(longitude, precision) + 0.0:.{precision}f}'
+
+
+# --- Nominatim ---
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """Session requests partagée : connexions HTTP réutilisées d'un appel à l'autre."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_maxsize=getattr(settings, 'GEOCODE_POOL_SIZE', 10),
+                max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(['GET'])),
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['User-Agent'] = getattr(settings, 'GEOCODE_USER_AGENT', 'EcommerceApp/1.0')
+            _session = session
+    return _session
+
+
+def _nominatim(latitude, longitude):
+    try:
+        response = http_session().get(
+            getattr(settings, 'GEOCODE_NOMINATIM_URL', NOMINATIM_URL),
+            params={
+                'lat': latitude,
+                'lon': longitude,
+                'format': 'json',
+                'addressdetails': 1
+            },
+            # (connexion, lecture) en secondes
+            timeout=getattr(settings, 'GEOCODE_TIMEOUT', (2, 5)),
+        )
+        response.raise_for_status()
+        address_data = response.json().get('address')
+    except (requests.RequestException, ValueError) as e:
+        raise GeocodingError(f"Nominatim indisponible : {e}") from e
+    if not address_data:
+        raise GeocodingError(f"Aucune adresse connue en {latitude}, {longitude}")
+    return {
+        'street_address': address_data.get('road', 'Inconnue'),
+        'city': address_data.get('city', '') or address_data.get('town', '') or address_data.get('village', ''),
+        'postal_code': address_data.get('postcode', ''),
+        'country': address_data.get('country', 'Inconnue')
+    }
+
+
+# --- Gazetier local ---
+
+def _unit_vector(latitude, longitude):
+    """Point sur la sphère unité : la distance euclidienne y croît avec la distance orthodromique."""
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+class KDTree:
+    """k-d tree sur des points 3D ; chaque nœud est (indice, axe, gauche, droite)."""
+
+    def __init__(self, points):
+        self.points = points
+        self.root = self._build(list(range(len(points))), 0)
+
+    def _build(self, indices, depth):
+        if not indices:
+            return None
+        axis = depth % 3
+        indices.sort(key=lambda index: self.points[index][axis])
+        middle = len(indices) // 2
+        return (
+            indices[middle],
+            axis,
+            self._build(indices[:middle], depth + 1),
+            self._build(indices[middle + 1:], depth + 1),
+        )
+
+    def nearest(self, target):
+        """(indice, distance euclidienne au carré) du point le plus proche, ou (None, inf) si l'arbre est vide."""
+        best = [None, math.inf]
+
+        def visit(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            point = self.points[index]
+            distance = sum((a - b) ** 2 for a, b in zip(point, target))
+            if distance < best[1]:
+                best[0], best[1] = index, distance
+            offset = target[axis] - point[axis]
+            near, far = (left, right) if offset < 0 else (right, left)
+            visit(near)
+            # L'autre côté n'est exploré que si le plan de coupe est plus proche que le meilleur point
+            if offset * offset < best[1]:
+                visit(far)
+
+        visit(self.root)
+        return best[0], best[1]
+
+
+class Gazetteer:
+    def __init__(self, places):
+        self.places = places
+        self.tree = KDTree([_unit_vector(place['latitude'], place['longitude']) for place in places])
+
+    @classmethod
+    def from_csv(cls, path):
+        places = []
+        with open(path, newline='', encoding='utf-8') as handle:
+            for row in csv.DictReader(handle):
+                places.append({
+                    'latitude': float(row['latitude']),
+                    'longitude': float(row['longitude']),
+                    'city': row.get('city', ''),
+                    'postal_code': row.get('postal_code', ''),
+                    'country': row.get('country', ''),
+                })
+        logger.info(f"Gazetier chargé : {len(places)} lieux depuis {path}")
+        return cls(places)
+
+    def nearest(self, latitude, longitude):
+        """(lieu le plus proche, distance en km), ou (None, inf) si le gazetier est vide."""
+        index, squared = self.tree.nearest(_unit_vector(latitude, longitude))
+        if index is None:
+            return None, math.inf
+        # Corde → angle au centre → distance à la surface
+        return self.places[index], 2 * math.asin(min(1.0, math.sqrt(squared) / 2)) * EARTH_RADIUS_KM
+
+    def reverse(self, latitude, longitude):
+        place, distance = self.nearest(latitude, longitude)
+        if place is None or distance > getattr(settings, 'GEOCODE_GAZETTEER_MAX_KM', 50):
+            raise GeocodingError(f"Aucun lieu du gazetier près de {latitude}, {longitude}")
+        return {
+            'street_address': 'Inconnue',
+            'city': place['city'],
+            'postal_code': place['postal_code'],
+            'country': place['country'] or 'Inconnue',
+        }
+
+
+_gazetteer_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _load_gazetteer(path):
+    return Gazetteer.from_csv(path)
+
+
+def gazetteer():
+    """Gazetier configuré (chargé une fois par processus), ou None."""
+    path = getattr(settings, 'GEOCODE_GAZETTEER_PATH', None)
+    if not path:
+        return None
+    with _gazetteer_lock:
+        return _load_gazetteer(path)
+
+
+# --- Résolution ---
+
+def _fetch(latitude, longitude):
+    """(adresse, source) depuis le backend configuré."""
+    local = gazetteer()
+    if getattr(settings, 'GEOCODE_BACKEND', 'nominatim') == 'gazetteer':
+        if local is None:
+            raise GeocodingError("GEOCODE_BACKEND = 'gazetteer' mais GEOCODE_GAZETTEER_PATH n'est pas défini")
+        return local.reverse(latitude, longitude), 'gazetteer'
+    try:
+        return _nominatim(latitude, longitude), 'nominatim'
+    except GeocodingError as e:
+        if local is None:
+            raise
+        logger.warning(f"{e} ; repli sur le gazetier")
+        return local.reverse(latitude, longitude), 'gazetteer'
+
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def _lookup(key):
+    """(adresse, définitive) d'une clé arrondie ; un repli sur le gazetier n'est pas définitif."""
+    fresh_after = timezone.now() - timedelta(days=getattr(settings, 'GEOCODE_CACHE_DAYS', 90))
+    entry = GeocodeCacheEntry.objects.filter(key=key, updated_at__gte=fresh_after).first()
+    if entry:
+        return entry.as_address(), True
+    latitude, longitude = map(float, key.split(','))
+    address, source = _fetch(latitude, longitude)
+    if source == 'nominatim':
+        GeocodeCacheEntry.objects.update_or_create(key=key, defaults={**address, 'source': source})
+    return address, source == 'nominatim' or getattr(settings, 'GEOCODE_BACKEND', 'nominatim') == 'gazetteer'
+
+
+def _resolve(key):
+    """Adresse d'une clé arrondie ; seules les réponses définitives restent en mémoire, les échecs jamais."""
+    with _memory_lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key]
+    address, final = _lookup(key)
+    if final:
+        with _memory_lock:
+            _memory[key] = address
+            while len(_memory) > getattr(settings, 'GEOCODE_LRU_SIZE', 4096):
+                _memory.popitem(last=False)
+    return address
+
+
+def reverse_geocode(latitude, longitude):
+    """Adresse {street_address, city, postal_code, country} la plus proche des coordonnées, ou None."""
+    try:
+        return dict(_resolve(coordinate_key(float(latitude), float(longitude))))
+    except GeocodingError as e:
+        logger.warning(f"Géocodage inverse impossible : {e}")
+    except (ValueError, KeyError, OSError, DatabaseError) as e:
+        # Coordonnées invalides, gazetier illisible ou mal formé, base indisponible
+        logger.error(f"Erreur de géocodage inverse pour {latitude}, {longitude} : {e}")
+    return None
+
+
+def clear_caches():
+    """Vide les caches en mémoire (tests, changement de gazetier)."""
+    with _memory_lock:
+        _memory.clear()
+    _load_gazetteer.cache_clear()
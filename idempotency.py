@@ -0,0 +1,72 @@
+"""
+Idempotence des requêtes rejouées : formulaire de paiement soumis deux fois,
+webhook Stripe renvoyé.
+
+Une requête est identifiée par une clé, fournie par le client (champ
+idempotency_key ou en-tête Idempotency-Key) ou dérivée de son contenu. La
+première exécution insère un IdempotencyRecord (index unique scope + clé) et
+y enregistre sa réponse ; un doublon se résume à la lecture de cette ligne.
+Les événements de webhook déjà traités sont gardés dans ProcessedWebhookEvent.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyRecord, ProcessedWebhookEvent
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(request, *parts):
+    """Clé propre à l'utilisateur : celle du client si fournie, sinon un hachage des parties données."""
+    client_key = request.POST.get('idempotency_key') or request.headers.get('Idempotency-Key')
+    material = [request.user.id, 'client', client_key] if client_key else [request.user.id, 'derived', *parts]
+    return hashlib.sha256('\x1f'.join(map(str, material)).encode()).hexdigest()
+
+
+def begin(scope, key, user):
+    """(enregistrement, True) à la première exécution, (enregistrement existant, False) pour un doublon."""
+    try:
+        with transaction.atomic():
+            return IdempotencyRecord.objects.create(scope=scope, key=key, user=user), True
+    except IntegrityError:
+        return IdempotencyRecord.objects.get(scope=scope, key=key), False
+
+
+def complete(record, location, order=None):
+    """Enregistre la réponse de la première exécution ; les doublons y seront redirigés."""
+    record.status = 'completed'
+    record.response_location = location
+    record.order = order
+    record.save(update_fields=['status', 'response_location', 'order'])
+
+
+def abandon(record):
+    """Libère la clé quand la requête n'a rien produit (formulaire invalide, paiement refusé) : elle pourra être rejouée."""
+    record.delete()
+
+
+def claim_webhook_event(event_id, event_type):
+    """
+    True si l'événement n'a jamais été traité. À appeler dans la transaction
+    du traitement : si celui-ci échoue, l'événement pourra être retraité.
+    """
+    _, created = ProcessedWebhookEvent.objects.get_or_create(event_id=event_id, defaults={'event_type': event_type})
+    return created
+
+
+def prune_idempotency(now=None):
+    """Supprime les clés de plus de IDEMPOTENCY_KEY_TTL secondes et les événements de plus de WEBHOOK_EVENT_RETENTION_DAYS jours."""
+    now = now or timezone.now()
+    records, _ = IdempotencyRecord.objects.filter(
+        created_at__lt=now - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+    ).delete()
+    events, _ = ProcessedWebhookEvent.objects.filter(
+        processed_at__lt=now - timedelta(days=getattr(settings, 'WEBHOOK_EVENT_RETENTION_DAYS', 30))
+    ).delete()
+    logger.info(f"Idempotence : {records} clés et {events} événements de webhook supprimés")
+    return records, events
@@ -0,0 +1,268 @@
+"""
+Dérivés des images téléversées : Product.image1..image3,
+SellerProfile.profile_picture et blog.Post.image.
+
+À l'enregistrement, chaque nouvel original reçoit un ImageAsset ; après le
+commit, le pool de store.media_jobs calcule une vignette carrée
+(IMAGE_THUMBNAIL_SIZE) et les largeurs IMAGE_DERIVATIVE_WIDTHS en JPEG, WebP
+et AVIF (store.imaging). Les fichiers sont enregistrés à côté de l'original
+sous un nom contenant le hachage du contenu (products/chaise.3f2a9c1b7d4e.640.webp) :
+ils ne changent jamais et peuvent être servis avec un cache longue durée.
+
+Un original au contenu identique (même hachage) à un original déjà traité
+est réutilisé : les champs d'image pointent vers lui, le doublon est
+supprimé et aucun dérivé n'est calculé.
+
+Avant le calcul des dérivés, le pool prend aussi l'empreinte perceptuelle
+(dHash 64 bits) de l'original. Elle ne sert qu'à la modération
+(duplicate_suspects) : deux photos différentes prises de la même façon
+peuvent avoir la même empreinte, un original n'est donc jamais remplacé ni
+supprimé sur cette seule base. L'empreinte est découpée en quatre blocs de
+16 bits indexés : deux empreintes à 3 bits ou moins d'écart ont au moins un
+bloc identique, ce qui rend la recherche exacte jusqu'à cette distance.
+
+Les gabarits les utilisent via {% load image_tags %} ; la commande
+backfill_image_derivatives traite les images déjà en place.
+"""
+import hashlib
+import logging
+import posixpath
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .imaging import fingerprint, render_derivatives
+from .media_jobs import run_in_pool
+from .models import ImageAsset, Product, SellerProfile
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FIELDS = {
+    'store.Product': ('image1', 'image2', 'image3'),
+    'store.SellerProfile': ('profile_picture',),
+    'blog.Post': ('image',),
+}
+
+
+def derivative_options():
+    return {
+        'widths': tuple(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (320, 640, 1024))),
+        'thumbnail': tuple(getattr(settings, 'IMAGE_THUMBNAIL_SIZE', (200, 200))),
+        'formats': tuple(getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', ('jpeg', 'webp', 'avif'))),
+        'quality': getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 80),
+    }
+
+
+def derived_name(source, digest, label, fmt):
+    directory, filename = posixpath.split(source)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, f"{stem}.{digest[:12]}.{label}.{'jpg' if fmt == 'jpeg' else fmt}")
+
+
+def _cache_key(source):
+    return f"image_asset:{hashlib.md5(source.encode()).hexdigest()}"
+
+
+def variants_for(source):
+    """Variantes prêtes de l'original {'thumb' | largeur: {...}}, ou None ; mises en cache jusqu'au prochain calcul."""
+    if not source:
+        return None
+    key = _cache_key(source)
+    variants = cache.get(key)
+    if variants is None:
+        variants = ImageAsset.objects.filter(source=source, status='ready').values_list('variants', flat=True).first() or {}
+        cache.set(key, variants, getattr(settings, 'IMAGE_ASSET_CACHE_TIMEOUT', 3600))
+    return variants or None
+
+
+def ensure_assets(sources):
+    """Crée les ImageAsset manquants pour ces originaux ; retourne les ids des assets à calculer."""
+    sources = {source for source in sources if source}
+    if not sources:
+        return []
+    missing = sources - set(ImageAsset.objects.filter(source__in=sources).values_list('source', flat=True))
+    if not missing:
+        return []
+    ImageAsset.objects.bulk_create([ImageAsset(source=source) for source in missing], ignore_conflicts=True)
+    return list(ImageAsset.objects.filter(source__in=missing, status='pending').values_list('id', flat=True))
+
+
+def hash_blocks(value):
+    """{'phash_0'..'phash_3': bloc de 16 bits} du dHash, du poids fort au poids faible."""
+    return {f'phash_{index}': (value >> (16 * (3 - index))) & 0xFFFF for index in range(4)}
+
+
+def hamming(first, second):
+    return bin(first ^ second).count('1')
+
+
+def _block_query(values):
+    """Q des assets partageant au moins un bloc avec l'une des empreintes données."""
+    query = Q()
+    for index in range(4):
+        field = f'phash_{index}'
+        query |= Q(**{f'{field}__in': {hash_blocks(value)[field] for value in values}})
+    return query
+
+
+def near_duplicates(value, max_distance):
+    """[(distance, asset)] des originaux dont le dHash est à au plus max_distance bits (exact jusqu'à 3)."""
+    found = [
+        (hamming(value, int(asset.perceptual_hash, 16)), asset)
+        for asset in ImageAsset.objects.filter(_block_query([value]))
+    ]
+    return sorted([item for item in found if item[0] <= max_distance], key=lambda item: (item[0], item[1].id))
+
+
+def process(asset_id):
+    """Lance le traitement de l'asset ; retourne un Future terminé avec lui, ou None s'il a été traité sur place."""
+    asset = ImageAsset.objects.get(id=asset_id)
+    options = derivative_options()
+    try:
+        with default_storage.open(asset.source, 'rb') as handle:
+            data = handle.read()
+    except OSError as e:
+        _failed(asset_id, e)
+        return None
+    # Le hachage couvre aussi les réglages : les changer produit de nouveaux noms
+    digest = hashlib.sha256(data)
+    digest.update(repr(sorted(options.items())).encode())
+    digest = digest.hexdigest()
+    twin = ImageAsset.objects.filter(content_hash=digest, status='ready', duplicate_of__isnull=True).exclude(id=asset_id).first()
+    if twin:
+        _reuse(asset, twin)
+        return None
+    return run_in_pool(
+        fingerprint,
+        data,
+        on_result=lambda result: _fingerprinted(asset, digest, data, options, result),
+        on_error=lambda error: _failed(asset_id, error),
+    )
+
+
+def _fingerprinted(asset, digest, data, options, result):
+    width, height, value = result
+    ImageAsset.objects.filter(id=asset.id).update(
+        content_hash=digest, perceptual_hash=f'{value:016x}', width=width, height=height, **hash_blocks(value)
+    )
+    return run_in_pool(
+        render_derivatives,
+        data,
+        options['widths'],
+        options['thumbnail'],
+        options['formats'],
+        options['quality'],
+        on_result=lambda rendered: _store(asset, digest, rendered),
+        on_error=lambda error: _failed(asset.id, error),
+    )
+
+
+def _reuse(asset, canonical):
+    """Fait pointer les champs d'image vers l'original de même contenu déjà traité et supprime le doublon."""
+    with transaction.atomic():
+        for label, fields in IMAGE_FIELDS.items():
+            model = apps.get_model(label)
+            for field in fields:
+                model.objects.filter(**{field: asset.source}).update(**{field: canonical.source})
+        ImageAsset.objects.filter(id=asset.id).update(
+            status='ready', duplicate_of=canonical, variants=canonical.variants, error='', updated_at=timezone.now()
+        )
+    cache.delete(_cache_key(asset.source))
+    if getattr(settings, 'IMAGE_DELETE_DUPLICATES', True):
+        default_storage.delete(asset.source)
+    logger.info(f"{asset.source} remplacé par {canonical.source} (doublon)")
+
+
+def _store(asset, digest, result):
+    width, height, rendered = result
+    variants = {}
+    for label, encoded in rendered.items():
+        entry = {'width': encoded.pop('width'), 'height': encoded.pop('height')}
+        for fmt, content in encoded.items():
+            name = derived_name(asset.source, digest, label, fmt)
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(content))
+            entry[fmt] = name
+        variants[label] = entry
+    ImageAsset.objects.filter(id=asset.id).update(
+        status='ready', width=width, height=height, variants=variants, error='', updated_at=timezone.now()
+    )
+    cache.delete(_cache_key(asset.source))
+    logger.info(f"Dérivés prêts pour {asset.source} : {len(variants)} tailles")
+
+
+def _failed(asset_id, error):
+    logger.error(f"Dérivés impossibles pour l'image {asset_id}: {error}")
+    ImageAsset.objects.filter(id=asset_id).update(status='failed', error=str(error), updated_at=timezone.now())
+
+
+def duplicate_suspects(products, max_distance=None):
+    """
+    {id produit: [(autre produit, distance)]} : produits dont une image est
+    identique ou proche (IMAGE_DUPLICATE_DISTANCE bits, 3 par défaut) d'une
+    image des produits donnés. Trois requêtes quel que soit le nombre de produits.
+    """
+    if max_distance is None:
+        max_distance = getattr(settings, 'IMAGE_DUPLICATE_DISTANCE', 3)
+    fields = IMAGE_FIELDS['store.Product']
+    sources = {product.id: {getattr(product, field).name for field in fields} - {None, ''} for product in products}
+    all_sources = set().union(*sources.values())
+    if not all_sources:
+        return {}
+
+    # Sources proches de chaque source (elle-même comprise : des produits peuvent partager un original réutilisé)
+    neighbours = {source: {source: 0} for source in all_sources}
+    hashes = {
+        source: int(value, 16)
+        for source, value in ImageAsset.objects.filter(source__in=all_sources).exclude(perceptual_hash='').values_list('source', 'perceptual_hash')
+    }
+    if hashes:
+        candidates = ImageAsset.objects.filter(_block_query(hashes.values())).values_list('source', 'perceptual_hash')
+        for other, other_value in candidates:
+            other_value = int(other_value, 16)
+            for source, value in hashes.items():
+                distance = hamming(value, other_value)
+                if distance <= max_distance:
+                    neighbours[source][other] = min(distance, neighbours[source].get(other, distance))
+
+    near = set().union(*(found.keys() for found in neighbours.values()))
+    query = Q()
+    for field in fields:
+        query |= Q(**{f'{field}__in': near})
+    by_source = defaultdict(list)
+    for other in Product.objects.filter(query).only('id', 'name', 'seller', *fields):
+        for field in fields:
+            by_source[getattr(other, field).name].append(other)
+
+    suspects = {}
+    for product_id, product_sources in sources.items():
+        matches = {}
+        for source in product_sources:
+            for other_source, distance in neighbours[source].items():
+                for other in by_source.get(other_source, ()):
+                    if other.id != product_id and distance < matches.get(other.id, (None, 65))[1]:
+                        matches[other.id] = (other, distance)
+        if matches:
+            suspects[product_id] = sorted(matches.values(), key=lambda item: (item[1], item[0].id))
+    return suspects
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=SellerProfile)
+@receiver(post_save, sender='blog.Post')
+def schedule_image_derivatives(sender, instance, update_fields=None, **kwargs):
+    fields = IMAGE_FIELDS[sender._meta.label]
+    if update_fields is not None and not set(fields).intersection(update_fields):
+        return
+    asset_ids = ensure_assets(getattr(instance, field).name for field in fields)
+    if asset_ids:
+        transaction.on_commit(lambda: [process(asset_id) for asset_id in asset_ids])
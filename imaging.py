@@ -0,0 +1,97 @@
+"""
+Calcul des dérivés d'une image : vignette carrée et largeurs fixes, encodées
+en JPEG, WebP et AVIF (si Pillow sait l'écrire) ; empreinte perceptuelle
+(dHash) pour repérer les doublons.
+
+Ce module n'importe pas Django : il est exécuté dans les processus du pool
+de store.media_jobs, et ne travaille que sur des octets.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+try:
+    import pillow_avif  # noqa: F401  (greffon AVIF pour Pillow < 11.3)
+except ImportError:
+    pass
+
+ENCODER_OPTIONS = {
+    'jpeg': {'optimize': True, 'progressive': True},
+    'webp': {'method': 4},
+    'avif': {'speed': 6},
+}
+
+# Orientations EXIF qui échangent largeur et hauteur
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def supported_formats(formats):
+    Image.init()
+    return [fmt for fmt in formats if fmt.upper() in Image.SAVE]
+
+
+def _oriented_size(image):
+    width, height = image.size
+    if image.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def dhash(image, size=8):
+    """
+    Empreinte de 64 bits : l'image réduite en 9x8 niveaux de gris, chaque bit
+    indique si un pixel est plus clair que son voisin de droite. Insensible
+    au redimensionnement et à la recompression.
+    """
+    pixels = image.convert('L').resize((size + 1, size), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            index = row * (size + 1) + column
+            value = (value << 1) | (pixels[index] > pixels[index + 1])
+    return value
+
+
+def fingerprint(data):
+    """(largeur, hauteur, dHash) de l'image ; un JPEG n'est décodé qu'au 1/8."""
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = _oriented_size(image)
+        image.draft('L', (64, 64))
+        return width, height, dhash(ImageOps.exif_transpose(image))
+
+
+def render_derivatives(data, widths=(320, 640, 1024), thumbnail=(200, 200), formats=('jpeg', 'webp', 'avif'), quality=80):
+    """
+    (largeur, hauteur, variantes) de l'image encodée dans data ; variantes :
+    {'thumb' | largeur: {'width', 'height', format: octets}}. Aucune largeur
+    n'est agrandie au-delà de l'original.
+    """
+    formats = supported_formats(formats)
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = _oriented_size(image)
+        targets = [target for target in widths if target < width] or [width]
+        # JPEG : décodage directement à l'échelle 1/2, 1/4 ou 1/8 suffisante
+        needed = max(max(targets), max(thumbnail))
+        image.draft('RGB', (needed, needed))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if image.mode in ('LA', 'PA') or 'transparency' in image.info else 'RGB')
+
+        variants = {'thumb': _encode(ImageOps.fit(image, thumbnail, Image.LANCZOS), formats, quality)}
+        for target in targets:
+            if target < image.width:
+                resized = image.resize((target, max(1, round(image.height * target / image.width))), Image.LANCZOS)
+            else:
+                resized = image
+            variants[str(target)] = _encode(resized, formats, quality)
+    return width, height, variants
+
+
+def _encode(image, formats, quality):
+    encoded = {'width': image.width, 'height': image.height}
+    for fmt in formats:
+        frame = image.convert('RGB') if fmt == 'jpeg' and image.mode != 'RGB' else image
+        buffer = io.BytesIO()
+        frame.save(buffer, format=fmt.upper(), quality=quality, **ENCODER_OPTIONS.get(fmt, {}))
+        encoded[fmt] = buffer.getvalue()
+    return encoded
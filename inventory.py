@@ -0,0 +1,193 @@
+"""
+Réservations de stock pendant le paiement.
+
+Le checkout réserve les quantités du panier pour STOCK_RESERVATION_TTL
+secondes ; Product.reserved_stock totalise les réservations en cours, si bien
+que available_stock, is_sold_out et is_listed en tiennent compte. process_payment
+convertit les réservations (décrément du stock), retirer un article du panier
+libère la sienne et le balayeur libère celles qui ont expiré.
+
+Les produits sont toujours verrouillés par ordre d'id croissant pour éviter
+les interblocages entre paniers qui se recoupent.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Product, StockReservation
+from .visibility import refresh_listing
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, available):
+        self.product = product
+        self.available = available
+        super().__init__(f"Stock insuffisant pour {product.name} : {available} unité(s) disponible(s)")
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 900))
+
+
+def _case(values):
+    return Case(*[When(id=product_id, then=Value(value)) for product_id, value in values.items()], default=Value(0), output_field=IntegerField())
+
+
+def _adjust_reserved(deltas):
+    """reserved_stock += delta pour chaque produit, en une seule UPDATE."""
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if deltas:
+        Product.objects.filter(id__in=deltas).update(reserved_stock=F('reserved_stock') + _case(deltas))
+
+
+def _lock_products(product_ids):
+    """{id: produit} verrouillés par ordre d'id croissant."""
+    return {product.id: product for product in Product.objects.select_for_update().filter(id__in=product_ids).order_by('id')}
+
+
+def _cart_quantities(lines):
+    quantities = Counter()
+    for line in lines:
+        quantities[line.product_id] += line.quantity
+    return quantities
+
+
+def _release_expired(products, now):
+    """Libère les réservations expirées des produits verrouillés et met à jour leur reserved_stock en mémoire."""
+    expired = Counter()
+    ids = []
+    for reservation in StockReservation.objects.filter(product_id__in=products, expires_at__lte=now):
+        expired[reservation.product_id] += reservation.quantity
+        ids.append(reservation.id)
+    if not ids:
+        return expired
+    _adjust_reserved({product_id: -quantity for product_id, quantity in expired.items()})
+    StockReservation.objects.filter(id__in=ids).delete()
+    for product_id, quantity in expired.items():
+        products[product_id].reserved_stock -= quantity
+    return expired
+
+
+def _check_available(lines, quantities, products, held):
+    for line in lines:
+        product = products.get(line.product_id)
+        quantity = quantities[line.product_id]
+        own = held[line.product_id].quantity if line.product_id in held else 0
+        available = product.stock - product.reserved_stock + own if product else 0
+        if product is None or product.is_sold or product.sold_out or quantity > available:
+            raise InsufficientStock(product or line.product, max(available, 0))
+
+
+def reserve_cart(user, lines, ttl=None):
+    """
+    Réserve les quantités des lignes du panier pour l'utilisateur (et remplace
+    ses réservations précédentes). Retourne l'instant d'expiration ;
+    lève InsufficientStock si une ligne dépasse le stock disponible.
+    """
+    quantities = _cart_quantities(lines)
+    now = timezone.now()
+    expires_at = now + (ttl or reservation_ttl())
+    with transaction.atomic():
+        held_ids = set(StockReservation.objects.filter(user=user).values_list('product_id', flat=True))
+        products = _lock_products(sorted(set(quantities) | held_ids))
+        _release_expired(products, now)
+        held = {reservation.product_id: reservation for reservation in StockReservation.objects.filter(user=user)}
+        _check_available(lines, quantities, products, held)
+
+        deltas = Counter({product_id: quantity for product_id, quantity in quantities.items()})
+        for product_id, reservation in held.items():
+            deltas[product_id] -= reservation.quantity
+        _adjust_reserved(deltas)
+
+        StockReservation.objects.filter(user=user).exclude(product_id__in=quantities).delete()
+        to_update = []
+        for product_id, reservation in held.items():
+            if product_id in quantities:
+                reservation.quantity, reservation.expires_at = quantities[product_id], expires_at
+                to_update.append(reservation)
+        StockReservation.objects.bulk_update(to_update, ['quantity', 'expires_at'])
+        StockReservation.objects.bulk_create([
+            StockReservation(user=user, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in quantities.items() if product_id not in held
+        ])
+    refresh_listing(products)
+    return expires_at
+
+
+def convert_reservations(user, lines):
+    """
+    Décrémente le stock des lignes du panier en consommant les réservations de
+    l'utilisateur ; une ligne sans réservation (expirée puis balayée) passe si
+    le stock disponible suffit, sinon InsufficientStock est levée.
+    """
+    quantities = _cart_quantities(lines)
+    now = timezone.now()
+    with transaction.atomic():
+        held_ids = set(StockReservation.objects.filter(user=user).values_list('product_id', flat=True))
+        products = _lock_products(sorted(set(quantities) | held_ids))
+        _release_expired(products, now)
+        held = {reservation.product_id: reservation for reservation in StockReservation.objects.filter(user=user)}
+        _check_available(lines, quantities, products, held)
+        released = {product_id: reservation.quantity for product_id, reservation in held.items()}
+        # Garde-fou dans la requête elle-même : stock >= quantité pour chaque produit
+        updated = Product.objects.filter(id__in=products, stock__gte=_case(quantities)).update(
+            stock=F('stock') - _case(quantities),
+            reserved_stock=F('reserved_stock') - _case(released),
+        )
+        if updated != len(products):
+            offender = min(products.values(), key=lambda product: product.stock - quantities[product.id])
+            raise InsufficientStock(offender, 0)
+        StockReservation.objects.filter(user=user).delete()
+    # update() ne passe pas par post_save : is_listed est recalculé ici
+    refresh_listing(products)
+
+
+def release_reservations(user, product_ids=None):
+    """
+    Libère les réservations de l'utilisateur (article retiré du panier), toutes
+    ou seulement celles des produits donnés ; retourne leur nombre.
+    """
+    reservations = StockReservation.objects.filter(user=user)
+    if product_ids is not None:
+        reservations = reservations.filter(product_id__in=product_ids)
+    with transaction.atomic():
+        held_ids = set(reservations.values_list('product_id', flat=True))
+        if not held_ids:
+            return 0
+        _lock_products(sorted(held_ids))
+        held = list(reservations)
+        _adjust_reserved(Counter({reservation.product_id: -reservation.quantity for reservation in held}))
+        StockReservation.objects.filter(id__in=[reservation.id for reservation in held]).delete()
+    refresh_listing(held_ids)
+    return len(held)
+
+
+def restock(quantities):
+    """Remet en stock {id produit: quantité} (commande annulée ou paiement échoué), en une UPDATE."""
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return
+    with transaction.atomic():
+        products = _lock_products(sorted(quantities))
+        Product.objects.filter(id__in=products).update(stock=F('stock') + _case(quantities))
+    refresh_listing(products)
+
+
+def sweep_expired_reservations(now=None):
+    """Libère les réservations expirées ; retourne le nombre d'unités libérées."""
+    now = now or timezone.now()
+    product_ids = sorted(set(StockReservation.objects.filter(expires_at__lte=now).values_list('product_id', flat=True)))
+    if not product_ids:
+        return 0
+    with transaction.atomic():
+        expired = _release_expired(_lock_products(product_ids), now)
+    refresh_listing(product_ids)
+    logger.info(f"Réservations expirées libérées pour {len(expired)} produits")
+    return sum(expired.values())
@@ -0,0 +1,42 @@
+from concurrent.futures import wait
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from store.images import IMAGE_FIELDS, ensure_assets, process
+from store.models import ImageAsset
+
+
+class Command(BaseCommand):
+    help = "Calcule les dérivés (vignettes, WebP/AVIF, tailles responsives) des images déjà téléversées."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help="Recalcule aussi les images en échec")
+        parser.add_argument('--refresh', action='store_true', help="Recalcule toutes les images (après un changement de réglages)")
+
+    def handle(self, *args, **options):
+        sources = set()
+        for label, fields in IMAGE_FIELDS.items():
+            model = apps.get_model(label)
+            for names in model.objects.values_list(*fields).iterator():
+                sources.update(name for name in names if name)
+        ensure_assets(sources)
+
+        if options['refresh']:
+            ImageAsset.objects.filter(source__in=sources).update(status='pending')
+        elif options['retry_failed']:
+            ImageAsset.objects.filter(source__in=sources, status='failed').update(status='pending')
+        # Images traitées avant l'empreinte perceptuelle : à repasser pour la déduplication
+        ImageAsset.objects.filter(source__in=sources, status='ready', perceptual_hash='', duplicate_of__isnull=True).update(status='pending')
+
+        futures = []
+        for asset_id in ImageAsset.objects.filter(source__in=sources, status='pending').values_list('id', flat=True):
+            future = process(asset_id)
+            if future is not None:
+                futures.append(future)
+        wait(futures)
+
+        counts = {status: ImageAsset.objects.filter(source__in=sources, status=status).count() for status in ('ready', 'pending', 'failed')}
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(sources)} images : {counts['ready']} prêtes, {counts['pending']} en attente, {counts['failed']} en échec."
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+from store.visibility import refresh_listing
+
+
+class Command(BaseCommand):
+    help = "Recalcule la colonne Product.is_listed pour tout le catalogue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Nombre de produits recalculés par UPDATE")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            refresh_listing(ids[start:start + batch_size])
+        listed = Product.objects.filter(is_listed=True).count()
+        self.stdout.write(self.style.SUCCESS(f"{len(ids)} produits recalculés, {listed} visibles dans le catalogue."))
@@ -0,0 +1,114 @@
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+
+from store.inventory import InsufficientStock
+from store.models import Cart, CartItem, Order, OrderItem, Product
+from store.orders import place_order
+from store.pricing import CartPricer
+
+
+def legacy_place_order(user, priced):
+    """Ancienne boucle de process_payment : un verrou, une création et une sauvegarde par ligne, dans l'ordre du panier."""
+    with transaction.atomic():
+        for line in priced.lines:
+            product = Product.objects.select_for_update().get(id=line.product_id)
+            if line.quantity > product.stock:
+                raise InsufficientStock(product, product.stock)
+        order = Order.objects.create(user=user, total=priced.total, status='pending', payment_method='card')
+        for line in priced.lines:
+            product = Product.objects.get(id=line.product_id)
+            OrderItem.objects.create(order=order, product=product, quantity=line.quantity, price=line.unit_price, seller=product.seller)
+            product.stock -= line.quantity
+            product.save()
+    return order
+
+
+def batch_place_order(user, priced):
+    return place_order(user, priced, status='pending', payment_method='card')
+
+
+PIPELINES = {
+    'batch': batch_place_order,
+    'legacy': legacy_place_order,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le débit de passage de commande à plusieurs niveaux de concurrence, "
+        "pour le pipeline en lot (store.orders) et l'ancienne boucle ligne à ligne. "
+        "À lancer sur une base de test PostgreSQL : SQLite sérialise les écritures."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help="Nombres de paiements simultanés")
+        parser.add_argument('--checkouts', type=int, default=20, help="Commandes passées par client simulé")
+        parser.add_argument('--items', type=int, default=10, help="Lignes par panier")
+        parser.add_argument('--products', type=int, default=50, help="Taille du catalogue partagé (plus il est petit, plus les paniers se recoupent)")
+        parser.add_argument('--pipeline', choices=['batch', 'legacy', 'both'], default='both')
+
+    def handle(self, *args, **options):
+        pipelines = ['batch', 'legacy'] if options['pipeline'] == 'both' else [options['pipeline']]
+        levels = options['concurrency']
+        prefix = f'bench_{uuid.uuid4().hex[:8]}'
+        seller, buyers, products = self._create_fixture(prefix, max(levels), options['products'], options['items'])
+        try:
+            for pipeline in pipelines:
+                for concurrency in levels:
+                    placed, failed, elapsed = self._run(PIPELINES[pipeline], buyers[:concurrency], options['checkouts'])
+                    self.stdout.write(
+                        f"{pipeline:<6} x{concurrency:>3} : {placed / elapsed:8.1f} commandes/s "
+                        f"({placed} passées, {failed} échecs, {elapsed:.2f} s)"
+                    )
+        finally:
+            Product.objects.filter(id__in=[product.id for product in products]).delete()
+            get_user_model().objects.filter(username__startswith=prefix).delete()
+        self.stdout.write(self.style.SUCCESS("Benchmark terminé, données de test supprimées."))
+
+    def _create_fixture(self, prefix, buyer_count, product_count, items):
+        User = get_user_model()
+        seller = User.objects.create_user(username=f'{prefix}_seller', email=f'{prefix}_seller@example.com', password=None, user_type='seller')
+        products = [
+            Product.objects.create(seller=seller, name=f'{prefix} {index}', description='Benchmark', price=Decimal('10.00'), stock=10 ** 6)
+            for index in range(product_count)
+        ]
+        buyers = []
+        for index in range(buyer_count):
+            buyer = User.objects.create_user(username=f'{prefix}_buyer{index}', email=f'{prefix}_buyer{index}@example.com', password=None, user_type='buyer')
+            cart = Cart.objects.create(user=buyer)
+            # Ordre aléatoire : l'ancienne boucle verrouille dans l'ordre du panier
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=1)
+                for product in random.sample(products, min(items, len(products)))
+            ])
+            buyers.append(buyer)
+        return seller, buyers, products
+
+    def _worker(self, place, buyer, checkouts):
+        placed = failed = 0
+        try:
+            cart = Cart.objects.get(user=buyer)
+            pricer = CartPricer(buyer)
+            for _ in range(checkouts):
+                try:
+                    place(buyer, pricer.price(cart))
+                    placed += 1
+                except (DatabaseError, InsufficientStock):
+                    failed += 1
+        finally:
+            connection.close()
+        return placed, failed
+
+    def _run(self, place, buyers, checkouts):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(buyers)) as executor:
+            results = list(executor.map(lambda buyer: self._worker(place, buyer, checkouts), buyers))
+        elapsed = time.perf_counter() - start
+        return sum(placed for placed, _ in results), sum(failed for _, failed in results), elapsed
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.similarity import compute_similar_products
+
+
+class Command(BaseCommand):
+    help = "Recalcule les produits similaires des produits dont les attributs ont changé (ou de tout le catalogue avec --full)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Recalcule tous les produits (notes et popularité comprises)")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Nombre de produits scorés par bloc")
+
+    def handle(self, *args, **options):
+        processed = compute_similar_products(full=options['full'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Produits similaires recalculés pour {processed} produits."))
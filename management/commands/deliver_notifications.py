@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.notifications import resume_stale_fan_outs
+
+
+class Command(BaseCommand):
+    help = "Reprend les envois de notifications groupés interrompus (processus redémarré ou erreur sur un lot)."
+
+    def handle(self, *args, **options):
+        resumed = resume_stale_fan_outs()
+        self.stdout.write(self.style.SUCCESS(f"{resumed} envois repris."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.media_jobs import process_stale_jobs
+
+
+class Command(BaseCommand):
+    help = "Reprend les extractions GPS de photos restées en file (processus redémarré)."
+
+    def handle(self, *args, **options):
+        processed = process_stale_jobs()
+        self.stdout.write(self.style.SUCCESS(f"{processed} photos traitées."))
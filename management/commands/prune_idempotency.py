@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.idempotency import prune_idempotency
+
+
+class Command(BaseCommand):
+    help = "Supprime les clés d'idempotence et les événements de webhook expirés (à lancer chaque jour)."
+
+    def handle(self, *args, **options):
+        records, events = prune_idempotency()
+        self.stdout.write(self.style.SUCCESS(f"{records} clés et {events} événements de webhook supprimés."))
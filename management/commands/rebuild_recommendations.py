@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.recommendations import rebuild_recommendations
+
+
+class Command(BaseCommand):
+    help = "Reconstruit les recommandations par co-occurrence (complète, ou incrémentale avec --since-minutes)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since-minutes', type=int, default=None, help="Ne recalcule que les produits touchés par les utilisateurs actifs sur cette période")
+        parser.add_argument('--top-k', type=int, default=None, help="Nombre de voisins conservés par produit (RECOMMENDATIONS_TOP_K par défaut)")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since_minutes'] is not None:
+            since = timezone.now() - timedelta(minutes=options['since_minutes'])
+        processed = rebuild_recommendations(since=since, top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(f"Recommandations recalculées pour {processed} produits."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = "Reconstruit l'index de recherche plein texte des produits."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Nombre de produits indexés par lot")
+
+    def handle(self, *args, **options):
+        # Bases migrées avant l'ajout de l'index : la table est créée ici
+        search.ensure_index()
+        backend = search.get_backend()
+        indexed = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{indexed} produits indexés avec {backend.__class__.__name__}."
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.ratings import reconcile_ratings
+
+
+class Command(BaseCommand):
+    help = "Recalcule les notes dénormalisées des produits (avis) et des vendeurs (SellerRating) depuis les tables sources."
+
+    def handle(self, *args, **options):
+        products, sellers = reconcile_ratings()
+        self.stdout.write(self.style.SUCCESS(
+            f"Notes réconciliées : {products} produits et {sellers} vendeurs corrigés."
+        ))
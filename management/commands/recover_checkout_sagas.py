@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.checkout import recover_stale_sagas
+
+
+class Command(BaseCommand):
+    help = "Termine les paiements restés ouverts après l'arrêt d'un worker (à lancer toutes les quelques minutes)."
+
+    def handle(self, *args, **options):
+        confirmed, compensated, unresolved = recover_stale_sagas()
+        self.stdout.write(self.style.SUCCESS(
+            f"{confirmed} commandes confirmées, {compensated} compensées, {unresolved} encore indéterminées."
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.pricing import refresh_effective_prices
+
+
+class Command(BaseCommand):
+    help = "Recalcule Product.effective_price (prix après réduction active) pour tout le catalogue."
+
+    def handle(self, *args, **options):
+        updated = refresh_effective_prices()
+        self.stdout.write(self.style.SUCCESS(f"Prix effectif recalculé pour {updated} produits."))
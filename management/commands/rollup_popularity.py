@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from store.popularity import rebuild_popularity, rollup_popularity
+
+
+class Command(BaseCommand):
+    help = "Intègre les journées closes de ProductView au score de popularité des produits (à lancer chaque jour)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Recalcule tous les scores depuis ProductView")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            products = rebuild_popularity()
+            self.stdout.write(self.style.SUCCESS(f"Popularité reconstruite pour {products} produits."))
+            return
+        days = rollup_popularity()
+        self.stdout.write(self.style.SUCCESS(f"{days} journée(s) intégrée(s) au score de popularité."))
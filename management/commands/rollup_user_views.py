@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store.view_events import prune_daily_views, rollup_closed_days
+
+
+class Command(BaseCommand):
+    help = "Agrège les vues produit des journées closes par utilisateur/produit/jour et applique la rétention."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=None, help="Durée de conservation des agrégats (USER_VIEW_RETENTION_DAYS par défaut)")
+
+    def handle(self, *args, **options):
+        processed = rollup_closed_days()
+        deleted = prune_daily_views(options['retention_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{processed} vues agrégées, {deleted} agrégats expirés supprimés."
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from store.pricing import refresh_effective_prices, scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Lance le planificateur des bornes de réduction, qui tient Product.effective_price à jour. "
+        "Un seul processus par base ; activer ensuite EFFECTIVE_PRICE_SCHEDULER."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-sleep', type=int, default=60,
+            help="Attente maximale entre deux passages, en secondes (les réductions créées par les autres processus sont vues au passage suivant)",
+        )
+
+    def handle(self, *args, **options):
+        # Bornes franchies pendant que le planificateur était arrêté
+        updated = refresh_effective_prices()
+        self.stdout.write(f"Prix effectif recalculé pour {updated} produits, planificateur démarré.")
+        scheduler.max_sleep = options['max_sleep']
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            scheduler.stop()
+        self.stdout.write(self.style.SUCCESS("Planificateur arrêté."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.inventory import sweep_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Libère les réservations de stock expirées (à lancer chaque minute)."
+
+    def handle(self, *args, **options):
+        released = sweep_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f"{released} unités de stock libérées."))
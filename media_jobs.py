@@ -0,0 +1,151 @@
+"""
+Extraction en arrière-plan des coordonnées GPS des photos de livraison.
+
+La photo est enregistrée tout de suite avec sa Location et un PhotoGeotagJob
+est mis en file. Après le commit, un pool de processus (MEDIA_WORKERS, 2 par
+défaut) lit uniquement le segment EXIF de la photo (store.exif, l'image
+n'est pas décodée) et renseigne Location.latitude/longitude. La page de
+paiement suit le job via la vue photo_geotag_status.
+
+Les jobs restés en file au-delà de MEDIA_JOB_TIMEOUT secondes (processus
+redémarré) sont repris par la commande process_photo_geotags.
+
+Le même pool calcule les dérivés d'images (store.images) via run_in_pool.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .exif import read_exif_gps
+from .models import PhotoGeotagJob
+
+logger = logging.getLogger(__name__)
+
+# Le segment EXIF (APP1) fait au plus 64 Ko et suit immédiatement le début du fichier
+EXIF_HEAD_BYTES = 128 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    """Pool de processus partagé, créé au premier job ; 'spawn' évite de dupliquer les connexions du processus web."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'MEDIA_WORKERS', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    return _executor
+
+
+def enqueue_geotag(location):
+    """Met en file l'extraction GPS de la photo de la Location ; le job part après le commit."""
+    job = PhotoGeotagJob.objects.create(location=location, user=location.user)
+    transaction.on_commit(lambda: submit(job.id))
+    return job
+
+
+def _photo_source(photo):
+    """Chemin local de la photo, ou à défaut (stockage distant) les premiers octets du fichier."""
+    try:
+        return photo.path
+    except NotImplementedError:
+        with photo.open('rb') as handle:
+            return handle.read(EXIF_HEAD_BYTES)
+
+
+def run_in_pool(function, *args, on_result, on_error):
+    """
+    Exécute function(*args) dans le pool ; on_result(résultat) ou on_error(exception)
+    est appelé dans un thread du processus courant, qui ferme ensuite sa connexion.
+    Retourne un Future terminé une fois ce rappel exécuté ; si on_result retourne
+    lui-même un Future (étape suivante mise en file), après celui-ci.
+    """
+    submitter = threading.get_ident()
+    handled = Future()
+
+    def done(future):
+        follow = None
+        try:
+            try:
+                result = future.result()
+            except Exception as e:
+                on_error(e)
+            else:
+                follow = on_result(result)
+        finally:
+            # Pas dans le thread appelant si le résultat était déjà disponible
+            if threading.get_ident() != submitter:
+                connection.close()
+            if isinstance(follow, Future):
+                follow.add_done_callback(lambda _: handled.set_result(None))
+            else:
+                handled.set_result(None)
+
+    executor().submit(function, *args).add_done_callback(done)
+    return handled
+
+
+def submit(job_id):
+    job = PhotoGeotagJob.objects.select_related('location').get(id=job_id)
+    if not job.location.photo:
+        _finish(job_id, None, None)
+        return
+    PhotoGeotagJob.objects.filter(id=job_id).update(status='running', updated_at=timezone.now())
+    run_in_pool(
+        read_exif_gps,
+        _photo_source(job.location.photo),
+        on_result=lambda position: _finish(job_id, *position),
+        on_error=lambda error: _failed(job_id, error),
+    )
+
+
+def _failed(job_id, error):
+    logger.error(f"Extraction GPS échouée pour le job {job_id}: {error}")
+    _finish(job_id, None, None, error=str(error))
+
+
+def _finish(job_id, latitude, longitude, error=''):
+    with transaction.atomic():
+        job = PhotoGeotagJob.objects.select_for_update().select_related('location').get(id=job_id)
+        if job.status in PhotoGeotagJob.FINISHED:
+            return job
+        if error:
+            job.status = 'failed'
+        elif latitude is None or longitude is None:
+            job.status = 'no_gps'
+        else:
+            job.status = 'done'
+            job.latitude, job.longitude = latitude, longitude
+            # Comme avant : la position de la photo l'emporte sur celle saisie
+            location = job.location
+            location.latitude, location.longitude = latitude, longitude
+            location.save(update_fields=['latitude', 'longitude'])
+        job.error = error
+        job.save(update_fields=['status', 'latitude', 'longitude', 'error', 'updated_at'])
+    logger.info(f"Job de géolocalisation {job_id} terminé : {job.status}")
+    return job
+
+
+def process_stale_jobs(now=None):
+    """Traite sur place les jobs en file depuis plus de MEDIA_JOB_TIMEOUT secondes ; retourne leur nombre."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=getattr(settings, 'MEDIA_JOB_TIMEOUT', 300))
+    processed = 0
+    for job in PhotoGeotagJob.objects.filter(status__in=('queued', 'running'), updated_at__lte=cutoff).select_related('location'):
+        try:
+            photo = job.location.photo
+            latitude, longitude = read_exif_gps(_photo_source(photo)) if photo else (None, None)
+        except Exception as e:
+            _finish(job.id, None, None, error=str(e))
+        else:
+            _finish(job.id, latitude, longitude)
+        processed += 1
+    return processed
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Case, ExpressionWrapper, F, FloatField, OuterRef, Prefetch, Subquery, Value, When
 from django.conf import settings
 from django.utils import timezone
 from decimal import Decimal
@@ -16,6 +17,12 @@ class Category(models.Model):
         return self.name
 
 # === Modèle Discount ===
+class DiscountQuerySet(models.QuerySet):
+    def active(self, at=None):
+        """Réductions en vigueur à l'instant donné (maintenant par défaut)."""
+        at = at or timezone.now()
+        return self.filter(is_active=True, start_date__lte=at, end_date__gte=at)
+
 class Discount(models.Model):
     product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='discounts')
     percentage = models.DecimalField(
@@ -28,6 +35,8 @@ class Discount(models.Model):
     end_date = models.DateTimeField(help_text="Date de fin de la réduction")
     is_active = models.BooleanField(default=True, help_text="Indique si la réduction est active")
 
+    objects = DiscountQuerySet.as_manager()
+
     def clean(self):
         if self.start_date and self.end_date and self.start_date >= self.end_date:
             raise ValidationError("La date de fin doit être postérieure à la date de début.")
@@ -38,8 +47,79 @@ class Discount(models.Model):
     def __str__(self):
         return f"Réduction {self.percentage}% sur {self.product.name}"
 
+# === Colonnes dénormalisées maintenues hors de save() ===
+class MaintainedFieldsMixin:
+    """
+    Colonnes maintenues par des UPDATE atomiques (F(), select_for_update) :
+    une sauvegarde complète d'une instance chargée plus tôt ne les réécrit pas.
+    Pour les modifier via save(), les nommer dans update_fields.
+    """
+    maintained_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and field.name not in self.maintained_fields
+            ]
+        super().save(*args, **kwargs)
+
+# === Notes dénormalisées (Product et SellerProfile, maintenues par store.ratings) ===
+RATING_VALUES = range(1, 6)
+
+def empty_rating_histogram():
+    return {str(value): 0 for value in RATING_VALUES}
+
+class RatingAggregateMixin:
+    """Propriétés de lecture des colonnes rating_sum, rating_count et rating_histogram."""
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return 0
+        return round(self.rating_sum / self.rating_count, 1)
+
+    @property
+    def rating_distribution(self):
+        """[(note, nombre, pourcentage)] de 5 à 1 étoiles, pour les barres d'avis."""
+        histogram = {**empty_rating_histogram(), **(self.rating_histogram or {})}
+        return [
+            (value, histogram[str(value)], round(100 * histogram[str(value)] / self.rating_count) if self.rating_count else 0)
+            for value in reversed(RATING_VALUES)
+        ]
+
+def average_rating_expression():
+    """Moyenne des notes calculée depuis les colonnes dénormalisées (0 sans note)."""
+    return Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=ExpressionWrapper(F('rating_sum') * 1.0 / F('rating_count'), output_field=FloatField()),
+        output_field=FloatField(),
+    )
+
+# === QuerySet Product ===
+class ProductQuerySet(models.QuerySet):
+    def with_active_discount(self, at=None):
+        """
+        Annote la meilleure réduction active (best_discount_percentage, best_discount_end_date)
+        dans la requête des produits, au lieu d'une requête par produit et par propriété.
+        """
+        active = Discount.objects.active(at).filter(product=OuterRef('pk')).order_by('-percentage')
+        return self.annotate(
+            best_discount_percentage=Subquery(active.values('percentage')[:1]),
+            best_discount_end_date=Subquery(active.values('end_date')[:1]),
+        )
+
+    def with_rating(self):
+        """Annote avg_rating depuis rating_sum / rating_count, sans jointure sur les avis."""
+        return self.annotate(avg_rating=average_rating_expression())
+
+def prefetch_active_discount(lookup='product'):
+    """Prefetch d'une relation vers Product avec la réduction active annotée (ex. CartItem.product)."""
+    return Prefetch(lookup, queryset=Product.objects.with_active_discount())
+
 # === Modèle Product ===
-class Product(models.Model):
+class Product(MaintainedFieldsMixin, RatingAggregateMixin, models.Model):
     SIZE_CHOICES = [
         ('', 'Select Size'),
         ('XS', 'Extra Small'),
@@ -82,41 +162,57 @@ class Product(models.Model):
     brand = models.CharField(max_length=100, blank=True, null=True, help_text="Marque du produit")
     color = models.CharField(max_length=50, blank=True, null=True, help_text="Couleur du produit")
     material = models.CharField(max_length=100, blank=True, null=True, help_text="Matériau du produit")
+    reserved_stock = models.PositiveIntegerField(default=0, editable=False, help_text="Unités réservées par des paiements en cours (maintenu par store.inventory)")
+    is_listed = models.BooleanField(default=False, db_index=True, editable=False, help_text="Approuvé, en stock et ni vendu ni épuisé (maintenu par store.visibility)")
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, db_index=True, editable=False, help_text="Prix payé après la meilleure réduction active (maintenu par store.pricing)")
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_histogram = models.JSONField(default=empty_rating_histogram, editable=False, help_text="Nombre d'avis par note (maintenu par store.ratings)")
+    popularity_score = models.FloatField(default=0, db_index=True, editable=False, help_text="Vues récentes, fenêtre glissante ou décroissance (maintenu par store.popularity)")
+    similarity_dirty = models.BooleanField(default=True, db_index=True, editable=False, help_text="Voisins à recalculer (maintenu par store.similarity)")
+
+    objects = ProductQuerySet.as_manager()
+
+    maintained_fields = ('views', 'reserved_stock', 'rating_sum', 'rating_count', 'rating_histogram', 'popularity_score')
 
     def __str__(self):
         return self.name
 
+    def _active_discount(self):
+        """(pourcentage, date de fin) de la meilleure réduction active, lus depuis with_active_discount() si annoté."""
+        if 'best_discount_percentage' in self.__dict__:
+            return self.best_discount_percentage, self.best_discount_end_date
+        active_discount = self.discounts.active().order_by('-percentage').first()
+        if active_discount:
+            return active_discount.percentage, active_discount.end_date
+        return None, None
+
     @property
     def discounted_price(self):
-        current_time = timezone.now()
-        active_discount = self.discounts.filter(is_active=True, start_date__lte=current_time, end_date__gte=current_time).order_by('-percentage').first()
-        if active_discount:
-            discount_amount = self.price * (active_discount.percentage / Decimal('100'))
+        percentage, end_date = self._active_discount()
+        if percentage:
+            discount_amount = self.price * (percentage / Decimal('100'))
             return self.price - discount_amount
         return self.price
 
     @property
     def active_discount_percentage(self):
-        current_time = timezone.now()
-        active_discount = self.discounts.filter(is_active=True, start_date__lte=current_time, end_date__gte=current_time).order_by('-percentage').first()
-        return active_discount.percentage if active_discount else 0
+        percentage, end_date = self._active_discount()
+        return percentage if percentage is not None else 0
 
     @property
     def active_discount_end_date(self):
-        current_time = timezone.now()
-        active_discount = self.discounts.filter(is_active=True, start_date__lte=current_time, end_date__gte=current_time).order_by('-percentage').first()
-        return active_discount.end_date if active_discount else None
+        percentage, end_date = self._active_discount()
+        return end_date
 
     @property
-    def is_sold_out(self):
-        return self.stock == 0 or self.is_sold or self.sold_out
+    def available_stock(self):
+        """Stock non réservé par un paiement en cours."""
+        return max(self.stock - self.reserved_stock, 0)
 
     @property
-    def average_rating(self):
-        reviews = self.reviews.all()
-        if reviews.exists():
-            return round(sum(review.rating for review in reviews) / reviews.count(), 1)
-        return 0
+    def is_sold_out(self):
+        return self.available_stock == 0 or self.is_sold or self.sold_out
 
     class Meta:
         verbose_name = "Produit"
@@ -212,7 +308,7 @@ class OrderItem(models.Model):
         return f"{self.quantity} x {self.product.name} in Order {self.order.id}"
 
 # === Extension de SellerProfile ===
-class SellerProfile(models.Model):
+class SellerProfile(MaintainedFieldsMixin, RatingAggregateMixin, models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='seller_profile')
     first_name = models.CharField(max_length=100, blank=True, null=True)
     last_name = models.CharField(max_length=100, blank=True, null=True)
@@ -222,6 +318,11 @@ class SellerProfile(models.Model):
     contact_phone = models.CharField(max_length=20, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_histogram = models.JSONField(default=empty_rating_histogram, editable=False, help_text="Nombre de notes SellerRating par valeur (maintenu par store.ratings)")
+
+    maintained_fields = ('rating_sum', 'rating_count', 'rating_histogram')
 
     def __str__(self):
         return f"Profil de {self.user.username}"
@@ -343,14 +444,241 @@ class SellerRating(models.Model):
 class UserProductView(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='user_views')
-    view_date = models.DateTimeField(auto_now_add=True)
+    view_date = models.DateTimeField(default=timezone.now, db_index=True)
 
     class Meta:
-        unique_together = ('user', 'product', 'view_date')
+        indexes = [models.Index(fields=['user', 'product', 'view_date'])]
 
     def __str__(self):
         return f"{self.user} a vu {self.product}"
 
+# === Modèle UserProductViewDaily (agrégat journalier de UserProductView) ===
+class UserProductViewDaily(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_product_views')
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='daily_user_views')
+    day = models.DateField(db_index=True)
+    view_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'product', 'day')
+
+    def __str__(self):
+        return f"{self.user} a vu {self.product} {self.view_count} fois le {self.day}"
+
+# === Modèle StockReservation (réservations de stock pendant le paiement, store.inventory) ===
+class StockReservation(models.Model):
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='reservations')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stock_reservations')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'product')
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product} réservé(s) pour {self.user} jusqu'au {self.expires_at:%Y-%m-%d %H:%M}"
+
+# === Modèle PopularityRollup (journées de ProductView intégrées à Product.popularity_score) ===
+class PopularityRollup(models.Model):
+    day = models.DateField(unique=True)
+    mode = models.CharField(max_length=10, help_text="'window' ou 'decay' au moment de l'intégration")
+    products = models.PositiveIntegerField(default=0)
+    added = models.JSONField(null=True, blank=True, help_text="Vues ajoutées au score par produit (mode 'window'), retirées telles quelles à la sortie de la fenêtre")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-day']
+
+    def __str__(self):
+        return f"Popularité intégrée pour le {self.day} ({self.mode})"
+
+# === Modèle SimilarProduct (voisins précalculés par store.similarity) ===
+class SimilarProduct(models.Model):
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='similar_links')
+    neighbor = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='similar_of')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('product', 'rank')
+        ordering = ['product', 'rank']
+
+    def __str__(self):
+        return f"{self.neighbor} (n°{self.rank + 1}) similaire à {self.product}"
+
+# === Modèle ProductRecommendation (co-occurrences précalculées par store.recommendations) ===
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='recommendation_links')
+    neighbor = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='recommended_from')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField(help_text="Similarité cosinus des interactions (favoris, achats, vues)")
+
+    class Meta:
+        unique_together = ('product', 'rank')
+        indexes = [models.Index(fields=['neighbor', 'product'])]
+        ordering = ['product', 'rank']
+
+    def __str__(self):
+        return f"{self.neighbor} recommandé avec {self.product} ({self.score:.3f})"
+
+# === Modèle CheckoutSaga (état persistant du paiement d'une commande, store.checkout) ===
+class CheckoutSaga(models.Model):
+    STATE_CHOICES = [
+        ('started', 'Commande créée, stock décrémenté'),
+        ('charging', 'Appel au prestataire de paiement en cours'),
+        ('confirmed', 'Paiement confirmé'),
+        ('compensated', 'Paiement échoué, stock restitué'),
+    ]
+    OPEN_STATES = ('started', 'charging')
+
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='saga')
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='started')
+    payment_method = models.CharField(max_length=20, choices=Order.PAYMENT_METHODS)
+    payment_token = models.CharField(max_length=255, blank=True, help_text="PaymentMethod Stripe ou identifiant PayPal envoyé par le client")
+    intent_id = models.CharField(max_length=255, blank=True, help_text="PaymentIntent Stripe créé pour la commande")
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['state', 'updated_at'])]
+
+    def __str__(self):
+        return f"Paiement de la commande {self.order_id} : {self.get_state_display()}"
+
+# === Modèles IdempotencyRecord / ProcessedWebhookEvent (requêtes rejouées, store.idempotency) ===
+class IdempotencyRecord(models.Model):
+    STATUS_CHOICES = [
+        ('in_progress', 'En cours'),
+        ('completed', 'Terminée'),
+    ]
+
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=64)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_records')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_location = models.CharField(max_length=255, blank=True)
+    response_message = models.CharField(max_length=255, blank=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('scope', 'key')
+
+    def __str__(self):
+        return f"{self.scope} {self.key[:12]} ({self.get_status_display()})"
+
+class ProcessedWebhookEvent(models.Model):
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    processed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
+
+# === Modèle GeocodeCacheEntry (géocodage inverse persistant, store.geocoding) ===
+class GeocodeCacheEntry(models.Model):
+    key = models.CharField(max_length=40, unique=True, help_text="Coordonnées arrondies 'lat,lon'")
+    street_address = models.CharField(max_length=255, blank=True)
+    city = models.CharField(max_length=100, blank=True)
+    postal_code = models.CharField(max_length=20, blank=True)
+    country = models.CharField(max_length=100, blank=True)
+    source = models.CharField(max_length=20)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def as_address(self):
+        return {
+            'street_address': self.street_address,
+            'city': self.city,
+            'postal_code': self.postal_code,
+            'country': self.country,
+        }
+
+    def __str__(self):
+        return f"{self.key} → {self.city}, {self.country}"
+
+# === Modèle PhotoGeotagJob (extraction GPS des photos de livraison en arrière-plan, store.media_jobs) ===
+class PhotoGeotagJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'En file'),
+        ('running', 'En cours'),
+        ('done', 'Position extraite'),
+        ('no_gps', 'Aucune donnée GPS'),
+        ('failed', 'Échec'),
+    ]
+    FINISHED = ('done', 'no_gps', 'failed')
+
+    location = models.ForeignKey('delivery.Location', on_delete=models.CASCADE, related_name='geotag_jobs')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='geotag_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'updated_at'])]
+
+    def __str__(self):
+        return f"Géolocalisation de la photo {self.location_id} : {self.get_status_display()}"
+
+# === Modèle ImageAsset (dérivés d'une image téléversée, store.images) ===
+class ImageAsset(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('ready', 'Prêt'),
+        ('failed', 'Échec'),
+    ]
+
+    source = models.CharField(max_length=255, unique=True, help_text="Nom de l'original dans le stockage")
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # dHash 64 bits (hexadécimal) et ses quatre blocs de 16 bits, indexés pour la recherche par distance de Hamming
+    perceptual_hash = models.CharField(max_length=16, blank=True)
+    phash_0 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_1 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_2 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_3 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='duplicates', help_text="Original conservé à la place de celui-ci")
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    variants = models.JSONField(default=dict, blank=True, help_text="{'thumb' | largeur: {'width', 'height', format: nom du fichier}}")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} ({self.get_status_display()})"
+
+# === Modèle NotificationFanOut (envoi d'une notification à de nombreux utilisateurs, store.notifications) ===
+class NotificationFanOut(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminé'),
+        ('failed', 'Échec'),
+    ]
+    OPEN_STATES = ('pending', 'running')
+
+    message = models.TextField()
+    notification_type = models.CharField(max_length=50)
+    related_object_id = models.PositiveIntegerField(null=True, blank=True)
+    user_ids = models.JSONField(default=list, help_text="Destinataires, dans l'ordre d'envoi")
+    delivered = models.PositiveIntegerField(default=0, help_text="Destinataires déjà traités (reprise à partir de cet indice)")
+    attempts = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'updated_at'])]
+
+    def __str__(self):
+        return f"Notification '{self.notification_type}' : {self.delivered}/{len(self.user_ids)} ({self.get_status_display()})"
+
 # === Modèle Subscription ===
 class Subscription(models.Model):
     PLAN_CHOICES = [
@@ -0,0 +1,193 @@
+"""
+Envoi d'une même notification à de nombreux utilisateurs (favoris d'un
+produit en promotion, administrateurs, vendeurs d'une commande).
+
+Les Notification sont insérées par lots de NOTIFICATION_BATCH_SIZE (500 par
+défaut) avec bulk_create, et l'événement WebSocket 'send_notification' est
+poussé aux groupes user_<id> du NotificationConsumer, lot par lot, sous une
+seule boucle asyncio.
+
+Jusqu'à NOTIFICATION_ASYNC_THRESHOLD destinataires (200 par défaut), les
+lignes sont créées dans la transaction en cours ; au-delà, seul un
+NotificationFanOut est enregistré, et la création est faite après le commit
+par un thread d'arrière-plan (NOTIFICATION_WORKERS, 2 par défaut) pour ne
+pas retenir la requête. Chaque lot est validé avec l'avancement du job : un
+envoi interrompu (processus redémarré, erreur sur un lot) reprend au premier
+lot non traité avec la commande deliver_notifications, au plus
+NOTIFICATION_MAX_ATTEMPTS fois. Les événements WebSocket partent toujours
+après le commit, depuis le thread d'arrière-plan.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Notification, NotificationFanOut
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'NOTIFICATION_WORKERS', 2),
+                thread_name_prefix='notifications',
+            )
+    return _executor
+
+
+def batch_size():
+    return getattr(settings, 'NOTIFICATION_BATCH_SIZE', 500)
+
+
+def _chunks(values, size):
+    values = iter(values)
+    while chunk := list(islice(values, size)):
+        yield chunk
+
+
+def _user_ids(users):
+    """Identifiants distincts, dans l'ordre ; accepte des utilisateurs, des ids ou un values_list."""
+    return list(dict.fromkeys(getattr(user, 'pk', user) for user in users))
+
+
+def in_background(function, *args):
+    """Exécute function(*args) dans un thread du pool, qui ferme ensuite sa connexion."""
+    def run():
+        try:
+            function(*args)
+        except Exception as e:
+            logger.error(f"Envoi de notifications échoué : {e}")
+        finally:
+            connection.close()
+
+    return executor().submit(run)
+
+
+def notify_users(users, message, notification_type, related_object_id=None):
+    """
+    Notifie chacun des utilisateurs donnés (objets ou ids, doublons ignorés) ;
+    retourne le nombre de destinataires. À appeler dans la transaction qui
+    produit l'événement : rien ne part si elle est annulée.
+    """
+    user_ids = _user_ids(users)
+    if not user_ids:
+        return 0
+    if len(user_ids) > getattr(settings, 'NOTIFICATION_ASYNC_THRESHOLD', 200):
+        job = NotificationFanOut.objects.create(
+            message=message, notification_type=notification_type, related_object_id=related_object_id, user_ids=user_ids
+        )
+        transaction.on_commit(lambda: in_background(deliver_fan_out, job.id))
+        logger.info(f"Notification '{notification_type}' pour {len(user_ids)} utilisateurs mise en file (job {job.id})")
+        return len(user_ids)
+    create_notifications(user_ids, message, notification_type, related_object_id)
+    transaction.on_commit(lambda: in_background(push_notifications, user_ids, message, notification_type, related_object_id))
+    return len(user_ids)
+
+
+def create_notifications(user_ids, message, notification_type, related_object_id=None):
+    size = batch_size()
+    for chunk in _chunks(user_ids, size):
+        Notification.objects.bulk_create(
+            [
+                Notification(user_id=user_id, message=message, notification_type=notification_type, related_object_id=related_object_id)
+                for user_id in chunk
+            ],
+            batch_size=size,
+        )
+
+
+def _claim(job_id, stale_before=None):
+    """Passe le job à 'running' s'il attend (ou est bloqué depuis stale_before) ; None s'il est pris ailleurs."""
+    jobs = NotificationFanOut.objects.filter(id=job_id)
+    if stale_before is None:
+        jobs = jobs.filter(status='pending')
+    else:
+        jobs = jobs.filter(status__in=NotificationFanOut.OPEN_STATES, updated_at__lte=stale_before)
+    if not jobs.update(status='running', attempts=F('attempts') + 1, updated_at=timezone.now()):
+        return None
+    return NotificationFanOut.objects.get(id=job_id)
+
+
+def deliver_fan_out(job_id, stale_before=None):
+    """
+    Crée puis pousse les notifications du job lot par lot, à partir du premier
+    destinataire non traité ; retourne le statut du job, ou None s'il est pris ailleurs.
+    """
+    job = _claim(job_id, stale_before)
+    if job is None:
+        return None
+    User = get_user_model()
+    position = job.delivered
+    for chunk in _chunks(job.user_ids[position:], batch_size()):
+        try:
+            with transaction.atomic():
+                # Les comptes supprimés depuis la mise en file sont ignorés
+                recipients = list(User.objects.filter(id__in=chunk).values_list('id', flat=True))
+                create_notifications(recipients, job.message, job.notification_type, job.related_object_id)
+                NotificationFanOut.objects.filter(id=job.id).update(delivered=position + len(chunk), updated_at=timezone.now())
+        except Exception as e:
+            status = 'failed' if job.attempts >= getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 5) else 'pending'
+            NotificationFanOut.objects.filter(id=job.id).update(status=status, error=str(e), updated_at=timezone.now())
+            logger.error(f"Job de notification {job.id} interrompu à {position}/{len(job.user_ids)} ({status}) : {e}")
+            return status
+        position += len(chunk)
+        try:
+            push_notifications(recipients, job.message, job.notification_type, job.related_object_id)
+        except Exception as e:
+            # Les notifications sont enregistrées : seul le temps réel est perdu pour ce lot
+            logger.error(f"WebSocket '{job.notification_type}' indisponible pour le job {job.id} : {e}")
+    NotificationFanOut.objects.filter(id=job.id).update(status='done', error='', updated_at=timezone.now())
+    logger.info(f"Notification '{job.notification_type}' envoyée à {len(job.user_ids)} utilisateurs (job {job.id})")
+    return 'done'
+
+
+def resume_stale_fan_outs(now=None):
+    """Reprend sur place les jobs inactifs depuis NOTIFICATION_FANOUT_TIMEOUT secondes ; retourne leur nombre."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=getattr(settings, 'NOTIFICATION_FANOUT_TIMEOUT', 300))
+    stale = NotificationFanOut.objects.filter(status__in=NotificationFanOut.OPEN_STATES, updated_at__lte=cutoff)
+    resumed = 0
+    for job_id in stale.values_list('id', flat=True):
+        if deliver_fan_out(job_id, stale_before=cutoff) is not None:
+            resumed += 1
+    return resumed
+
+
+def push_notifications(user_ids, message, notification_type, related_object_id=None):
+    """Événement 'send_notification' vers les groupes user_<id> ; les erreurs du channel layer sont journalisées."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    event = {
+        'type': 'send_notification',
+        'message': message,
+        'notification_type': notification_type,
+        'related_object_id': related_object_id,
+    }
+
+    async def send_all():
+        for chunk in _chunks(user_ids, batch_size()):
+            results = await asyncio.gather(
+                *(channel_layer.group_send(f'user_{user_id}', event) for user_id in chunk),
+                return_exceptions=True,
+            )
+            failed = [result for result in results if isinstance(result, Exception)]
+            if failed:
+                logger.error(f"WebSocket '{notification_type}' : {len(failed)} envois sur {len(chunk)} échoués ({failed[0]})")
+
+    async_to_sync(send_all)()
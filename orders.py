@@ -0,0 +1,48 @@
+"""
+Création des commandes à partir d'un panier chiffré (PricedCart).
+
+La commande est passée en lot, dans une transaction courte :
+1. verrouillage de tous les produits en une requête, par id croissant, et
+   décrément du stock en une UPDATE ... CASE gardée par stock >= quantité
+   (store.inventory.convert_reservations) ;
+2. création de la commande ;
+3. bulk_create des OrderItem.
+"""
+import logging
+
+from django.db import transaction
+
+from .inventory import convert_reservations
+from .models import Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+
+def place_order(user, priced, **order_fields):
+    """
+    Crée la commande et ses lignes et décrémente le stock ; lève
+    InsufficientStock (sans rien écrire) si une ligne n'est plus disponible.
+    order_fields : shipping_address, shipping_option, payment_method, status...
+    """
+    lines = priced.lines
+    with transaction.atomic():
+        convert_reservations(user, lines)
+        order = Order.objects.create(
+            user=user,
+            # Vendeur principal : celui du premier produit (voir set_order_seller)
+            seller_id=lines[0].product.seller_id if lines else None,
+            total=priced.total,
+            **order_fields,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=line.product_id,
+                quantity=line.quantity,
+                price=line.unit_price,
+                seller_id=line.product.seller_id,
+            )
+            for line in lines
+        ])
+    logger.info(f"Commande créée pour l'utilisateur {user.username}: #{order.id}, {len(lines)} lignes, Total: {priced.total} €")
+    return order
@@ -0,0 +1,152 @@
+"""
+Pagination par curseur (keyset) : chaque page filtre sur la dernière clé vue
+au lieu d'un OFFSET, et ne fait jamais de COUNT(*).
+"""
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'store.pagination.cursor'
+
+
+class CursorPage:
+    """Page de résultats avec les jetons opaques des pages voisines."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class CursorPaginator:
+    """
+    Pagine un queryset trié sur un champ non nul (ex. 'price', '-created_at', 'id'),
+    la clé primaire servant à départager les égalités.
+    """
+
+    def __init__(self, queryset, per_page, ordering='id'):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = ordering
+        self.descending = ordering.startswith('-')
+        self.field_name = ordering.lstrip('-')
+        if self.field_name == 'pk':
+            self.field_name = 'id'
+        self.field = queryset.model._meta.get_field(self.field_name)
+
+    def _order_by(self, reverse=False):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        if self.field_name == 'id':
+            return [f'{prefix}id']
+        return [f'{prefix}{self.field_name}', f'{prefix}id']
+
+    def _after(self, value, pk, reverse=False):
+        """Condition « strictement après (value, pk) » dans le sens de parcours."""
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        if self.field_name == 'id':
+            return Q(**{f'id__{lookup}': pk})
+        return Q(**{f'{self.field_name}__{lookup}': value}) | Q(**{self.field_name: value, f'id__{lookup}': pk})
+
+    def encode_cursor(self, obj, direction):
+        value = getattr(obj, self.field.attname)
+        return signing.dumps({
+            'o': self.ordering,
+            'v': self.field.value_to_string(obj) if value is not None else None,
+            'pk': obj.pk,
+            'd': direction,
+        }, salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, cursor):
+        """Retourne (valeur, pk, direction) ou None si le jeton est invalide."""
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+        if not isinstance(data, dict) or data.get('o') != self.ordering or data.get('d') not in ('n', 'p'):
+            return None
+        return self.field.to_python(data['v']), data['pk'], data['d']
+
+    def get_page(self, cursor=None):
+        position = self.decode_cursor(cursor) if cursor else None
+        if position is None:
+            rows = list(self.queryset.order_by(*self._order_by())[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1], 'n') if has_more else None
+            return CursorPage(rows, next_cursor=next_cursor)
+
+        value, pk, direction = position
+        reverse = direction == 'p'
+        queryset = self.queryset.filter(self._after(value, pk, reverse=reverse))
+        rows = list(queryset.order_by(*self._order_by(reverse=reverse))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            next_cursor = self.encode_cursor(rows[-1], 'n') if rows else None
+            previous_cursor = self.encode_cursor(rows[0], 'p') if has_more else None
+        else:
+            next_cursor = self.encode_cursor(rows[-1], 'n') if has_more else None
+            previous_cursor = self.encode_cursor(rows[0], 'p') if rows else None
+        return CursorPage(rows, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+
+def cursor_context(page):
+    """Jetons des pages voisines, ajoutés au contexte à côté de page_obj (None hors pagination par curseur)."""
+    return {
+        'next_cursor': getattr(page, 'next_cursor', None),
+        'previous_cursor': getattr(page, 'previous_cursor', None),
+    }
+
+
+class CursorPaginationMixin:
+    """
+    Pagination par curseur d'une ListView, à côté de sa pagination habituelle :
+    elle s'applique quand la requête porte ?cursor= (vide pour la première
+    page). page_obj et object_list restent dans le contexte ; next_cursor et
+    previous_cursor s'y ajoutent.
+    """
+    cursor_paginate_by = 50
+    cursor_ordering = 'id'
+    cursor_param = 'cursor'
+
+    def get_cursor_ordering(self):
+        return self.cursor_ordering
+
+    def cursor_requested(self):
+        return self.cursor_param in self.request.GET
+
+    def get_paginate_by(self, queryset):
+        if self.cursor_requested():
+            return self.cursor_paginate_by
+        return super().get_paginate_by(queryset)
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.cursor_requested():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size, self.get_cursor_ordering())
+        page = paginator.get_page(self.request.GET.get(self.cursor_param))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(cursor_context(context.get('page_obj')))
+        return context
@@ -0,0 +1,43 @@
+"""
+Client Stripe de chaque utilisateur, mémorisé dans CustomUser.stripe_customer_id.
+
+Le premier paiement (ou abonnement) retrouve le client par e-mail ou le crée,
+puis son id est enregistré : les paiements suivants n'interrogent plus
+Stripe pour le retrouver.
+"""
+import logging
+
+import stripe
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+logger = logging.getLogger(__name__)
+
+
+def stripe_customer_id(user):
+    """Id du client Stripe de l'utilisateur, retrouvé ou créé au premier appel puis lu en base."""
+    if user.stripe_customer_id:
+        return user.stripe_customer_id
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    # Clients créés avant la mise en cache : même e-mail, moyens de paiement déjà enregistrés
+    customers = stripe.Customer.list(email=user.email, limit=1)
+    if customers.data:
+        customer_id = customers.data[0].id
+    else:
+        customer_id = stripe.Customer.create(
+            email=user.email,
+            metadata={'user_id': user.id},
+            idempotency_key=f'customer-user-{user.id}',
+        ).id
+    User = get_user_model()
+    if not User.objects.filter(id=user.id, stripe_customer_id__isnull=True).update(stripe_customer_id=customer_id):
+        # Une requête concurrente l'a déjà enregistré : on garde le sien
+        customer_id = User.objects.filter(id=user.id).values_list('stripe_customer_id', flat=True).get()
+    user.stripe_customer_id = customer_id
+    logger.info(f"Client Stripe {customer_id} associé à {user.username}")
+    return customer_id
+
+
+def forget_stripe_customer(customer_id):
+    """Oublie un client supprimé chez Stripe ; il sera recréé au prochain paiement."""
+    return get_user_model().objects.filter(stripe_customer_id=customer_id).update(stripe_customer_id=None)
@@ -0,0 +1,171 @@
+"""
+Score de popularité des produits (Product.popularity_score).
+
+Le score est maintenu par journée close de ProductView plutôt que recalculé à
+chaque requête :
+- mode 'window' (par défaut) : somme des vues des POPULARITY_WINDOW_DAYS
+  derniers jours ; chaque journée intégrée ajoute ses vues et retire celles
+  de la journée qui sort de la fenêtre, telles qu'elles avaient été ajoutées
+  (PopularityRollup.added) : les vues écrites après la clôture d'une journée
+  ne sont jamais comptées, et le score ne dérive pas ;
+- mode 'decay' (POPULARITY_HALF_LIFE_DAYS défini) : le score est multiplié
+  chaque jour par un facteur de demi-vie puis augmenté des vues du jour.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .fragment_cache import fragment_cache
+from .models import PopularityRollup, Product, ProductView
+
+logger = logging.getLogger(__name__)
+
+UPDATE_BATCH_SIZE = 500
+
+
+def window_days():
+    return getattr(settings, 'POPULARITY_WINDOW_DAYS', 30)
+
+
+def half_life_days():
+    return getattr(settings, 'POPULARITY_HALF_LIFE_DAYS', None)
+
+
+def current_mode():
+    return 'decay' if half_life_days() else 'window'
+
+
+def decay_factor():
+    return 0.5 ** (1 / half_life_days())
+
+
+def _day_bounds(first_day, last_day):
+    start = timezone.make_aware(datetime.combine(first_day, time.min))
+    end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min))
+    return start, end
+
+
+def _views_between(first_day, last_day):
+    """{produit: vues} sur les journées [first_day, last_day]."""
+    start, end = _day_bounds(first_day, last_day)
+    return Counter(dict(
+        ProductView.objects.filter(view_date__gte=start, view_date__lt=end)
+        .values('product_id').annotate(total=Sum('view_count')).values_list('product_id', 'total')
+    ))
+
+
+def _daily_views(first_day, last_day):
+    """(produit, jour, vues) sur les journées [first_day, last_day]."""
+    start, end = _day_bounds(first_day, last_day)
+    return (
+        ProductView.objects.filter(view_date__gte=start, view_date__lt=end)
+        .annotate(day=TruncDate('view_date'))
+        .values('product_id', 'day').annotate(total=Sum('view_count'))
+        .values_list('product_id', 'day', 'total')
+    )
+
+
+def _added_on(day):
+    """{produit: vues} ajoutées au score lors de l'intégration de la journée."""
+    rollup = PopularityRollup.objects.filter(day=day).first()
+    if rollup is None:
+        return Counter()
+    if rollup.added is None:
+        # Intégrée avant l'enregistrement des vues ajoutées : relue dans ProductView
+        return _views_between(day, day)
+    return Counter({int(product_id): views for product_id, views in rollup.added.items()})
+
+
+def _apply(scores, absolute=False):
+    """Ajoute (ou affecte) les scores donnés, une UPDATE ... CASE par lot de produits."""
+    items = [(product_id, float(score)) for product_id, score in scores.items() if score or absolute]
+    for start in range(0, len(items), UPDATE_BATCH_SIZE):
+        batch = items[start:start + UPDATE_BATCH_SIZE]
+        value = Case(*[When(id=product_id, then=Value(score)) for product_id, score in batch], output_field=FloatField())
+        Product.objects.filter(id__in=[product_id for product_id, _ in batch]).update(
+            popularity_score=value if absolute else F('popularity_score') + value
+        )
+    return len(items)
+
+
+def close_day(day):
+    """Intègre une journée close au score de popularité."""
+    mode = current_mode()
+    with transaction.atomic():
+        if mode == 'decay':
+            Product.objects.filter(popularity_score__gt=0).update(popularity_score=F('popularity_score') * decay_factor())
+            deltas = _views_between(day, day)
+            added = None
+        else:
+            added = _views_between(day, day)
+            deltas = Counter(added)
+            deltas.subtract(_added_on(day - timedelta(days=window_days())))
+        touched = _apply(deltas)
+        PopularityRollup.objects.create(day=day, mode=mode, products=touched, added=added)
+        fragment_cache.invalidate('popularity')
+    return touched
+
+
+def rebuild_popularity(until=None):
+    """
+    Recalcule tous les scores depuis ProductView jusqu'à la journée `until`
+    (hier par défaut). Utilisé au premier passage et quand le mode change.
+    """
+    until = until or timezone.localdate() - timedelta(days=1)
+    mode = current_mode()
+    scores = defaultdict(float)
+    rollups = []
+    if mode == 'decay':
+        # Au-delà de dix demi-vies, une journée pèse moins d'un millième
+        first_day = until - timedelta(days=int(half_life_days() * 10))
+        factor = decay_factor()
+        for product_id, day, total in _daily_views(first_day, until).iterator(chunk_size=5000):
+            scores[product_id] += total * factor ** (until - day).days
+        rollups.append(PopularityRollup(day=until, mode=mode, products=len(scores)))
+    else:
+        # Une ligne par journée de la fenêtre, pour retirer plus tard exactement ce qui est ajouté ici
+        first_day = until - timedelta(days=window_days() - 1)
+        per_day = defaultdict(dict)
+        for product_id, day, total in _daily_views(first_day, until).iterator(chunk_size=5000):
+            scores[product_id] += total
+            per_day[day][product_id] = total
+        for offset in range(window_days()):
+            day = first_day + timedelta(days=offset)
+            rollups.append(PopularityRollup(
+                day=day, mode=mode, products=len(scores) if day == until else len(per_day[day]), added=per_day[day]
+            ))
+    with transaction.atomic():
+        Product.objects.exclude(popularity_score=0).update(popularity_score=0)
+        _apply(scores, absolute=True)
+        PopularityRollup.objects.all().delete()
+        PopularityRollup.objects.bulk_create(rollups)
+        fragment_cache.invalidate('popularity')
+    logger.info(f"Popularité reconstruite ({mode}) pour {len(scores)} produits")
+    return len(scores)
+
+
+def rollup_popularity():
+    """
+    Intègre les journées closes pas encore prises en compte (jusqu'à hier).
+    Retourne le nombre de journées traitées.
+    """
+    yesterday = timezone.localdate() - timedelta(days=1)
+    last = PopularityRollup.objects.order_by('-day').first()
+    if last is None or last.mode != current_mode():
+        rebuild_popularity(yesterday)
+        return 1
+    days = 0
+    day = last.day + timedelta(days=1)
+    while day <= yesterday:
+        close_day(day)
+        day += timedelta(days=1)
+        days += 1
+    if days:
+        logger.info(f"Popularité mise à jour pour {days} journées (jusqu'au {yesterday})")
+    return days
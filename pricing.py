@@ -0,0 +1,287 @@
+"""
+Prix effectif des produits (prix après la meilleure réduction active).
+
+Product.effective_price est recalculé en SQL quand le prix ou les réductions
+d'un produit changent, et par un planificateur qui se réveille à la prochaine
+borne (début ou fin) d'une réduction pour ne recalculer que les produits concernés.
+Le planificateur tourne dans un seul processus, lancé à part avec la commande
+run_discount_scheduler ; EFFECTIVE_PRICE_SCHEDULER = True indique aux autres
+processus qu'il est en place et que la colonne indexée peut être lue. Sinon
+(par défaut), la colonne n'est pas à jour aux bornes : with_effective_price
+calcule alors le prix à l'instant de la requête.
+
+CartPricer calcule les montants d'un panier (lignes, sous-total, code promo,
+livraison, total) en une requête pour les lignes, produits et réductions.
+"""
+import logging
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import DecimalField, ExpressionWrapper, F, Min, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Round
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Discount, Product
+
+logger = logging.getLogger(__name__)
+
+
+def effective_price_expression(at=None):
+    """Expression SQL du prix effectif de chaque ligne de Product à l'instant donné."""
+    best = Discount.objects.active(at).filter(product=OuterRef('pk')).order_by('-percentage').values('percentage')[:1]
+    percentage = Coalesce(Subquery(best), Value(Decimal('0')), output_field=DecimalField(max_digits=5, decimal_places=2))
+    return Round(
+        ExpressionWrapper(
+            F('price') - F('price') * percentage / Value(Decimal('100')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        2,
+    )
+
+
+def scheduler_enabled():
+    return getattr(settings, 'EFFECTIVE_PRICE_SCHEDULER', False)
+
+
+def with_effective_price(queryset):
+    """
+    (queryset, champ) pour filtrer et trier par prix effectif : la colonne
+    indexée effective_price si le planificateur la tient à jour, sinon le prix
+    calculé en SQL à l'instant (annotation current_effective_price).
+    """
+    if scheduler_enabled():
+        return queryset, 'effective_price'
+    return queryset.annotate(current_effective_price=effective_price_expression()), 'current_effective_price'
+
+
+def active_discount_snapshot(product_id, now=None):
+    """
+    (pourcentage, date de fin, prochaine borne) de la meilleure réduction active
+    d'un produit ; la prochaine borne (fin d'une réduction en cours ou début d'une
+    réduction à venir) est l'instant où ce résultat peut changer sans écriture.
+    """
+    now = now or timezone.now()
+    best = Discount.objects.active(now).filter(product_id=product_id).order_by('-percentage').values_list('percentage', 'end_date').first()
+    bounds = Discount.objects.filter(product_id=product_id, is_active=True).aggregate(
+        next_start=Min('start_date', filter=Q(start_date__gt=now)),
+        next_end=Min('end_date', filter=Q(end_date__gte=now)),
+    )
+    candidates = [bound for bound in bounds.values() if bound is not None]
+    percentage, end_date = best or (None, None)
+    return percentage, end_date, min(candidates) if candidates else None
+
+
+def refresh_effective_prices(product_ids=None):
+    """Recalcule effective_price en un seul UPDATE pour les produits donnés (ou tous)."""
+    queryset = Product.objects.all()
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return 0
+        queryset = queryset.filter(id__in=product_ids)
+    return queryset.update(effective_price=effective_price_expression())
+
+
+class DiscountBoundaryScheduler:
+    """Thread qui dort jusqu'à la prochaine borne de réduction puis rafraîchit les produits concernés."""
+
+    def __init__(self, max_sleep=3600):
+        self.max_sleep = max_sleep
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._last_run = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self.run, name='discount-boundary-scheduler', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """Boucle du planificateur dans le thread courant, jusqu'à stop()."""
+        self._stopping.clear()
+        self._last_run = timezone.now()
+        self._run()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def reschedule(self):
+        """À appeler quand une réduction change : la prochaine borne est recalculée."""
+        self._wakeup.set()
+
+    def next_boundary(self, now):
+        bounds = Discount.objects.filter(is_active=True).aggregate(
+            next_start=Min('start_date', filter=Q(start_date__gt=now)),
+            next_end=Min('end_date', filter=Q(end_date__gte=now)),
+        )
+        candidates = [bound for bound in bounds.values() if bound is not None]
+        return min(candidates) if candidates else None
+
+    def run_due(self, since, now):
+        """Rafraîchit les produits dont une réduction a commencé ou s'est terminée dans ]since, now]."""
+        product_ids = set(Discount.objects.filter(
+            Q(start_date__gt=since, start_date__lte=now) | Q(end_date__gte=since, end_date__lt=now)
+        ).values_list('product_id', flat=True))
+        if product_ids:
+            refresh_effective_prices(product_ids)
+            logger.info(f"Prix effectifs recalculés pour {len(product_ids)} produits")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                boundary = self.next_boundary(timezone.now())
+            except DatabaseError as e:
+                logger.error(f"Planificateur des réductions : {e}")
+                boundary = None
+            finally:
+                close_old_connections()
+            timeout = self.max_sleep
+            if boundary is not None:
+                # Une réduction expire juste après end_date : on se réveille une seconde plus tard
+                timeout = min(timeout, max((boundary - timezone.now()).total_seconds(), 0) + 1)
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            now = timezone.now()
+            try:
+                self.run_due(self._last_run, now)
+                self._last_run = now
+            except DatabaseError as e:
+                logger.error(f"Planificateur des réductions : {e}")
+            finally:
+                close_old_connections()
+
+
+scheduler = DiscountBoundaryScheduler(max_sleep=getattr(settings, 'EFFECTIVE_PRICE_MAX_SLEEP', 3600))
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def refresh_discounted_product(sender, instance, **kwargs):
+    refresh_effective_prices([instance.product_id])
+    scheduler.reschedule()
+
+
+@receiver(post_init, sender=Product)
+def remember_price(sender, instance, **kwargs):
+    # None si le prix est différé : il sera alors recalculé à la sauvegarde
+    instance._price_snapshot = instance.__dict__.get('price')
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_effective_price(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'price' not in update_fields:
+        return
+    price = instance.__dict__.get('price')
+    if not created and price is not None and price == instance._price_snapshot:
+        return
+    refresh_effective_prices([instance.id])
+    instance._price_snapshot = price
+
+
+DEFAULT_SHIPPING_COST = Decimal('5.00')
+
+
+class PricedCart:
+    """
+    Panier chiffré. lines contient les CartItem, produit et réduction active
+    chargés (item.subtotal ne fait plus de requête) et unit_price renseigné.
+    """
+
+    def __init__(self, cart, lines, shipping_cost, discount_amount=Decimal('0.00'), promo_code=None, promo_error=None):
+        self.cart = cart
+        self.lines = lines
+        self.subtotal = sum((line.subtotal for line in lines), Decimal('0.00'))
+        self.shipping_cost = shipping_cost
+        self.discount_amount = discount_amount
+        self.promo_code = promo_code
+        self.promo_error = promo_error
+
+    @property
+    def total(self):
+        return self.subtotal + self.shipping_cost - self.discount_amount
+
+    @property
+    def is_empty(self):
+        return not self.lines
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+
+class CartPricer:
+    """
+    Chiffre le panier d'un utilisateur ; partagé par cart, checkout,
+    process_payment, apply_discount et apply_promo_code pour qu'ils donnent
+    les mêmes montants. Le code promo est lu et écrit dans la session.
+    """
+
+    def __init__(self, user, session=None):
+        self.user = user
+        self.session = session
+
+    def load_lines(self, cart):
+        active = Discount.objects.active().filter(product=OuterRef('product_id')).order_by('-percentage')
+        lines = list(
+            cart.items.select_related('product').annotate(
+                best_discount_percentage=Subquery(active.values('percentage')[:1]),
+                best_discount_end_date=Subquery(active.values('end_date')[:1]),
+            ).order_by('id')
+        )
+        for line in lines:
+            # Lues par Product._active_discount() comme avec with_active_discount()
+            line.product.best_discount_percentage = line.best_discount_percentage
+            line.product.best_discount_end_date = line.best_discount_end_date
+            line.unit_price = line.product.discounted_price
+        return lines
+
+    def _promo_discount(self, code, subtotal):
+        """(réduction, erreur) pour un code promo appliqué au sous-total."""
+        from marketing.models import PromoCode
+
+        try:
+            promo = PromoCode.objects.get(code=code)
+        except PromoCode.DoesNotExist:
+            return Decimal('0.00'), "Code promo introuvable."
+        if not promo.is_valid(user=self.user):
+            return Decimal('0.00'), "Code promo invalide ou expiré."
+        return promo.apply(subtotal), None
+
+    def price(self, cart, shipping_cost=DEFAULT_SHIPPING_COST, promo_code=None):
+        """
+        Chiffre le panier. Sans promo_code, le code enregistré en session est
+        appliqué et oublié s'il n'est plus valable ; promo_error explique pourquoi.
+        """
+        priced = PricedCart(cart, self.load_lines(cart), shipping_cost)
+        from_session = promo_code is None and self.session is not None
+        if from_session:
+            promo_code = self.session.get('promo_code')
+        if not promo_code:
+            return priced
+        discount_amount, error = self._promo_discount(promo_code, priced.subtotal)
+        if error:
+            priced.promo_error = error
+            if from_session:
+                self.forget_promo()
+        else:
+            priced.promo_code, priced.discount_amount = promo_code, discount_amount
+        return priced
+
+    def remember_promo(self, priced):
+        self.session['promo_code'] = priced.promo_code
+        self.session['discount_amount'] = float(priced.discount_amount)
+
+    def forget_promo(self):
+        self.session.pop('promo_code', None)
+        self.session.pop('discount_amount', None)
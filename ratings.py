@@ -0,0 +1,144 @@
+"""
+Notes dénormalisées : rating_sum, rating_count et rating_histogram sur Product
+(avis Review) et sur SellerProfile (notes SellerRating).
+
+Chaque création, modification ou suppression applique un delta sous
+select_for_update, dans la transaction de l'écriture d'origine. La commande
+reconcile_ratings recalcule tout depuis les tables sources.
+"""
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .models import Product, Review, SellerProfile, SellerRating, empty_rating_histogram
+
+logger = logging.getLogger(__name__)
+
+AGGREGATE_FIELDS = ['rating_sum', 'rating_count', 'rating_histogram']
+
+
+def apply_rating_delta(queryset, removed=None, added=None):
+    """Retire la note `removed` et/ou ajoute la note `added` à la ligne du queryset."""
+    with transaction.atomic():
+        row = queryset.select_for_update().values(*AGGREGATE_FIELDS).first()
+        if row is None:
+            return
+        histogram = {**empty_rating_histogram(), **(row['rating_histogram'] or {})}
+        total, count = row['rating_sum'], row['rating_count']
+        if removed is not None:
+            total, count = total - removed, count - 1
+            histogram[str(removed)] -= 1
+        if added is not None:
+            total, count = total + added, count + 1
+            histogram[str(added)] += 1
+        # update() plutôt que save() : ni auto_now ni récepteurs post_save de Product
+        queryset.update(
+            rating_sum=max(total, 0),
+            rating_count=max(count, 0),
+            rating_histogram={key: max(value, 0) for key, value in histogram.items()},
+        )
+
+
+# Modèle source -> (champ désignant la cible, queryset de la cible à partir de son id)
+SOURCES = {
+    Review: ('product_id', lambda product_id: Product.objects.filter(id=product_id)),
+    SellerRating: ('seller_id', lambda seller_id: SellerProfile.objects.filter(user_id=seller_id)),
+}
+
+
+def _snapshot(instance):
+    target_field, _ = SOURCES[type(instance)]
+    values = instance.__dict__
+    if instance.pk is None or 'rating' not in values or target_field not in values:
+        return None
+    return values[target_field], values['rating']
+
+
+@receiver(post_init, sender=Review)
+@receiver(post_init, sender=SellerRating)
+def remember_rating(sender, instance, **kwargs):
+    instance._rating_snapshot = _snapshot(instance)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=SellerRating)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    target_field, target = SOURCES[sender]
+    current = (getattr(instance, target_field), instance.rating)
+    previous = None if created else getattr(instance, '_rating_snapshot', None)
+    if previous == current:
+        return
+    if sender is SellerRating:
+        # Un vendeur peut être noté avant d'avoir rempli son profil
+        SellerProfile.objects.get_or_create(user_id=current[0])
+    if previous is None and not created:
+        # Ancienne valeur inconnue (champs différés) : recalcul complet de la cible
+        reconcile_targets(sender, [current[0]])
+    elif previous is None or previous[0] != current[0]:
+        if previous is not None:
+            apply_rating_delta(target(previous[0]), removed=previous[1])
+        apply_rating_delta(target(current[0]), added=current[1])
+    else:
+        apply_rating_delta(target(current[0]), removed=previous[1], added=current[1])
+    instance._rating_snapshot = current
+
+
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=SellerRating)
+def update_rating_on_delete(sender, instance, **kwargs):
+    target_field, target = SOURCES[sender]
+    snapshot = getattr(instance, '_rating_snapshot', None) or (getattr(instance, target_field), instance.rating)
+    apply_rating_delta(target(snapshot[0]), removed=snapshot[1])
+
+
+def _aggregates(source, target_ids=None):
+    """{cible: (somme, nombre, histogramme)} recalculés depuis la table source."""
+    target_field, _ = SOURCES[source]
+    queryset = source.objects.all()
+    if target_ids is not None:
+        queryset = queryset.filter(**{f'{target_field}__in': target_ids})
+    aggregates = defaultdict(lambda: [0, 0, empty_rating_histogram()])
+    for target_id, rating, count in queryset.values_list(target_field, 'rating').annotate(n=Count('id')).order_by():
+        aggregate = aggregates[target_id]
+        aggregate[0] += rating * count
+        aggregate[1] += count
+        aggregate[2][str(rating)] += count
+    return aggregates
+
+
+def reconcile_targets(source, target_ids=None):
+    """
+    Réécrit les agrégats des cibles données (ou de toutes) depuis la table source.
+    Retourne le nombre de lignes corrigées.
+    """
+    aggregates = _aggregates(source, target_ids)
+    if source is Review:
+        targets = Product.objects.all()
+        key = 'id'
+    else:
+        for seller_id in aggregates:
+            SellerProfile.objects.get_or_create(user_id=seller_id)
+        targets = SellerProfile.objects.all()
+        key = 'user_id'
+    if target_ids is not None:
+        targets = targets.filter(**{f'{key}__in': target_ids})
+    stale = []
+    with transaction.atomic():
+        for target in targets.select_for_update().only(key, *AGGREGATE_FIELDS).iterator(chunk_size=2000):
+            total, count, histogram = aggregates.get(getattr(target, key), (0, 0, empty_rating_histogram()))
+            if (target.rating_sum, target.rating_count, target.rating_histogram) != (total, count, histogram):
+                target.rating_sum, target.rating_count, target.rating_histogram = total, count, histogram
+                stale.append(target)
+        targets.model.objects.bulk_update(stale, AGGREGATE_FIELDS, batch_size=1000)
+    if stale:
+        logger.warning(f"{len(stale)} agrégats de notes corrigés ({source.__name__})")
+    return len(stale)
+
+
+def reconcile_ratings():
+    """Recalcule les notes de tous les produits et vendeurs ; retourne (produits, vendeurs) corrigés."""
+    return reconcile_targets(Review), reconcile_targets(SellerRating)
@@ -0,0 +1,158 @@
+"""
+Recommandations article-à-article par co-occurrence.
+
+Les interactions (favoris, achats, vues) forment une matrice creuse
+utilisateurs x produits ; chaque vue compte une fois, qu'elle soit encore une
+ligne UserProductView ou agrégée dans le view_count de UserProductViewDaily.
+Les poids d'un même couple sont additionnés puis amortis (log1p). La similarité cosinus entre colonnes donne, pour chaque
+produit, ses top-K voisins stockés dans ProductRecommendation.
+
+Une recommandation pour un utilisateur est la somme des scores des voisins de
+ses produits d'intérêt, calculée en une seule requête SQL.
+"""
+import logging
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.utils import timezone
+
+from .fragment_cache import fragment_cache
+from .models import Favorite, OrderItem, Product, ProductRecommendation, UserProductView, UserProductViewDaily
+
+logger = logging.getLogger(__name__)
+
+EVENT_WEIGHTS = {
+    'purchase': 5.0,
+    'favorite': 3.0,
+    'view': 1.0,
+}
+
+
+def _scientific_stack():
+    try:
+        import numpy
+        from scipy import sparse
+    except ImportError as e:
+        raise ImproperlyConfigured("Le calcul des recommandations nécessite numpy et scipy (pip install numpy scipy).") from e
+    return numpy, sparse
+
+
+def _interaction_sources():
+    """(nom, queryset de triplets (utilisateur, produit, nombre d'événements)) pour chaque type d'événement."""
+    once = Value(1, output_field=IntegerField())
+    return [
+        ('purchase', OrderItem.objects.exclude(order__status='cancelled').values_list('order__user_id', 'product_id', once)),
+        ('favorite', Favorite.objects.values_list('user_id', 'product_id', once)),
+        ('view', UserProductView.objects.values_list('user_id', 'product_id', once)),
+        ('view', UserProductViewDaily.objects.values_list('user_id', 'product_id', 'view_count')),
+    ]
+
+
+def _load_interactions(np):
+    users, products, weights = array('q'), array('q'), array('d')
+    for event, queryset in _interaction_sources():
+        weight = EVENT_WEIGHTS[event]
+        for user_id, product_id, count in queryset.iterator(chunk_size=5000):
+            users.append(user_id)
+            products.append(product_id)
+            weights.append(weight * count)
+    return np.array(users, dtype=np.int64), np.array(products, dtype=np.int64), np.array(weights, dtype=np.float64)
+
+
+def _active_users(since):
+    """Utilisateurs ayant au moins un nouvel événement depuis `since`."""
+    user_ids = set(Favorite.objects.filter(added_at__gte=since).values_list('user_id', flat=True))
+    user_ids.update(OrderItem.objects.filter(order__created_at__gte=since).values_list('order__user_id', flat=True))
+    user_ids.update(UserProductView.objects.filter(view_date__gte=since).values_list('user_id', flat=True))
+    user_ids.update(UserProductViewDaily.objects.filter(day__gte=since.date()).values_list('user_id', flat=True))
+    return user_ids
+
+
+def rebuild_recommendations(since=None, top_k=None, chunk_size=1000):
+    """
+    Recalcule les voisins de co-occurrence.
+
+    since=None : reconstruction complète. Sinon, seuls les produits touchés par
+    les utilisateurs actifs depuis `since` sont recalculés : ce sont les seules
+    lignes dont les co-occurrences ont pu changer. La matrice est toujours
+    chargée en entier, car la normalisation cosinus dépend de toutes les interactions.
+    Retourne le nombre de produits recalculés.
+    """
+    np, sparse = _scientific_stack()
+    top_k = top_k or getattr(settings, 'RECOMMENDATIONS_TOP_K', 20)
+
+    users, products, weights = _load_interactions(np)
+    if not len(users):
+        return 0
+    user_ids, user_pos = np.unique(users, return_inverse=True)
+    product_ids, product_pos = np.unique(products, return_inverse=True)
+    matrix = sparse.coo_matrix((weights, (user_pos, product_pos)), shape=(len(user_ids), len(product_ids))).tocsc()
+    matrix.sum_duplicates()
+    matrix.data = np.log1p(matrix.data)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    normalized = (matrix @ sparse.diags(1.0 / norms)).tocsc()
+
+    if since is None:
+        targets = np.arange(len(product_ids))
+    else:
+        active = np.fromiter(_active_users(since), dtype=np.int64)
+        touched = np.isin(users, active)
+        targets = np.unique(product_pos[touched])
+    transposed = normalized.T.tocsr()
+
+    for start in range(0, len(targets), chunk_size):
+        chunk = targets[start:start + chunk_size]
+        cooccurrence = (transposed[chunk] @ normalized).tocsr()
+        links = []
+        for row, position in enumerate(chunk):
+            begin, end = cooccurrence.indptr[row], cooccurrence.indptr[row + 1]
+            columns, scores = cooccurrence.indices[begin:end], cooccurrence.data[begin:end]
+            keep = columns != position
+            columns, scores = columns[keep], scores[keep]
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k - 1)[:top_k]
+                columns, scores = columns[best], scores[best]
+            order = np.argsort(-scores, kind='stable')
+            links.extend(
+                ProductRecommendation(product_id=int(product_ids[position]), neighbor_id=int(product_ids[column]), rank=rank, score=float(score))
+                for rank, (column, score) in enumerate(zip(columns[order], scores[order]))
+            )
+        chunk_product_ids = product_ids[chunk].tolist()
+        with transaction.atomic():
+            ProductRecommendation.objects.filter(product_id__in=chunk_product_ids).delete()
+            ProductRecommendation.objects.bulk_create(links, batch_size=1000)
+    if since is None:
+        # Produits sans plus aucune interaction (favoris retirés, commandes annulées)
+        ProductRecommendation.objects.exclude(product_id__in=product_ids.tolist()).delete()
+    fragment_cache.invalidate('recommendations')
+    logger.info(f"Recommandations recalculées pour {len(targets)} produits ({len(user_ids)} utilisateurs)")
+    return len(targets)
+
+
+def recommend_for_user(user, exclude=()):
+    """
+    Produits listés recommandés à un utilisateur, triés par score (une requête).
+    Les produits déjà favoris ou achetés sont écartés ; à découper par l'appelant.
+    """
+    recent_days = getattr(settings, 'RECOMMENDATIONS_VIEW_WINDOW_DAYS', 90)
+    favorites = Favorite.objects.filter(user=user).values('product_id')
+    purchases = OrderItem.objects.filter(order__user=user).values('product_id')
+    seeds = ProductRecommendation.objects.filter(
+        Q(product__in=favorites)
+        | Q(product__in=purchases)
+        | Q(product__in=UserProductView.objects.filter(user=user).values('product_id'))
+        | Q(product__in=UserProductViewDaily.objects.filter(
+            user=user, day__gte=timezone.localdate() - timedelta(days=recent_days)
+        ).values('product_id'))
+    )
+    scores = seeds.filter(neighbor=OuterRef('pk')).order_by().values('neighbor').annotate(total=Sum('score')).values('total')
+    return Product.objects.filter(
+        is_listed=True, id__in=seeds.values('neighbor')
+    ).exclude(id__in=list(exclude)).exclude(id__in=favorites).exclude(id__in=purchases).annotate(
+        recommendation_score=Subquery(scores, output_field=FloatField())
+    ).order_by('-recommendation_score', 'id')
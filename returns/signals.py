@@ -1,7 +1,7 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from returns.models import ReturnRequest
-from store.models import Notification
+from store.notifications import notify_users
 from django.core.mail import send_mail
 from django.conf import settings
 from channels.layers import get_channel_layer
@@ -18,7 +18,14 @@ def notify_seller_of_return_request(sender, instance, created, **kwargs):
         if not sellers:
             logger.warning(f"Aucun seller trouvé pour l'Order {order.id}. Vérifiez les produits associés.")
             return
-        
+
+        # Notifications en base de données (et WebSocket user_<id>), en un seul lot
+        notify_users(
+            sellers,
+            f"Une demande de retour a été soumise pour la commande #{order.id}.",
+            'return_request',
+            related_object_id=instance.id,
+        )
         for seller in sellers:
             try:
                 # Notification par email
@@ -29,13 +36,6 @@ def notify_seller_of_return_request(sender, instance, created, **kwargs):
                     recipient_list=[seller.email],
                     fail_silently=True,
                 )
-                # Notification en base de données
-                Notification.objects.create(
-                    user=seller,
-                    message=f"Une demande de retour a été soumise pour la commande #{order.id}.",
-                    notification_type='return_request',
-                    related_object_id=instance.id
-                )
                 # Notification WebSocket
                 channel_layer = get_channel_layer()
                 async_to_sync(channel_layer.group_send)(
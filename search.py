@@ -0,0 +1,343 @@
+"""
+Index de recherche plein texte des produits : FTS5 sous SQLite, tsvector sous
+PostgreSQL, repli icontains ailleurs. Les textes sont normalisés en Python
+(accents, élisions, mots vides français) avant indexation.
+
+La table d'index est créée après migrate (signal post_migrate) ou par la
+commande rebuild_search_index, jamais pendant une requête : get_backend() se
+contente de choisir le moteur.
+"""
+import logging
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, transaction, OperationalError, ProgrammingError
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+INDEXED_FIELDS = ('name', 'description', 'brand', 'color', 'material')
+
+# Poids par champ : le nom et la marque comptent plus que la description
+FIELD_WEIGHTS = {'name': 10.0, 'description': 1.0, 'brand': 5.0, 'color': 2.0, 'material': 2.0}
+
+FRENCH_STOPWORDS = frozenset("""
+    a au aux avec ce ces cet cette dans de des du en et il ils je la le les leur
+    leurs ma mais me mes mon ne ni nos notre nous on ou par pas pour qu que qui sa
+    se ses son sur ta te tes ton tu un une vos votre vous y est sont
+""".split())
+
+ELISION_RE = re.compile(r"\b(?:l|d|j|m|n|s|t|c|qu|jusqu|lorsqu|puisqu)['’]", re.IGNORECASE)
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold_accents(text):
+    """Supprime les accents : « Été » -> « Ete »."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def stem(token):
+    """Racinisation légère du français (pluriels et formes en -aux)."""
+    if len(token) > 4 and token.endswith('aux'):
+        return token[:-3] + 'al'
+    if len(token) > 3 and token[-1] in 'sx' and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Découpe un texte en termes normalisés, prêts pour l'index."""
+    if not text:
+        return []
+    text = ELISION_RE.sub(' ', text.lower())
+    text = fold_accents(text)
+    return [stem(t) for t in TOKEN_RE.findall(text) if t not in FRENCH_STOPWORDS]
+
+
+def product_document(product):
+    """Retourne le texte normalisé de chaque champ indexé du produit."""
+    return {field: ' '.join(tokenize(getattr(product, field) or '')) for field in INDEXED_FIELDS}
+
+
+class ORMSearchBackend:
+    """Repli sans index : filtrage icontains sur les champs indexés."""
+    vendor = None
+    table = None
+
+    def ensure_index(self):
+        pass
+
+    def index(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def condition(self, query):
+        condition = Q()
+        for field in INDEXED_FIELDS:
+            condition |= Q(**{f'{field}__icontains': query})
+        return condition
+
+    def search(self, query, limit):
+        return list(Product.objects.filter(self.condition(query)).values_list('id', flat=True)[:limit])
+
+    def filter(self, queryset, query):
+        return queryset.filter(self.condition(query)), None
+
+
+class SQLiteFTSBackend:
+    """Table virtuelle FTS5 dont le rowid est l'id du produit."""
+    vendor = 'sqlite'
+    table = 'store_product_fts'
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                f"{', '.join(INDEXED_FIELDS)}, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def index(self, products):
+        rows = []
+        for product in products:
+            document = product_document(product)
+            rows.append([product.id] + [document[field] for field in INDEXED_FIELDS])
+        if not rows:
+            return
+        placeholders = ', '.join(['%s'] * (len(INDEXED_FIELDS) + 1))
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [[row[0]] for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, {', '.join(INDEXED_FIELDS)}) VALUES ({placeholders})",
+                rows,
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [[pk] for pk in product_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+
+    def match_expression(self, query):
+        # Chaque terme est cherché en préfixe ; les termes sont combinés en ET
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    def rank_expression(self):
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in INDEXED_FIELDS)
+        return f"bm25({self.table}, {weights})"
+
+    def search(self, query, limit):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s "
+                f"ORDER BY {self.rank_expression()} LIMIT %s",
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def filter(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset.none(), None
+        matches = RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [match])
+        # bm25 : plus petit = plus pertinent
+        rank = RawSQL(
+            f"SELECT {self.rank_expression()} FROM {self.table} "
+            f"WHERE {self.table} MATCH %s AND rowid = {queryset.model._meta.db_table}.id",
+            [match],
+            output_field=FloatField(),
+        )
+        return queryset.filter(id__in=matches), rank.asc()
+
+
+class PostgresSearchBackend:
+    """Table tsvector pondérée (A à D) indexée en GIN."""
+    vendor = 'postgresql'
+    table = 'store_product_search'
+    field_labels = {'name': 'A', 'brand': 'B', 'color': 'C', 'material': 'C', 'description': 'D'}
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "product_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_document_idx ON {self.table} USING GIN (document)"
+            )
+
+    def index(self, products):
+        # Les textes sont déjà normalisés : la configuration 'simple' suffit
+        vector = ' || '.join(
+            f"setweight(to_tsvector('simple', %s), '{self.field_labels[field]}')" for field in INDEXED_FIELDS
+        )
+        rows = []
+        for product in products:
+            document = product_document(product)
+            rows.append([product.id] + [document[field] for field in INDEXED_FIELDS])
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (product_id, document) VALUES (%s, {vector}) "
+                "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                rows,
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE product_id = ANY(%s)", [list(product_ids)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {self.table}")
+
+    def ts_query(self, query):
+        return ' & '.join(f'{token}:*' for token in tokenize(query))
+
+    def search(self, query, limit):
+        ts_query = self.ts_query(query)
+        if not ts_query:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT product_id FROM {self.table} WHERE document @@ to_tsquery('simple', %s) "
+                "ORDER BY ts_rank_cd(document, to_tsquery('simple', %s)) DESC LIMIT %s",
+                [ts_query, ts_query, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def filter(self, queryset, query):
+        ts_query = self.ts_query(query)
+        if not ts_query:
+            return queryset.none(), None
+        matches = RawSQL(
+            f"SELECT product_id FROM {self.table} WHERE document @@ to_tsquery('simple', %s)", [ts_query]
+        )
+        rank = RawSQL(
+            f"SELECT ts_rank_cd(document, to_tsquery('simple', %s)) FROM {self.table} "
+            f"WHERE product_id = {queryset.model._meta.db_table}.id",
+            [ts_query],
+            output_field=FloatField(),
+        )
+        return queryset.filter(id__in=matches), rank.desc()
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backend = None
+
+
+def get_backend():
+    """
+    Choisit le moteur selon la base ; repli sur icontains tant que la table
+    d'index n'existe pas (aucune création ici, la requête peut être en transaction).
+    """
+    global _backend
+    if _backend is None:
+        backend_class = BACKENDS.get(connection.vendor, ORMSearchBackend)
+        if backend_class.table and backend_class.table not in connection.introspection.table_names():
+            logger.warning(f"Index de recherche {backend_class.table} absent, repli sur icontains (lancer migrate)")
+            backend_class = ORMSearchBackend
+        _backend = backend_class()
+    return _backend
+
+
+def ensure_index():
+    """Crée la table d'index du moteur de la base si besoin ; retourne False si c'est impossible."""
+    global _backend
+    backend_class = BACKENDS.get(connection.vendor, ORMSearchBackend)
+    # Le moteur est choisi de nouveau au prochain appel de get_backend()
+    _backend = None
+    try:
+        backend_class().ensure_index()
+    except (OperationalError, ProgrammingError) as e:
+        # SQLite compilé sans FTS5, droits insuffisants, etc.
+        logger.warning(f"Index de recherche {backend_class.__name__} indisponible, repli sur icontains : {e}")
+        return False
+    return True
+
+
+@receiver(post_migrate)
+def create_index_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.label == 'store' and using == DEFAULT_DB_ALIAS:
+        ensure_index()
+
+
+def search_product_ids(query, limit=None):
+    """Retourne les ids des produits correspondant à la requête, par pertinence décroissante."""
+    query = (query or '').strip()
+    if not query:
+        return []
+    limit = limit or getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+    return get_backend().search(query, limit)
+
+
+def filter_queryset(queryset, query, order_by_rank=True):
+    """
+    Restreint un queryset de produits aux résultats de la recherche, par une
+    sous-requête sur l'index : les autres filtres du queryset s'appliquent dans la
+    même requête, sans plafond sur le nombre de correspondances.
+    """
+    query = (query or '').strip()
+    if not query:
+        return queryset.none()
+    queryset, ranking = get_backend().filter(queryset, query)
+    if order_by_rank and ranking:
+        queryset = queryset.order_by(ranking)
+    return queryset
+
+
+def autocomplete(query, limit=5):
+    """Suggestions pour la barre de recherche, dans l'ordre de pertinence."""
+    ids = search_product_ids(query, limit=limit)
+    products = {p['id']: p for p in Product.objects.filter(id__in=ids).values('id', 'name', 'brand')}
+    return [products[pk] for pk in ids if pk in products]
+
+
+def rebuild_index(batch_size=500):
+    """Reconstruit entièrement l'index ; retourne le nombre de produits indexés."""
+    backend = get_backend()
+    indexed = 0
+    with transaction.atomic():
+        backend.clear()
+        batch = []
+        for product in Product.objects.only(*INDEXED_FIELDS).iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                backend.index(batch)
+                indexed += len(batch)
+                batch = []
+        backend.index(batch)
+        indexed += len(batch)
+    return indexed
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    transaction.on_commit(lambda: get_backend().index([instance]))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: get_backend().remove([product_id]))
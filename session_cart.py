@@ -0,0 +1,115 @@
+"""
+Panier des visiteurs anonymes, stocké dans la session sous la forme compacte
+{id produit: quantité}, et fusionné dans le Cart en base à la connexion.
+"""
+import logging
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import Cart, CartItem, Product
+from .pricing import DEFAULT_SHIPPING_COST, PricedCart
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = 'cart'
+
+
+def user_cart(user):
+    """Cart de l'utilisateur, créé au besoin (Cart.user est un OneToOneField : un seul panier par utilisateur)."""
+    cart, created = Cart.objects.get_or_create(user=user)
+    if created:
+        logger.info(f"New cart created for user {user.username}: {cart.id}")
+    return cart
+
+
+class SessionCart:
+    def __init__(self, session):
+        self.session = session
+
+    @property
+    def quantities(self):
+        """{id produit: quantité} ; les clés sont des chaînes dans la session (sérialisation JSON)."""
+        return {int(product_id): quantity for product_id, quantity in self.session.get(SESSION_KEY, {}).items()}
+
+    def _save(self, quantities):
+        if quantities:
+            self.session[SESSION_KEY] = {str(product_id): quantity for product_id, quantity in quantities.items()}
+        else:
+            self.session.pop(SESSION_KEY, None)
+
+    def quantity(self, product_id):
+        return self.quantities.get(int(product_id), 0)
+
+    def set(self, product_id, quantity):
+        quantities = self.quantities
+        if quantity > 0:
+            quantities[int(product_id)] = quantity
+        else:
+            quantities.pop(int(product_id), None)
+        self._save(quantities)
+
+    def remove(self, product_id):
+        self.set(product_id, 0)
+
+    def clear(self):
+        self._save({})
+
+    def __len__(self):
+        return len(self.quantities)
+
+    def load_lines(self):
+        """
+        Lignes non enregistrées (CartItem) avec produit et réduction active, en une requête.
+        L'id d'une ligne est celui de son produit : c'est lui que reçoivent update_cart et remove_from_cart.
+        """
+        quantities = self.quantities
+        products = Product.objects.filter(id__in=quantities).with_active_discount().order_by('id')
+        lines = []
+        for product in products:
+            line = CartItem(id=product.id, product=product, quantity=quantities[product.id])
+            line.unit_price = product.discounted_price
+            lines.append(line)
+        return lines
+
+    def price(self, shipping_cost=DEFAULT_SHIPPING_COST):
+        return PricedCart(None, self.load_lines(), shipping_cost)
+
+
+def merge_into_cart(user, quantities):
+    """
+    Ajoute les quantités données au Cart de l'utilisateur en une passe :
+    une lecture verrouillée des lignes existantes, un bulk_update et un bulk_create.
+    Les quantités sont plafonnées au stock ; les produits disparus sont ignorés.
+    """
+    if not quantities:
+        return 0
+    with transaction.atomic():
+        cart = user_cart(user)
+        stocks = dict(Product.objects.filter(id__in=quantities).values_list('id', 'stock'))
+        existing = {item.product_id: item for item in cart.items.select_for_update().filter(product_id__in=stocks)}
+        to_update, to_create = [], []
+        for product_id, stock in stocks.items():
+            if stock < 1:
+                continue
+            item = existing.get(product_id)
+            if item:
+                item.quantity = min(item.quantity + quantities[product_id], stock)
+                to_update.append(item)
+            else:
+                to_create.append(CartItem(cart=cart, product_id=product_id, quantity=min(quantities[product_id], stock)))
+        CartItem.objects.bulk_update(to_update, ['quantity'])
+        CartItem.objects.bulk_create(to_create)
+    return len(to_update) + len(to_create)
+
+
+@receiver(user_logged_in)
+def merge_session_cart_on_login(sender, request, user, **kwargs):
+    if request is None or not hasattr(request, 'session'):
+        return
+    session_cart = SessionCart(request.session)
+    merged = merge_into_cart(user, session_cart.quantities)
+    if merged:
+        logger.info(f"Session cart merged into cart of {user.username}: {merged} items")
+    session_cart.clear()
@@ -1,7 +1,8 @@
+from django.db.models import F
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import AIPreferences, Order, ProductRequest, OrderItem
+from .models import AIPreferences, Order, Product, ProductRequest, OrderItem
 
 @receiver(post_save, sender=User)
 def create_ai_preferences(sender, instance, created, **kwargs):
@@ -19,5 +20,4 @@ def update_product_sales(sender, instance, created, **kwargs):
 @receiver(post_save, sender=ProductRequest)
 def update_product_views(sender, instance, created, **kwargs):
     if created:
-        instance.product.views += 1
-        instance.product.save()
\ No newline at end of file
+        Product.objects.filter(id=instance.product_id).update(views=F('views') + 1)
\ No newline at end of file
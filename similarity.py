@@ -0,0 +1,176 @@
+"""
+Produits similaires précalculés.
+
+Chaque produit est décrit par ses attributs (catégorie, marque, couleur,
+matériau) encodés en entiers : comparer deux codes revient au produit
+scalaire des vecteurs one-hot correspondants, sans matérialiser ces vecteurs.
+Chaque produit n'est comparé qu'aux candidats partageant au moins un attribut
+(listes inversées par code) : la mémoire reste proportionnelle à ces candidats,
+pas à lots x catalogue. Le score pondère les attributs communs puis ajoute un bonus de note moyenne et
+de popularité ; les meilleurs voisins sont stockés dans SimilarProduct.
+
+Seuls les produits marqués similarity_dirty (attributs modifiés, nouveaux
+produits) sont recalculés, sauf avec full=True.
+"""
+import logging
+import math
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .facets import facet_key
+from .fragment_cache import fragment_cache
+from .models import Product, SimilarProduct
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_FIELDS = ('category_id', 'brand', 'color', 'material')
+FIELD_WEIGHTS = (3.0, 2.0, 1.0, 1.0)
+RATING_WEIGHT = 0.5
+POPULARITY_WEIGHT = 0.5
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImproperlyConfigured("Le calcul des produits similaires nécessite numpy (pip install numpy).") from e
+    return numpy
+
+
+def similar_to(product):
+    """Voisins listés d'un produit, dans l'ordre du score (à découper par l'appelant)."""
+    return Product.objects.filter(similar_of__product=product, is_listed=True).order_by('similar_of__rank')
+
+
+def _encode(np, rows, vocabularies):
+    """Codes entiers (lignes x attributs) ; -1 pour une valeur absente."""
+    codes = np.full((len(rows), len(SIMILARITY_FIELDS)), -1, dtype=np.int32)
+    for i, row in enumerate(rows):
+        for j, value in enumerate(row):
+            key = value if j == 0 else facet_key(value)
+            if key is not None:
+                codes[i, j] = vocabularies[j].setdefault(key, len(vocabularies[j]))
+    return codes
+
+
+def _postings(np, candidate_codes):
+    """Pour chaque attribut, {code: indices des candidats qui portent ce code}."""
+    postings = []
+    for j in range(len(SIMILARITY_FIELDS)):
+        column = candidate_codes[:, j]
+        order = np.argsort(column, kind='stable')
+        values, starts = np.unique(column[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        postings.append({int(value): order[begin:end] for value, begin, end in zip(values, starts, ends) if value >= 0})
+    return postings
+
+
+def _score_row(np, codes, candidate_codes, bonus, postings):
+    """(indices, scores) des candidats ayant au moins un attribut commun avec le produit."""
+    # Comme l'ancien filtre OR : les candidats sans attribut commun ne sont pas notés
+    matches = [postings[j][code] for j, code in enumerate(codes.tolist()) if code in postings[j]]
+    if not matches:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    columns = np.unique(np.concatenate(matches))
+    scores = bonus[columns]
+    for j, weight in enumerate(FIELD_WEIGHTS):
+        if codes[j] >= 0:
+            scores += weight * (candidate_codes[columns, j] == codes[j])
+    return columns, scores
+
+
+def _top_neighbors(np, columns, scores, top_n):
+    """Les top_n meilleurs candidats, triés par score décroissant, avec leur score."""
+    k = min(top_n, len(scores))
+    if k == 0:
+        return []
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best], kind='stable')]
+    return list(zip(columns[best].tolist(), scores[best].tolist()))
+
+
+def compute_similar_products(full=False, top_n=None, chunk_size=500):
+    """
+    Recalcule les voisins des produits marqués (ou de tous avec full=True).
+    Retourne le nombre de produits traités.
+    """
+    np = _numpy()
+    top_n = top_n or getattr(settings, 'SIMILAR_PRODUCTS_STORED', 12)
+    started_at = timezone.now()
+
+    targets = Product.objects.all() if full else Product.objects.filter(similarity_dirty=True)
+    target_rows = list(targets.values_list('id', *SIMILARITY_FIELDS))
+    if not target_rows:
+        return 0
+    candidate_rows = list(
+        Product.objects.filter(is_listed=True)
+        .with_rating()
+        .values_list('id', *SIMILARITY_FIELDS, 'views', 'avg_rating')
+    )
+
+    vocabularies = [{} for _ in SIMILARITY_FIELDS]
+    candidate_ids = np.array([row[0] for row in candidate_rows], dtype=np.int64)
+    candidate_codes = _encode(np, [row[1:5] for row in candidate_rows], vocabularies)
+    postings = _postings(np, candidate_codes)
+    position = {product_id: i for i, product_id in enumerate(candidate_ids.tolist())}
+
+    views = np.array([row[5] for row in candidate_rows], dtype=np.float32)
+    ratings = np.array([row[6] or 0 for row in candidate_rows], dtype=np.float32)
+    max_views = float(views.max()) if len(views) else 0.0
+    bonus = RATING_WEIGHT * ratings / 5
+    if max_views > 0:
+        bonus += POPULARITY_WEIGHT * np.log1p(views) / math.log1p(max_views)
+
+    processed = 0
+    for start in range(0, len(target_rows), chunk_size):
+        chunk = target_rows[start:start + chunk_size]
+        chunk_ids = [row[0] for row in chunk]
+        links = []
+        for product_id, codes in zip(chunk_ids, _encode(np, [row[1:] for row in chunk], vocabularies)):
+            columns, scores = _score_row(np, codes, candidate_codes, bonus, postings)
+            if product_id in position:
+                keep = columns != position[product_id]
+                columns, scores = columns[keep], scores[keep]
+            links.extend(
+                SimilarProduct(product_id=product_id, neighbor_id=int(candidate_ids[column]), rank=rank, score=score)
+                for rank, (column, score) in enumerate(_top_neighbors(np, columns, scores, top_n))
+            )
+        with transaction.atomic():
+            SimilarProduct.objects.filter(product_id__in=chunk_ids).delete()
+            SimilarProduct.objects.bulk_create(links, batch_size=1000)
+            # Un produit modifié pendant le calcul reste marqué pour le prochain passage
+            Product.objects.filter(id__in=chunk_ids, updated_at__lte=started_at).update(similarity_dirty=False)
+        processed += len(chunk_ids)
+    fragment_cache.invalidate('similar')
+    logger.info(f"Produits similaires recalculés pour {processed} produits ({len(candidate_rows)} candidats)")
+    return processed
+
+
+def _signature(instance):
+    values = instance.__dict__
+    if any(field not in values for field in SIMILARITY_FIELDS):
+        return None  # Champs différés : on ne lit pas la base pour ça
+    return tuple(values[field] for field in SIMILARITY_FIELDS)
+
+
+@receiver(post_init, sender=Product)
+def remember_similarity_signature(sender, instance, **kwargs):
+    instance._similarity_signature = _signature(instance)
+
+
+@receiver(post_save, sender=Product)
+def flag_similarity_change(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return  # similarity_dirty vaut True par défaut
+    if update_fields is not None and not set(update_fields) & {'category', *SIMILARITY_FIELDS}:
+        return
+    signature = _signature(instance)
+    if signature is None or signature != instance._similarity_signature:
+        Product.objects.filter(id=instance.id).update(similarity_dirty=True)
+        instance.similarity_dirty = True
+    instance._similarity_signature = signature
@@ -0,0 +1,131 @@
+"""
+Bouchon local de l'API Stripe pour les tests : les appels utilisés par la
+boutique (clients, PaymentIntent, charges, sessions Checkout) sont servis
+depuis un état en mémoire et comptés, sans accès réseau.
+
+    with StripeStub() as stub:
+        ...
+        self.assertEqual(stub.calls['Customer.create'], 1)
+"""
+import re
+from collections import Counter
+from itertools import count
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import stripe
+
+
+class StripeStub:
+    def __init__(self, intent_status='succeeded'):
+        self.intent_status = intent_status
+        self.calls = Counter()
+        self.customers = {}
+        self.intents = {}
+        self._idempotent = {}
+        self._ids = count(1)
+        self._patches = []
+
+    def _new_id(self, prefix):
+        return f'{prefix}_stub{next(self._ids)}'
+
+    def _once(self, idempotency_key, create):
+        """Rejoue la réponse d'origine pour une clé d'idempotence déjà vue, comme Stripe."""
+        if idempotency_key is None:
+            return create()
+        if idempotency_key not in self._idempotent:
+            self._idempotent[idempotency_key] = create()
+        return self._idempotent[idempotency_key]
+
+    def customer_list(self, email=None, limit=10, **kwargs):
+        self.calls['Customer.list'] += 1
+        return SimpleNamespace(data=[customer for customer in self.customers.values() if customer.email == email][:limit])
+
+    def customer_create(self, email=None, metadata=None, idempotency_key=None, **kwargs):
+        self.calls['Customer.create'] += 1
+
+        def create():
+            customer = SimpleNamespace(id=self._new_id('cus'), email=email, metadata=metadata or {})
+            self.customers[customer.id] = customer
+            return customer
+        return self._once(idempotency_key, create)
+
+    def payment_method_attach(self, payment_method, customer=None, **kwargs):
+        self.calls['PaymentMethod.attach'] += 1
+        if customer not in self.customers:
+            raise stripe.error.InvalidRequestError(f"No such customer: '{customer}'", 'customer')
+        return SimpleNamespace(id=payment_method, customer=customer)
+
+    def payment_intent_create(self, amount=None, currency=None, customer=None, metadata=None, idempotency_key=None, **kwargs):
+        self.calls['PaymentIntent.create'] += 1
+
+        def create():
+            status = self.intent_status
+            intent = SimpleNamespace(
+                id=self._new_id('pi'),
+                amount=amount,
+                currency=currency,
+                customer=customer,
+                metadata={key: str(value) for key, value in (metadata or {}).items()},
+                status=status,
+                latest_charge=self._new_id('ch') if status == 'succeeded' else None,
+            )
+            self.intents[intent.id] = intent
+            return intent
+        return self._once(idempotency_key, create)
+
+    def payment_intent_retrieve(self, intent_id, **kwargs):
+        self.calls['PaymentIntent.retrieve'] += 1
+        if intent_id not in self.intents:
+            raise stripe.error.InvalidRequestError(f"No such payment_intent: '{intent_id}'", 'intent')
+        return self.intents[intent_id]
+
+    def payment_intent_search(self, query='', limit=10, **kwargs):
+        self.calls['PaymentIntent.search'] += 1
+        filters = dict(re.findall(r"metadata\['(\w+)'\]:'([^']*)'", query))
+        found = [
+            intent for intent in self.intents.values()
+            if all(intent.metadata.get(key) == value for key, value in filters.items())
+        ]
+        return SimpleNamespace(data=found[:limit])
+
+    def payment_intent_cancel(self, intent_id, **kwargs):
+        self.calls['PaymentIntent.cancel'] += 1
+        intent = self.payment_intent_retrieve(intent_id)
+        intent.status = 'canceled'
+        return intent
+
+    def charge_list(self, payment_intent=None, limit=10, **kwargs):
+        self.calls['Charge.list'] += 1
+        intent = self.intents.get(payment_intent)
+        if intent is None or not intent.latest_charge:
+            return SimpleNamespace(data=[])
+        return SimpleNamespace(data=[SimpleNamespace(id=intent.latest_charge, payment_intent=intent.id)])
+
+    def checkout_session_create(self, customer=None, **kwargs):
+        self.calls['checkout.Session.create'] += 1
+        session_id = self._new_id('cs')
+        return SimpleNamespace(id=session_id, customer=customer, url=f'https://checkout.stripe.test/{session_id}')
+
+    def __enter__(self):
+        targets = [
+            (stripe.Customer, 'list', self.customer_list),
+            (stripe.Customer, 'create', self.customer_create),
+            (stripe.PaymentMethod, 'attach', self.payment_method_attach),
+            (stripe.PaymentIntent, 'create', self.payment_intent_create),
+            (stripe.PaymentIntent, 'retrieve', self.payment_intent_retrieve),
+            (stripe.PaymentIntent, 'search', self.payment_intent_search),
+            (stripe.PaymentIntent, 'cancel', self.payment_intent_cancel),
+            (stripe.Charge, 'list', self.charge_list),
+            (stripe.checkout.Session, 'create', self.checkout_session_create),
+        ]
+        self._patches = [patch.object(owner, name, new) for owner, name, new in targets]
+        for stub in self._patches:
+            stub.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for stub in reversed(self._patches):
+            stub.stop()
+        self._patches = []
+        return False
@@ -0,0 +1,79 @@
+"""
+Balises d'images responsives (dérivés calculés par store.images).
+
+    {% load image_tags %}
+    <img src="{{ product.image1|thumbnail_url }}" alt="{{ product.name }}">
+    {% picture product.image1 sizes="(max-width: 600px) 100vw, 320px" alt=product.name %}
+
+Tant que les dérivés ne sont pas prêts, l'original est servi.
+"""
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from store.images import variants_for
+
+register = template.Library()
+
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def _source(image):
+    return getattr(image, 'name', image) or ''
+
+
+def _original_url(image):
+    return image.url if getattr(image, 'name', None) else ''
+
+
+def _widths(variants):
+    return sorted((entry for label, entry in variants.items() if label != 'thumb'), key=lambda entry: entry['width'])
+
+
+@register.simple_tag
+def srcset(image, fmt='webp'):
+    """Valeur srcset des largeurs disponibles dans le format donné ('' si les dérivés ne sont pas prêts)."""
+    variants = variants_for(_source(image))
+    if not variants:
+        return ''
+    return ', '.join(f"{default_storage.url(entry[fmt])} {entry['width']}w" for entry in _widths(variants) if fmt in entry)
+
+
+@register.filter
+def thumbnail_url(image, fmt='jpeg'):
+    """URL de la vignette carrée, ou de l'original à défaut."""
+    variants = variants_for(_source(image))
+    thumb = variants.get('thumb', {}) if variants else {}
+    return default_storage.url(thumb[fmt]) if fmt in thumb else _original_url(image)
+
+
+@register.simple_tag
+def picture(image, sizes='100vw', alt='', css_class=''):
+    """<picture> avec sources AVIF et WebP et repli JPEG ; simple <img> de l'original tant que les dérivés manquent."""
+    if not _source(image):
+        return ''
+    variants = variants_for(_source(image))
+    if not variants:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', _original_url(image), alt, css_class)
+    widths = _widths(variants)
+    sources = format_html_join(
+        '',
+        '<source type="{}" srcset="{}" sizes="{}">',
+        (
+            (MIME_TYPES[fmt], srcset(image, fmt), sizes)
+            for fmt in ('avif', 'webp')
+            if any(fmt in entry for entry in widths)
+        ),
+    )
+    largest = widths[-1]
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" loading="lazy"></picture>',
+        sources,
+        default_storage.url(largest['jpeg']) if 'jpeg' in largest else _original_url(image),
+        srcset(image, 'jpeg'),
+        sizes,
+        largest['width'],
+        largest['height'],
+        alt,
+        css_class,
+    )
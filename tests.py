@@ -105,4 +105,1105 @@ class SellerDashboardTests(TestCase):
         self.assertJSONEqual(response.content, {
             'labels': [],
             'data': [],
-        })
\ No newline at end of file
+        })
+
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from . import search
+from .search import filter_queryset, tokenize, search_product_ids
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.seller = CustomUser.objects.create_user(
+            username='search_seller', email='search_seller@example.com', password='testpass123', user_type='seller'
+        )
+
+    def test_tokenize_folds_accents_and_french_elisions(self):
+        self.assertEqual(tokenize("L'Été des Chaussures"), ['ete', 'chaussure'])
+        self.assertEqual(tokenize("Chevaux en cuir"), ['cheval', 'cuir'])
+
+    def test_search_ranks_name_matches_first(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            in_description = Product.objects.create(
+                seller=self.seller, name='Sac', description='Robe assortie disponible', price=10, stock=1
+            )
+            in_name = Product.objects.create(
+                seller=self.seller, name='Robe été', description='Coton léger', price=20, stock=1
+            )
+        self.assertEqual(search_product_ids('robes'), [in_name.id, in_description.id])
+        self.assertEqual(search_product_ids('ete coton'), [in_name.id])
+
+    @override_settings(SEARCH_MAX_RESULTS=1)
+    def test_filters_apply_before_any_result_limit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(seller=self.seller, name='Robe', description='Lin', price=10, stock=1)
+            expensive = Product.objects.create(seller=self.seller, name='Sac', description='Robe assortie', price=50, stock=1)
+        results = filter_queryset(Product.objects.filter(price__gte=20), 'robe')
+        self.assertEqual([product.id for product in results], [expensive.id])
+
+    def test_filter_orders_by_rank(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            in_description = Product.objects.create(seller=self.seller, name='Sac', description='Robe assortie', price=10, stock=1)
+            in_name = Product.objects.create(seller=self.seller, name='Robe', description='Lin', price=20, stock=1)
+        results = filter_queryset(Product.objects.all(), 'robe')
+        self.assertEqual([product.id for product in results], [in_name.id, in_description.id])
+
+    def test_backend_choice_runs_no_ddl(self):
+        search._backend = None
+        with CaptureQueriesContext(connection) as queries:
+            search.get_backend()
+        self.assertFalse([query for query in queries if query['sql'].lstrip().upper().startswith('CREATE')])
+
+
+from .pagination import CursorPaginator
+
+class CursorPaginatorTests(TestCase):
+    def setUp(self):
+        seller = CustomUser.objects.create_user(
+            username='cursor_seller', email='cursor_seller@example.com', password='testpass123', user_type='seller'
+        )
+        # Prix en double pour vérifier le départage par id
+        for i, price in enumerate([5, 10, 10, 10, 20]):
+            Product.objects.create(seller=seller, name=f'P{i}', description='D', price=price, stock=1)
+
+    def test_walk_forward_and_back(self):
+        paginator = CursorPaginator(Product.objects.all(), 2, 'price')
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        third = paginator.get_page(second.next_cursor)
+        walked = [p.name for page in (first, second, third) for p in page]
+        self.assertEqual(walked, ['P0', 'P1', 'P2', 'P3', 'P4'])
+        self.assertFalse(third.has_next())
+        self.assertEqual([p.name for p in paginator.get_page(third.previous_cursor)], ['P2', 'P3'])
+        self.assertFalse(paginator.get_page(second.previous_cursor).has_previous())
+
+    def test_tampered_cursor_restarts_from_first_page(self):
+        paginator = CursorPaginator(Product.objects.all(), 2, '-created_at')
+        self.assertEqual(len(paginator.get_page('not-a-cursor')), 2)
+        self.assertFalse(paginator.get_page('not-a-cursor').has_previous())
+
+
+from .facets import FacetIndex
+from admin_panel.models import ProductModeration
+
+class FacetIndexTests(TestCase):
+    def setUp(self):
+        self.seller = CustomUser.objects.create_user(
+            username='facet_seller', email='facet_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.category = Category.objects.create(name='Vêtements', slug='vetements')
+        self.index = FacetIndex()
+
+    def create_listed(self, **fields):
+        product = Product.objects.create(seller=self.seller, category=self.category, description='D', price=10, stock=3, **fields)
+        ProductModeration.objects.create(product=product, status='approved')
+        return product
+
+    def test_counts_follow_stock_changes(self):
+        first = self.create_listed(name='A', size='M', brand='Nike')
+        self.create_listed(name='B', size='M', brand='nike ')
+        counts = self.index.counts(self.category.id)
+        self.assertEqual(counts['size'], {'m': 2})
+        self.assertEqual(counts['brand'], {'nike': 2})
+
+        first.stock = 0
+        first.save()
+        self.index.update([first.id])
+        self.assertEqual(self.index.counts()['size'], {'m': 1})
+        sizes = {value: count for value, label, count in self.index.options()['size']}
+        self.assertEqual(sizes['M'], 1)
+        self.assertEqual(sizes['XL'], 0)
+
+
+from datetime import timedelta
+from decimal import Decimal
+from django.utils import timezone
+from .models import Discount
+
+class ActiveDiscountTests(TestCase):
+    def setUp(self):
+        seller = CustomUser.objects.create_user(
+            username='discount_seller', email='discount_seller@example.com', password='testpass123', user_type='seller'
+        )
+        now = timezone.now()
+        self.products = [
+            Product.objects.create(seller=seller, name=f'P{i}', description='D', price=Decimal('100.00'), stock=1)
+            for i in range(3)
+        ]
+        for percentage in (10, 25):
+            Discount.objects.create(product=self.products[0], percentage=percentage,
+                                    start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+        Discount.objects.create(product=self.products[1], percentage=50,
+                                start_date=now - timedelta(days=3), end_date=now - timedelta(days=2))
+
+    def test_annotated_properties_need_no_extra_queries(self):
+        with self.assertNumQueries(1):
+            products = list(Product.objects.filter(id__in=[p.id for p in self.products]).order_by('id').with_active_discount())
+            self.assertEqual([p.discounted_price for p in products], [Decimal('75.00'), Decimal('100.00'), Decimal('100.00')])
+            self.assertEqual([p.active_discount_percentage for p in products], [Decimal('25.00'), 0, 0])
+            self.assertIsNone(products[1].active_discount_end_date)
+
+    def test_unannotated_instance_matches_annotated(self):
+        annotated = Product.objects.with_active_discount().get(id=self.products[0].id)
+        self.assertEqual(self.products[0].discounted_price, annotated.discounted_price)
+
+
+from unittest.mock import patch
+from .pricing import DiscountBoundaryScheduler, with_effective_price
+
+class EffectivePriceTests(TestCase):
+    def setUp(self):
+        seller = CustomUser.objects.create_user(
+            username='price_seller', email='price_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.product = Product.objects.create(seller=seller, name='P', description='D', price=Decimal('80.00'), stock=1)
+
+    def test_discount_boundaries_update_effective_price(self):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_price, Decimal('80.00'))
+
+        start = timezone.now() + timedelta(hours=1)
+        Discount.objects.create(product=self.product, percentage=25, start_date=start, end_date=start + timedelta(hours=1))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_price, Decimal('80.00'))
+
+        scheduler = DiscountBoundaryScheduler()
+        self.assertEqual(scheduler.next_boundary(timezone.now()), start)
+        with patch('store.pricing.timezone.now', return_value=start + timedelta(minutes=1)), \
+                patch('store.models.timezone.now', return_value=start + timedelta(minutes=1)):
+            scheduler.run_due(start - timedelta(seconds=1), start + timedelta(minutes=1))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_price, Decimal('60.00'))
+
+    def test_without_scheduler_filters_use_the_live_price(self):
+        start = timezone.now() + timedelta(hours=1)
+        Discount.objects.create(product=self.product, percentage=25, start_date=start, end_date=start + timedelta(hours=1))
+        with patch('store.models.timezone.now', return_value=start + timedelta(minutes=1)):
+            products, price_field = with_effective_price(Product.objects.filter(id=self.product.id))
+            self.assertTrue(products.filter(**{f'{price_field}__lte': 60}).exists())
+        self.assertFalse(Product.objects.filter(id=self.product.id, effective_price__lte=60).exists())
+
+    def test_save_refreshes_only_when_the_price_changes(self):
+        product = Product.objects.get(id=self.product.id)
+        with patch('store.pricing.refresh_effective_prices') as refresh:
+            product.name = 'Renommé'
+            product.save()
+            refresh.assert_not_called()
+            product.price = Decimal('90.00')
+            product.save()
+            refresh.assert_called_once_with([product.id])
+
+
+from .view_counter import ViewCounter
+
+class ViewCounterTests(TestCase):
+    def setUp(self):
+        seller = CustomUser.objects.create_user(
+            username='views_seller', email='views_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.product = Product.objects.create(seller=seller, name='P', description='D', price=10, stock=1)
+
+    def test_views_are_buffered_until_flush(self):
+        counter = ViewCounter(flush_interval=0, max_pending=100)
+        for _ in range(3):
+            counter.record(self.product.id)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.views, 0)
+        self.assertEqual(counter.pending_views(self.product.id), 3)
+
+        counter.flush()
+        counter.record(self.product.id)
+        counter.flush()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.views, 4)
+        self.assertEqual(ProductView.objects.get(product=self.product).view_count, 4)
+
+    def test_max_pending_one_writes_through(self):
+        counter = ViewCounter(flush_interval=0, max_pending=1)
+        counter.record(self.product.id)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.views, 1)
+
+    def test_full_save_keeps_flushed_views(self):
+        product = Product.objects.get(id=self.product.id)
+        counter = ViewCounter(flush_interval=0, max_pending=100)
+        counter.record(self.product.id)
+        counter.record(self.product.id)
+        counter.flush()
+        product.name = 'Renommé'
+        product.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.views, 2)
+        self.assertEqual(self.product.name, 'Renommé')
+
+
+from .models import UserProductView, UserProductViewDaily
+from .view_events import UserViewSink, rollup_closed_days
+
+class UserViewSinkTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='sink_buyer', email='sink_buyer@example.com', password='testpass123', user_type='buyer'
+        )
+        self.product = Product.objects.create(seller=self.user, name='P', description='D', price=10, stock=1)
+
+    def test_events_are_batched_then_rolled_up(self):
+        sink = UserViewSink(flush_interval=0, max_pending=3)
+        sink.record(self.user.id, self.product.id)
+        sink.record(self.user.id, self.product.id)
+        self.assertEqual(UserProductView.objects.count(), 0)
+        sink.record(self.user.id, self.product.id)
+        self.assertEqual(UserProductView.objects.count(), 3)
+
+        rollup_closed_days(until=timezone.localdate() + timedelta(days=1))
+        self.assertEqual(UserProductView.objects.count(), 0)
+        daily = UserProductViewDaily.objects.get(user=self.user, product=self.product)
+        self.assertEqual((daily.day, daily.view_count), (timezone.localdate(), 3))
+
+    def test_views_flushed_during_rollup_are_kept(self):
+        UserProductView.objects.create(user=self.user, product=self.product)
+        bulk_create = UserProductViewDaily.objects.bulk_create
+
+        def flush_meanwhile(*args, **kwargs):
+            UserProductView.objects.create(user=self.user, product=self.product)
+            return bulk_create(*args, **kwargs)
+
+        with patch.object(UserProductViewDaily.objects, 'bulk_create', side_effect=flush_meanwhile):
+            self.assertEqual(rollup_closed_days(until=timezone.localdate() + timedelta(days=1)), 1)
+        self.assertEqual(UserProductView.objects.count(), 1)
+
+
+from unittest import skipUnless
+import importlib.util
+from .similarity import compute_similar_products, similar_to
+
+class SimilarProductTests(TestCase):
+    def setUp(self):
+        self.seller = CustomUser.objects.create_user(
+            username='similar_seller', email='similar_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.product = Product.objects.create(seller=self.seller, name='Robe', description='D', price=10, stock=1, brand='Zara', color='Rouge')
+
+    def test_attribute_change_flags_product(self):
+        Product.objects.filter(id=self.product.id).update(similarity_dirty=False)
+        product = Product.objects.get(id=self.product.id)
+        product.stock = 5
+        product.save()
+        self.assertFalse(Product.objects.get(id=product.id).similarity_dirty)
+        product.color = 'Bleu'
+        product.save()
+        self.assertTrue(Product.objects.get(id=product.id).similarity_dirty)
+
+    @skipUnless(importlib.util.find_spec('numpy'), "numpy n'est pas installé")
+    def test_neighbors_ranked_by_shared_attributes(self):
+        close = Product.objects.create(seller=self.seller, name='Jupe', description='D', price=10, stock=1, brand='zara', color='Rouge')
+        far = Product.objects.create(seller=self.seller, name='Pull', description='D', price=10, stock=1, color='Rouge')
+        Product.objects.create(seller=self.seller, name='Sac', description='D', price=10, stock=1, brand='Mango')
+        Product.objects.update(is_listed=True)
+
+        compute_similar_products()
+
+        self.assertEqual(list(similar_to(self.product)), [close, far])
+        self.assertFalse(Product.objects.filter(similarity_dirty=True).exists())
+        Product.objects.filter(id=close.id).update(is_listed=False)
+        self.assertEqual(list(similar_to(self.product)), [far])
+
+
+from .models import Favorite, ProductRecommendation
+from .recommendations import _interaction_sources, rebuild_recommendations, recommend_for_user
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.seller = CustomUser.objects.create_user(
+            username='reco_seller', email='reco_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.buyer = CustomUser.objects.create_user(
+            username='reco_buyer', email='reco_buyer@example.com', password='testpass123', user_type='buyer'
+        )
+        self.seed, self.neighbor, self.other = [
+            Product.objects.create(seller=self.seller, name=name, description='D', price=10, stock=1)
+            for name in ('Seed', 'Neighbor', 'Other')
+        ]
+        Product.objects.update(is_listed=True)
+
+    def test_recommend_for_user_sums_neighbor_scores(self):
+        Favorite.objects.create(user=self.buyer, product=self.seed)
+        ProductRecommendation.objects.create(product=self.seed, neighbor=self.neighbor, rank=0, score=0.9)
+        ProductRecommendation.objects.create(product=self.seed, neighbor=self.other, rank=1, score=0.2)
+        # Déjà en favori : jamais recommandé
+        ProductRecommendation.objects.create(product=self.neighbor, neighbor=self.seed, rank=0, score=0.9)
+
+        self.assertEqual(list(recommend_for_user(self.buyer)), [self.neighbor, self.other])
+        self.assertEqual(list(recommend_for_user(self.buyer, exclude=[self.neighbor.id])), [self.other])
+
+    @skipUnless(importlib.util.find_spec('scipy'), "scipy n'est pas installé")
+    def test_rebuild_links_co_favorited_products(self):
+        other_buyer = CustomUser.objects.create_user(
+            username='reco_buyer2', email='reco_buyer2@example.com', password='testpass123', user_type='buyer'
+        )
+        for user in (self.buyer, other_buyer):
+            Favorite.objects.create(user=user, product=self.seed)
+            Favorite.objects.create(user=user, product=self.neighbor)
+        Favorite.objects.create(user=other_buyer, product=self.other)
+
+        rebuild_recommendations()
+
+        neighbors = list(ProductRecommendation.objects.filter(product=self.seed).values_list('neighbor_id', flat=True))
+        self.assertEqual(neighbors, [self.neighbor.id, self.other.id])
+
+    def test_rolled_up_views_weigh_as_much_as_raw_views(self):
+        for _ in range(3):
+            UserProductView.objects.create(user=self.buyer, product=self.seed)
+        UserProductViewDaily.objects.create(user=self.buyer, product=self.neighbor, day=timezone.localdate(), view_count=3)
+        views = {}
+        for event, queryset in _interaction_sources():
+            if event == 'view':
+                for user_id, product_id, count in queryset:
+                    views[product_id] = views.get(product_id, 0) + count
+        self.assertEqual(views, {self.seed.id: 3, self.neighbor.id: 3})
+
+
+from datetime import datetime
+from django.test import override_settings
+from .models import PopularityRollup
+from .popularity import close_day, rebuild_popularity
+
+@override_settings(POPULARITY_WINDOW_DAYS=2, POPULARITY_HALF_LIFE_DAYS=None)
+class PopularityTests(TestCase):
+    def setUp(self):
+        seller = CustomUser.objects.create_user(
+            username='popular_seller', email='popular_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.product = Product.objects.create(seller=seller, name='P', description='D', price=10, stock=1)
+        self.today = timezone.localdate()
+
+    def _views(self, days_ago, count):
+        view = ProductView.objects.create(product=self.product, view_count=count)
+        day = self.today - timedelta(days=days_ago)
+        ProductView.objects.filter(id=view.id).update(
+            view_date=timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        )
+
+    def _score(self):
+        return Product.objects.get(id=self.product.id).popularity_score
+
+    def test_window_slides_as_days_close(self):
+        self._views(3, 5)
+        self._views(2, 7)
+        self._views(1, 11)
+        rebuild_popularity(until=self.today - timedelta(days=2))
+        self.assertEqual(self._score(), 12)
+
+        close_day(self.today - timedelta(days=1))
+        self.assertEqual(self._score(), 18)
+        # Une ligne par journée de la fenêtre reconstruite, plus la journée close
+        self.assertEqual(PopularityRollup.objects.count(), 3)
+
+    def test_views_written_after_closing_are_not_subtracted(self):
+        self._views(3, 4)
+        rebuild_popularity(until=self.today - timedelta(days=3))
+        # Vues de la journée déjà close, écrites en retard
+        self._views(3, 6)
+        close_day(self.today - timedelta(days=2))
+        close_day(self.today - timedelta(days=1))
+        self.assertEqual(self._score(), 0)
+
+    @override_settings(POPULARITY_HALF_LIFE_DAYS=1)
+    def test_decay_halves_each_day(self):
+        self._views(2, 8)
+        rebuild_popularity(until=self.today - timedelta(days=2))
+        close_day(self.today - timedelta(days=1))
+        self.assertEqual(self._score(), 4)
+
+    def test_full_save_of_stale_instance_keeps_score(self):
+        self._views(1, 6)
+        stale = Product.objects.get(id=self.product.id)
+        close_day(self.today - timedelta(days=1))
+        stale.save()
+        self.assertEqual(self._score(), 6)
+
+
+from .models import Review, SellerProfile, SellerRating
+from .ratings import reconcile_ratings
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.seller = CustomUser.objects.create_user(
+            username='rating_seller', email='rating_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.buyer = CustomUser.objects.create_user(
+            username='rating_buyer', email='rating_buyer@example.com', password='testpass123', user_type='buyer'
+        )
+        self.product = Product.objects.create(seller=self.seller, name='P', description='D', price=10, stock=1)
+
+    def _product(self):
+        return Product.objects.get(id=self.product.id)
+
+    def test_review_lifecycle_updates_aggregates(self):
+        review = Review.objects.create(product=self.product, user=self.buyer, rating=4)
+        product = self._product()
+        self.assertEqual((product.rating_sum, product.rating_count, product.average_rating), (4, 1, 4.0))
+
+        review = Review.objects.get(id=review.id)
+        review.rating = 2
+        review.save()
+        product = self._product()
+        self.assertEqual((product.rating_sum, product.rating_histogram['4'], product.rating_histogram['2']), (2, 0, 1))
+
+        review.delete()
+        product = self._product()
+        self.assertEqual((product.rating_sum, product.rating_count, product.average_rating), (0, 0, 0))
+
+    def test_seller_rating_and_reconcile(self):
+        order = Order.objects.create(user=self.buyer, seller=self.seller, total=10)
+        SellerRating.objects.create(seller=self.seller, rater=self.buyer, order=order, rating=5)
+        self.assertEqual(SellerProfile.objects.get(user=self.seller).rating_count, 1)
+
+        Product.objects.filter(id=self.product.id).update(rating_sum=9, rating_count=3)
+        self.assertEqual(reconcile_ratings(), (1, 0))
+        self.assertEqual(self._product().rating_count, 0)
+
+    def test_full_save_of_stale_instance_keeps_aggregates(self):
+        stale_product = self._product()
+        stale_profile, _ = SellerProfile.objects.get_or_create(user=self.seller)
+        Review.objects.create(product=self.product, user=self.buyer, rating=5)
+        order = Order.objects.create(user=self.buyer, seller=self.seller, total=10)
+        SellerRating.objects.create(seller=self.seller, rater=self.buyer, order=order, rating=3)
+        stale_product.save()
+        stale_profile.save()
+        self.assertEqual(self._product().rating_sum, 5)
+        self.assertEqual(SellerProfile.objects.get(user=self.seller).rating_sum, 3)
+        self.assertEqual(Product.objects.with_rating().get(id=self.product.id).avg_rating, 0)
+
+
+from django.core.cache import caches
+from .fragment_cache import FragmentCache
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.cache = FragmentCache(alias='default', prefix='test-fragment')
+        self.calls = 0
+
+    def _compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_invalidating_a_tag_only_expires_dependent_fragments(self):
+        self.assertEqual(self.cache.get_or_set('reviews', 1, self._compute, tags=['reviews:1']), 1)
+        self.assertEqual(self.cache.get_or_set('price', 1, self._compute, tags=['price:1']), 2)
+        self.assertEqual(self.cache.get_or_set('reviews', 1, self._compute, tags=['reviews:1']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cache.invalidate('reviews:1')
+
+        self.assertEqual(self.cache.get_or_set('reviews', 1, self._compute, tags=['reviews:1']), 3)
+        self.assertEqual(self.cache.get_or_set('price', 1, self._compute, tags=['price:1']), 2)
+        self.assertEqual(self.cache.stats()['reviews'][:2], (1, 2))
+        self.assertEqual(self.cache.stats()['price'][:2], (1, 1))
+
+
+from .models import Cart, CartItem
+from .pricing import CartPricer
+
+class CartPricerTests(TestCase):
+    def setUp(self):
+        seller = CustomUser.objects.create_user(
+            username='cart_seller', email='cart_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.buyer = CustomUser.objects.create_user(
+            username='cart_buyer', email='cart_buyer@example.com', password='testpass123', user_type='buyer'
+        )
+        self.cart = Cart.objects.create(user=self.buyer)
+        for index in range(5):
+            product = Product.objects.create(seller=seller, name=f'P{index}', description='D', price=Decimal('20.00'), stock=5)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+            if index == 0:
+                now = timezone.now()
+                Discount.objects.create(product=product, percentage=Decimal('50'), start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+
+    def test_prices_whole_cart_in_one_query(self):
+        with self.assertNumQueries(1):
+            priced = CartPricer(self.buyer).price(self.cart)
+            self.assertEqual(priced.subtotal, Decimal('180.00'))
+            self.assertEqual(priced.lines[0].unit_price, Decimal('10.00'))
+        self.assertEqual(priced.total, Decimal('185.00'))
+        priced.shipping_cost = Decimal('0.00')
+        self.assertEqual(priced.total, Decimal('180.00'))
+
+
+from django.contrib.sessions.backends.db import SessionStore
+from .session_cart import SessionCart, merge_into_cart
+
+class SessionCartTests(TestCase):
+    def setUp(self):
+        seller = CustomUser.objects.create_user(
+            username='session_seller', email='session_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.buyer = CustomUser.objects.create_user(
+            username='session_buyer', email='session_buyer@example.com', password='testpass123', user_type='buyer'
+        )
+        self.shirt = Product.objects.create(seller=seller, name='Shirt', description='D', price=Decimal('10.00'), stock=3)
+        self.hat = Product.objects.create(seller=seller, name='Hat', description='D', price=Decimal('5.00'), stock=10)
+
+    def test_session_cart_prices_and_merges_on_login(self):
+        session_cart = SessionCart(SessionStore())
+        session_cart.set(self.shirt.id, 2)
+        session_cart.set(self.hat.id, 1)
+        self.assertEqual(session_cart.price().subtotal, Decimal('25.00'))
+
+        cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.create(cart=cart, product=self.shirt, quantity=2)
+        merge_into_cart(self.buyer, session_cart.quantities)
+
+        quantities = dict(cart.items.values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.shirt.id: 3, self.hat.id: 1})
+
+
+from .inventory import InsufficientStock, convert_reservations, release_reservations, reserve_cart, sweep_expired_reservations
+from .models import StockReservation
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        seller = CustomUser.objects.create_user(
+            username='stock_seller', email='stock_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.alice, self.bob = [
+            CustomUser.objects.create_user(username=name, email=f'{name}@example.com', password='testpass123', user_type='buyer')
+            for name in ('stock_alice', 'stock_bob')
+        ]
+        self.product = Product.objects.create(seller=seller, name='Lamp', description='D', price=Decimal('30.00'), stock=3)
+
+    def _lines(self, user, quantity):
+        cart, _ = Cart.objects.get_or_create(user=user)
+        cart.items.all().delete()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        return list(cart.items.select_related('product'))
+
+    def test_reservations_hold_stock_until_converted_or_expired(self):
+        reserve_cart(self.alice, self._lines(self.alice, 2))
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual((product.reserved_stock, product.available_stock), (2, 1))
+
+        with self.assertRaises(InsufficientStock):
+            reserve_cart(self.bob, self._lines(self.bob, 2))
+
+        convert_reservations(self.alice, self._lines(self.alice, 2))
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual((product.stock, product.reserved_stock), (1, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+        reserve_cart(self.bob, self._lines(self.bob, 1), ttl=timedelta(seconds=-1))
+        self.assertTrue(Product.objects.get(id=self.product.id).is_sold_out)
+        self.assertEqual(sweep_expired_reservations(), 1)
+        self.assertEqual(Product.objects.get(id=self.product.id).available_stock, 1)
+
+    def test_full_save_of_stale_instance_keeps_reservations(self):
+        stale = Product.objects.get(id=self.product.id)
+        reserve_cart(self.alice, self._lines(self.alice, 2))
+        stale.name = 'Lampe'
+        stale.save()
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual((product.name, product.reserved_stock, product.available_stock), ('Lampe', 2, 1))
+
+    def test_conversion_ignores_expired_reservations_not_yet_swept(self):
+        reserve_cart(self.bob, self._lines(self.bob, 3), ttl=timedelta(seconds=-1))
+        convert_reservations(self.alice, self._lines(self.alice, 2))
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual((product.stock, product.reserved_stock), (1, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_removing_cart_item_releases_its_reservation(self):
+        lines = self._lines(self.alice, 2)
+        reserve_cart(self.alice, lines)
+        self.client.force_login(self.alice)
+        self.client.post(reverse('store:remove_from_cart', args=[lines[0].id]))
+        self.assertEqual(Product.objects.get(id=self.product.id).reserved_stock, 0)
+        self.assertEqual(release_reservations(self.alice), 0)
+
+
+from .orders import place_order
+from .pricing import CartPricer
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        self.seller = CustomUser.objects.create_user(
+            username='order_seller', email='order_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.buyer = CustomUser.objects.create_user(
+            username='order_buyer', email='order_buyer@example.com', password='testpass123', user_type='buyer'
+        )
+        self.cart = Cart.objects.create(user=self.buyer)
+        self.products = [
+            Product.objects.create(seller=self.seller, name=f'P{index}', description='D', price=Decimal('10.00'), stock=2)
+            for index in range(3)
+        ]
+        for product in reversed(self.products):
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def test_places_order_in_batch(self):
+        order = place_order(self.buyer, CartPricer(self.buyer).price(self.cart), payment_method='card')
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(order.seller, self.seller)
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {0})
+
+    def test_nothing_is_written_when_stock_is_short(self):
+        Product.objects.filter(id=self.products[1].id).update(stock=1)
+        with self.assertRaises(InsufficientStock):
+            place_order(self.buyer, CartPricer(self.buyer).price(self.cart), payment_method='card')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(id=self.products[0].id).stock, 2)
+
+
+from .checkout import PaymentFailed, charge, compensate, recover_stale_sagas, start_checkout
+from .models import CheckoutSaga
+
+class CheckoutSagaTests(TestCase):
+    def setUp(self):
+        self.seller = CustomUser.objects.create_user(
+            username='saga_seller', email='saga_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.buyer = CustomUser.objects.create_user(
+            username='saga_buyer', email='saga_buyer@example.com', password='testpass123', user_type='buyer'
+        )
+        self.product = Product.objects.create(seller=self.seller, name='P', description='D', price=Decimal('10.00'), stock=5)
+        self.cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+
+    def start(self):
+        return start_checkout(self.buyer, CartPricer(self.buyer).price(self.cart), 'card', 'pm_test')
+
+    def test_start_decrements_stock_and_opens_saga(self):
+        saga = self.start()
+        self.assertEqual(saga.state, 'started')
+        self.assertEqual(saga.order.status, 'pending')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    @patch('store.checkout._charge_card', side_effect=PaymentFailed("Carte refusée"))
+    def test_declined_payment_is_compensated(self, charge_card):
+        saga = self.start()
+        with self.assertRaises(PaymentFailed):
+            charge(saga, return_url='http://testserver/')
+        saga.refresh_from_db()
+        self.assertEqual(saga.state, 'compensated')
+        self.assertEqual(saga.order.status, 'cancelled')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    @patch('store.checkout._charge_card', side_effect=ConnectionError("timeout"))
+    def test_unknown_outcome_is_left_to_the_sweeper(self, charge_card):
+        saga = self.start()
+        with self.assertRaises(PaymentFailed):
+            charge(saga, return_url='http://testserver/')
+        saga.refresh_from_db()
+        self.assertEqual(saga.state, 'charging')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    @patch('store.checkout._charge_card')
+    def test_saga_already_claimed_is_not_charged(self, charge_card):
+        saga = self.start()
+        compensate(saga, "Expirée")
+        with self.assertRaises(PaymentFailed):
+            charge(saga, return_url='http://testserver/')
+        charge_card.assert_not_called()
+
+    def test_stale_saga_never_charged_is_compensated(self):
+        saga = self.start()
+        CheckoutSaga.objects.filter(id=saga.id).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(recover_stale_sagas(), (0, 1, 0))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+
+from .payments import stripe_customer_id
+from .stripe_stub import StripeStub
+
+@override_settings(STRIPE_SECRET_KEY='sk_test_stub')
+class StripeCustomerCacheTests(TestCase):
+    def setUp(self):
+        self.seller = CustomUser.objects.create_user(
+            username='stripe_seller', email='stripe_seller@example.com', password='testpass123', user_type='seller'
+        )
+        self.buyer = CustomUser.objects.create_user(
+            username='stripe_buyer', email='stripe_buyer@example.com', password='testpass123', user_type='buyer'
+        )
+        self.product = Product.objects.create(seller=self.seller, name='P', description='D', price=Decimal('10.00'), stock=5)
+        self.cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+
+    def test_customer_is_created_once_and_cached(self):
+        with StripeStub() as stub:
+            first = stripe_customer_id(self.buyer)
+            buyer = CustomUser.objects.get(id=self.buyer.id)
+            self.assertEqual(buyer.stripe_customer_id, first)
+            self.assertEqual(stripe_customer_id(buyer), first)
+        self.assertEqual(stub.calls['Customer.list'], 1)
+        self.assertEqual(stub.calls['Customer.create'], 1)
+
+    @patch('store.checkout._reward')
+    def test_repeat_payment_skips_customer_lookup(self, reward):
+        with StripeStub() as stub:
+            for _ in range(2):
+                buyer = CustomUser.objects.get(id=self.buyer.id)
+                saga = start_checkout(buyer, CartPricer(buyer).price(self.cart), 'card', 'pm_test')
+                charge(saga, return_url='http://testserver/')
+                saga.refresh_from_db()
+                self.assertEqual(saga.state, 'confirmed')
+        self.assertEqual(stub.calls['Customer.list'] + stub.calls['Customer.create'], 2)
+        self.assertEqual(stub.calls['PaymentIntent.create'], 2)
+        self.assertEqual(stub.calls['Charge.list'], 0)
+
+
+from django.test import RequestFactory
+from unittest.mock import MagicMock
+from .idempotency import begin, request_key
+from .models import Address, IdempotencyRecord, ProcessedWebhookEvent, ShippingOption
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='idem_buyer', email='idem_buyer@example.com', password='testpass123', user_type='buyer',
+            stripe_customer_id='cus_idem'
+        )
+
+    def post(self, data):
+        request = RequestFactory().post('/store/payment/process/', data)
+        request.user = self.user
+        return request
+
+    def test_client_key_wins_over_derived_key(self):
+        first = request_key(self.post({'idempotency_key': 'abc', 'address': '1'}), 'x')
+        second = request_key(self.post({'idempotency_key': 'abc', 'address': '2'}), 'y')
+        self.assertEqual(first, second)
+        self.assertNotEqual(request_key(self.post({'address': '1'}), 'x'), request_key(self.post({'address': '1'}), 'y'))
+
+    def test_duplicate_returns_existing_record(self):
+        record, first = begin('process_payment', 'k' * 64, self.user)
+        duplicate, again = begin('process_payment', 'k' * 64, self.user)
+        self.assertTrue(first)
+        self.assertFalse(again)
+        self.assertEqual(duplicate.id, record.id)
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+    @patch('stripe.Webhook.construct_event')
+    def test_webhook_event_is_processed_once(self, construct_event):
+        construct_event.return_value = {'id': 'evt_1', 'type': 'customer.deleted', 'data': {'object': {'id': 'cus_idem'}}}
+        url = reverse('store:stripe_webhook')
+        self.assertEqual(self.client.post(url, data='{}', content_type='application/json').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.stripe_customer_id)
+        CustomUser.objects.filter(id=self.user.id).update(stripe_customer_id='cus_idem')
+        self.assertEqual(self.client.post(url, data='{}', content_type='application/json').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.stripe_customer_id, 'cus_idem')
+        self.assertEqual(ProcessedWebhookEvent.objects.count(), 1)
+
+    @patch('store.views.LocationForm')
+    @patch('store.checkout._charge_card', return_value='ch_idem')
+    def test_failure_after_charge_keeps_the_key(self, charge_card, location_form):
+        location_form.return_value.save.return_value.photo = None
+        seller = CustomUser.objects.create_user(
+            username='idem_seller', email='idem_seller@example.com', password='testpass123', user_type='seller'
+        )
+        product = Product.objects.create(seller=seller, name='P', description='D', price=Decimal('10.00'), stock=5)
+        address = Address.objects.create(
+            user=self.user, full_name='Idem', street_address='1 rue', city='Paris', postal_code='75001', country='France'
+        )
+        option = ShippingOption.objects.create(name='Standard', cost=Decimal('5.00'), estimated_days=3)
+        data = {'address': address.id, 'shipping_option': option.id, 'payment_method': 'card', 'payment_method_id': 'pm_idem'}
+        self.client.force_login(self.user)
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=product, quantity=1)
+        with patch('store.views.Delivery', MagicMock(**{'objects.create.side_effect': RuntimeError('panne')})):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('store:process_payment'), data)
+        # Même panier soumis à nouveau : même clé, pas de second débit
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=product, quantity=1)
+        response = self.client.post(reverse('store:process_payment'), data)
+        self.assertEqual(charge_card.call_count, 1)
+        record = IdempotencyRecord.objects.get(user=self.user)
+        self.assertEqual(record.status, 'completed')
+        self.assertRedirects(response, reverse('store:payment_success', kwargs={'order_id': record.order_id}), fetch_redirect_response=False)
+
+
+import math
+import os
+import random
+import tempfile
+from . import geocoding
+from .models import GeocodeCacheEntry
+
+class GeocodingTests(TestCase):
+    def setUp(self):
+        geocoding.clear_caches()
+        self.addCleanup(geocoding.clear_caches)
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        handle.write('latitude,longitude,city,postal_code,country\n')
+        handle.write('48.8566,2.3522,Paris,75001,France\n')
+        handle.write('45.7640,4.8357,Lyon,69001,France\n')
+        handle.write('36.7538,3.0588,Alger,16000,Algérie\n')
+        handle.close()
+        self.addCleanup(os.remove, handle.name)
+        self.gazetteer_path = handle.name
+
+    def test_kd_tree_matches_brute_force(self):
+        rng = random.Random(7)
+        points = [geocoding._unit_vector(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(500)]
+        tree = geocoding.KDTree(points)
+        for _ in range(50):
+            target = geocoding._unit_vector(rng.uniform(-90, 90), rng.uniform(-180, 180))
+            expected = min(range(len(points)), key=lambda index: math.dist(points[index], target))
+            self.assertEqual(tree.nearest(target)[0], expected)
+
+    def test_offline_backend_answers_without_network(self):
+        with override_settings(GEOCODE_BACKEND='gazetteer', GEOCODE_GAZETTEER_PATH=self.gazetteer_path), \
+                patch('store.geocoding._nominatim') as nominatim:
+            address = geocoding.reverse_geocode(48.86, 2.35)
+            self.assertEqual(address['city'], 'Paris')
+            self.assertIsNone(geocoding.reverse_geocode(0.0, -140.0))
+        nominatim.assert_not_called()
+        self.assertFalse(GeocodeCacheEntry.objects.exists())
+
+    @patch('store.geocoding._nominatim', return_value={'street_address': 'Rue de Rivoli', 'city': 'Paris', 'postal_code': '75001', 'country': 'France'})
+    def test_rounded_coordinates_share_one_lookup(self, nominatim):
+        self.assertEqual(geocoding.reverse_geocode(48.856601, 2.352201)['street_address'], 'Rue de Rivoli')
+        geocoding.reverse_geocode(48.856604, 2.352204)
+        self.assertEqual(nominatim.call_count, 1)
+        geocoding.clear_caches()
+        geocoding.reverse_geocode(48.8566, 2.3522)
+        self.assertEqual(nominatim.call_count, 1)
+        self.assertEqual(GeocodeCacheEntry.objects.get().key, '48.8566,2.3522')
+
+    @patch('store.geocoding._nominatim', side_effect=geocoding.GeocodingError('timeout'))
+    def test_gazetteer_is_the_fallback_when_nominatim_fails(self, nominatim):
+        with override_settings(GEOCODE_GAZETTEER_PATH=self.gazetteer_path):
+            self.assertEqual(geocoding.reverse_geocode(45.76, 4.84)['city'], 'Lyon')
+        # Le repli n'est pas gardé : Nominatim est de nouveau interrogé dès l'appel suivant
+        nominatim.side_effect = None
+        nominatim.return_value = {'street_address': 'Rue de la République', 'city': 'Lyon', 'postal_code': '69002', 'country': 'France'}
+        self.assertEqual(geocoding.reverse_geocode(45.76, 4.84)['street_address'], 'Rue de la République')
+
+    def test_malformed_gazetteer_does_not_raise(self):
+        with open(self.gazetteer_path, 'a', encoding='utf-8') as handle:
+            handle.write('not-a-number,2.35,Nulle part,,\n')
+        with override_settings(GEOCODE_BACKEND='gazetteer', GEOCODE_GAZETTEER_PATH=self.gazetteer_path):
+            self.assertIsNone(geocoding.reverse_geocode(48.86, 2.35))
+
+
+import struct
+from .exif import read_exif_gps
+
+def jpeg_with_gps(latitude, longitude, order='<'):
+    """JPEG minimal (JFIF + APP1 Exif avec un IFD GPS, sans données d'image décodables)."""
+    def rationals(value):
+        degrees = int(value)
+        minutes = int((value - degrees) * 60)
+        seconds = round(((value - degrees) * 60 - minutes) * 60 * 100)
+        return struct.pack(order + 'IIIIII', degrees, 1, minutes, 1, seconds, 100)
+
+    ifd0 = struct.pack(order + 'H', 1) + struct.pack(order + 'HHII', 0x8825, 4, 1, 26) + struct.pack(order + 'I', 0)
+    values = 26 + 2 + 4 * 12 + 4
+    gps = struct.pack(order + 'H', 4)
+    gps += struct.pack(order + 'HHI', 1, 2, 2) + (b'N' if latitude >= 0 else b'S') + bytes(3)
+    gps += struct.pack(order + 'HHII', 2, 5, 3, values)
+    gps += struct.pack(order + 'HHI', 3, 2, 2) + (b'E' if longitude >= 0 else b'W') + bytes(3)
+    gps += struct.pack(order + 'HHII', 4, 5, 3, values + 24)
+    gps += struct.pack(order + 'I', 0)
+    tiff = (b'II' if order == '<' else b'MM') + struct.pack(order + 'HI', 42, 8) + ifd0 + gps
+    app1 = b'Exif\x00\x00' + tiff + rationals(abs(latitude)) + rationals(abs(longitude))
+    jfif = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    return b'\xff\xd8' + jfif + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + b'\xff\xda' + bytes(64)
+
+class ExifGpsTests(TestCase):
+    def test_reads_gps_from_both_byte_orders(self):
+        latitude, longitude = read_exif_gps(jpeg_with_gps(48.8566, 2.3522))
+        self.assertAlmostEqual(latitude, 48.8566, places=4)
+        self.assertAlmostEqual(longitude, 2.3522, places=4)
+        latitude, longitude = read_exif_gps(jpeg_with_gps(-33.8688, -151.2093, order='>'))
+        self.assertAlmostEqual(latitude, -33.8688, places=4)
+        self.assertAlmostEqual(longitude, -151.2093, places=4)
+
+    def test_missing_or_truncated_exif_gives_no_position(self):
+        self.assertEqual(read_exif_gps(b'\xff\xd8\xff\xda' + bytes(16)), (None, None))
+        self.assertEqual(read_exif_gps(b'not a jpeg'), (None, None))
+        self.assertEqual(read_exif_gps(jpeg_with_gps(10.0, 10.0)[:60]), (None, None))
+
+
+import io
+from django.core.cache import cache
+from PIL import Image
+from .images import derived_name
+from .imaging import render_derivatives
+from .models import ImageAsset
+from .templatetags.image_tags import picture, srcset, thumbnail_url
+
+class ImageDerivativeTests(TestCase):
+    def encode(self, size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (200, 30, 30)).save(buffer, format='JPEG')
+        return buffer.getvalue()
+
+    def test_renders_thumbnail_and_widths_without_upscaling(self):
+        width, height, variants = render_derivatives(self.encode((1200, 800)), widths=(320, 640, 1024, 2048), formats=('jpeg', 'webp'))
+        self.assertEqual((width, height), (1200, 800))
+        self.assertEqual(sorted(variants), ['1024', '320', '640', 'thumb'])
+        self.assertEqual((variants['thumb']['width'], variants['thumb']['height']), (200, 200))
+        self.assertEqual((variants['640']['width'], variants['640']['height']), (640, 427))
+        self.assertEqual(Image.open(io.BytesIO(variants['320']['webp'])).format, 'WEBP')
+
+        _, _, small = render_derivatives(self.encode((150, 100)), widths=(320, 640), formats=('jpeg',))
+        self.assertEqual(small['150']['width'], 150)
+
+    def test_derived_names_sit_next_to_the_original(self):
+        self.assertEqual(derived_name('products/chaise.png', 'abcdef0123456789', '640', 'webp'), 'products/chaise.abcdef012345.640.webp')
+        self.assertEqual(derived_name('products/chaise.png', 'abcdef0123456789', 'thumb', 'jpeg'), 'products/chaise.abcdef012345.thumb.jpg')
+
+    def test_template_helpers_fall_back_to_the_original(self):
+        cache.clear()
+        self.assertEqual(srcset('products/chaise.png'), '')
+        ImageAsset.objects.create(source='products/chaise.png', status='ready', variants={
+            'thumb': {'width': 200, 'height': 200, 'jpeg': 'products/chaise.abc.thumb.jpg'},
+            '320': {'width': 320, 'height': 213, 'jpeg': 'products/chaise.abc.320.jpg', 'webp': 'products/chaise.abc.320.webp'},
+            '640': {'width': 640, 'height': 427, 'jpeg': 'products/chaise.abc.640.jpg', 'webp': 'products/chaise.abc.640.webp'},
+        })
+        cache.clear()
+        self.assertIn('chaise.abc.320.webp 320w', srcset('products/chaise.png'))
+        self.assertTrue(thumbnail_url('products/chaise.png').endswith('chaise.abc.thumb.jpg'))
+        html = picture('products/chaise.png', sizes='320px', alt='Chaise')
+        self.assertIn('type="image/webp"', html)
+        self.assertNotIn('image/avif', html)
+        self.assertIn('width="640"', html)
+
+
+from PIL import ImageDraw
+from .images import _fingerprinted, derivative_options, duplicate_suspects, hamming, hash_blocks, near_duplicates
+from .imaging import fingerprint
+
+class PerceptualDuplicateTests(TestCase):
+    def photo(self, size, shapes, quality=90):
+        image = Image.new('RGB', (400, 300), (240, 240, 240))
+        draw = ImageDraw.Draw(image)
+        for box, colour in shapes:
+            draw.rectangle(box, fill=colour)
+        buffer = io.BytesIO()
+        image.resize(size).save(buffer, format='JPEG', quality=quality)
+        return buffer.getvalue()
+
+    def asset(self, source, value):
+        return ImageAsset.objects.create(source=source, status='ready', perceptual_hash=f'{value:016x}', **hash_blocks(value))
+
+    def test_dhash_survives_resize_and_recompression(self):
+        shapes = [((20, 20, 180, 140), (200, 20, 20)), ((220, 150, 380, 280), (20, 20, 200))]
+        _, _, original = fingerprint(self.photo((400, 300), shapes))
+        _, _, smaller = fingerprint(self.photo((200, 150), shapes, quality=60))
+        _, _, other = fingerprint(self.photo((400, 300), [((200, 20, 380, 140), (20, 200, 20))]))
+        self.assertLessEqual(hamming(original, smaller), 3)
+        self.assertGreater(hamming(original, other), 10)
+
+    def test_block_index_finds_hashes_within_three_bits(self):
+        base = 0x0123456789ABCDEF
+        near = self.asset('products/near.jpg', base ^ 0b111)
+        self.asset('products/far.jpg', base ^ 0xFFFF0000FFFF0000)
+        self.assertEqual([(3, near)], near_duplicates(base, 3))
+
+    def test_duplicate_suspects_match_products_across_sellers(self):
+        seller = CustomUser.objects.create_user(username='dup_seller', email='dup_seller@example.com', password='testpass123', user_type='seller')
+        other_seller = CustomUser.objects.create_user(username='dup_other', email='dup_other@example.com', password='testpass123', user_type='seller')
+        self.asset('products/a.jpg', 0xAAAA)
+        self.asset('products/b.jpg', 0xAAAB)
+        self.asset('products/c.jpg', 0xFFFF00000000FFFF)
+        product = Product.objects.create(seller=seller, name='A', description='D', price=Decimal('10.00'), stock=1, image1='products/a.jpg')
+        copy = Product.objects.create(seller=other_seller, name='B', description='D', price=Decimal('10.00'), stock=1, image2='products/b.jpg')
+        Product.objects.create(seller=other_seller, name='C', description='D', price=Decimal('10.00'), stock=1, image1='products/c.jpg')
+        with self.assertNumQueries(3):
+            suspects = duplicate_suspects([product])
+        self.assertEqual(suspects, {product.id: [(copy, 1)]})
+
+    def test_same_dhash_is_never_reused(self):
+        self.asset('products/red.jpg', 0xAAAA)
+        upload = ImageAsset.objects.create(source='products/blue.jpg')
+        with patch('store.images.run_in_pool') as run_in_pool, patch('store.images.default_storage') as storage:
+            _fingerprinted(upload, 'digest', b'', derivative_options(), (400, 300, 0xAAAA))
+        run_in_pool.assert_called_once()
+        storage.delete.assert_not_called()
+        upload.refresh_from_db()
+        self.assertIsNone(upload.duplicate_of)
+        self.assertEqual(upload.perceptual_hash, '000000000000aaaa')
+
+
+
+from django.db import DatabaseError
+from .models import Favorite, Notification, NotificationFanOut
+from .notifications import create_notifications, notify_users, resume_stale_fan_outs
+
+
+def run_now(function, *args):
+    function(*args)
+
+
+@patch('store.notifications.push_notifications')
+@patch('store.notifications.in_background', side_effect=run_now)
+class NotificationFanOutTests(TestCase):
+    def setUp(self):
+        self.users = [CustomUser.objects.create_user(username=f'fan{index}', password='pass123', user_type='buyer') for index in range(5)]
+
+    @override_settings(NOTIFICATION_BATCH_SIZE=2, NOTIFICATION_ASYNC_THRESHOLD=10)
+    def test_small_fan_out_is_created_in_the_transaction(self, in_background, push):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertNumQueries(3):
+                count = notify_users(self.users + [self.users[0].id], 'Promo', 'product_discount', related_object_id=7)
+        self.assertEqual(count, 5)
+        self.assertEqual(Notification.objects.filter(notification_type='product_discount', related_object_id=7).count(), 5)
+        push.assert_not_called()
+        callbacks[0]()
+        push.assert_called_once_with([user.id for user in self.users], 'Promo', 'product_discount', 7)
+
+    @override_settings(NOTIFICATION_BATCH_SIZE=2, NOTIFICATION_ASYNC_THRESHOLD=3)
+    def test_large_fan_out_waits_for_commit(self, in_background, push):
+        with self.captureOnCommitCallbacks() as callbacks:
+            notify_users(self.users, 'Promo', 'product_discount')
+        self.assertFalse(Notification.objects.exists())
+        callbacks[0]()
+        self.assertEqual(Notification.objects.filter(user__in=self.users).count(), 5)
+        self.assertEqual([len(call.args[0]) for call in push.call_args_list], [2, 2, 1])
+        self.assertEqual(NotificationFanOut.objects.get().status, 'done')
+
+    @override_settings(NOTIFICATION_BATCH_SIZE=2, NOTIFICATION_ASYNC_THRESHOLD=3)
+    def test_interrupted_fan_out_resumes_after_the_last_chunk(self, in_background, push):
+        calls = []
+
+        def fail_second_chunk(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise DatabaseError('connexion perdue')
+            create_notifications(*args)
+
+        with patch('store.notifications.create_notifications', side_effect=fail_second_chunk):
+            with self.captureOnCommitCallbacks(execute=True):
+                notify_users(self.users, 'Promo', 'product_discount')
+        job = NotificationFanOut.objects.get()
+        self.assertEqual((job.status, job.delivered, Notification.objects.count()), ('pending', 2, 2))
+
+        self.assertEqual(resume_stale_fan_outs(now=timezone.now() + timedelta(hours=1)), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.delivered, job.attempts), ('done', 5, 2))
+        self.assertEqual(Notification.objects.filter(user__in=self.users).count(), 5)
+
+    def test_discount_notifies_favoriters(self, in_background, push):
+        seller = CustomUser.objects.create_user(username='promo_seller', password='pass123', user_type='seller')
+        category = Category.objects.create(name='Promo')
+        product = Product.objects.create(seller=seller, category=category, name='Lampe', description='D', price=Decimal('40.00'), stock=3)
+        for user in self.users:
+            Favorite.objects.create(user=user, product=product)
+        self.client.login(username='promo_seller', password='pass123')
+        start = timezone.localtime() + timedelta(hours=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('store:apply_discount_for_product', args=[product.id]), {
+                'products': [product.id],
+                'percentage': 10,
+                'start_date': start.strftime('%Y-%m-%dT%H:%M'),
+                'end_date': (start + timedelta(days=7)).strftime('%Y-%m-%dT%H:%M'),
+            })
+        self.assertEqual(Notification.objects.filter(notification_type='product_discount', related_object_id=product.id).count(), 5)
@@ -18,6 +18,7 @@ urlpatterns = [
     path('address/add/', views.add_address, name='add_address'),
     path('checkout/', views.checkout, name='checkout'),
     path('geocode/', views.geocode, name='geocode'),  # Nouvel endpoint
+    path('geocode/photo/<int:job_id>/', views.photo_geotag_status, name='photo_geotag_status'),
     path('payment/process/', views.process_payment, name='process_payment'),
     path('payment/success/<int:order_id>/', views.payment_success, name='payment_success'),
     path('orders/', views.order_history, name='order_history'),
@@ -0,0 +1,97 @@
+"""
+Compteur de vues différé pour product_detail.
+
+Les vues sont agrégées en mémoire par produit et par jour, puis écrites par
+lots : un UPDATE ... SET views = views + n par valeur d'incrément distincte pour
+Product, et mise à jour groupée / bulk_create pour les lignes journalières de ProductView.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, When
+from django.utils import timezone
+
+from .buffering import BufferedWriter
+from .models import Product, ProductView
+
+logger = logging.getLogger(__name__)
+
+
+def _group_by_increment(counter):
+    """{n: [clés]} pour écrire un seul UPDATE par incrément distinct."""
+    groups = defaultdict(list)
+    for key, count in counter.items():
+        groups[count].append(key)
+    return groups
+
+
+class ViewCounter(BufferedWriter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._views = Counter()
+        self._daily = Counter()  # (product_id, jour) -> vues
+
+    def record(self, product_id):
+        """Compte une vue ; l'écriture en base est différée."""
+        with self._lock:
+            self._views[product_id] += 1
+            self._daily[(product_id, timezone.localdate())] += 1
+        self._added()
+
+    def pending_views(self, product_id):
+        """Vues comptées mais pas encore écrites, à ajouter à Product.views pour l'affichage."""
+        return self._views.get(product_id, 0)
+
+    def _take(self):
+        snapshot = (self._views, self._daily)
+        self._views, self._daily = Counter(), Counter()
+        return snapshot
+
+    def _restore(self, snapshot):
+        views, daily = snapshot
+        self._views.update(views)
+        self._daily.update(daily)
+
+    def _write(self, snapshot):
+        views, daily = snapshot
+        with transaction.atomic():
+            for increment, product_ids in _group_by_increment(views).items():
+                Product.objects.filter(id__in=product_ids).update(views=F('views') + increment)
+
+            per_day = defaultdict(Counter)
+            for (product_id, day), count in daily.items():
+                per_day[day][product_id] += count
+            for day, counts in per_day.items():
+                self._write_day(day, counts)
+        logger.debug(f"Vues écrites pour {len(views)} produits")
+
+    def _write_day(self, day, counts):
+        existing = dict(
+            ProductView.objects.filter(product_id__in=list(counts), view_date__date=day)
+            .values_list('product_id', 'id')
+        )
+        if existing:
+            ProductView.objects.filter(id__in=existing.values()).update(view_count=F('view_count') + Case(
+                *[When(id=row_id, then=counts[product_id]) for product_id, row_id in existing.items()],
+                output_field=IntegerField(),
+            ))
+        missing = [
+            ProductView(product_id=product_id, view_count=count)
+            for product_id, count in counts.items() if product_id not in existing
+        ]
+        if not missing:
+            return
+        created = ProductView.objects.bulk_create(missing)
+        if day != timezone.localdate():
+            # view_date est en auto_now_add : on rattache les lignes tardives à leur jour
+            day_start = timezone.make_aware(datetime.combine(day, time.min))
+            ProductView.objects.filter(id__in=[row.id for row in created if row.id]).update(view_date=day_start)
+
+
+view_counter = ViewCounter(
+    flush_interval=getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 5.0),
+    max_pending=getattr(settings, 'VIEW_COUNTER_MAX_PENDING', 1000),
+)
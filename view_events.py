@@ -0,0 +1,105 @@
+"""
+Journal des vues produit des utilisateurs connectés (UserProductView).
+
+Les événements sont mis en file en mémoire et écrits par bulk_create ; les
+journées closes sont ensuite agrégées en lignes (utilisateur, produit, jour)
+dans UserProductViewDaily, et les agrégats anciens supprimés selon la rétention.
+"""
+import logging
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .buffering import BufferedWriter
+from .models import UserProductView, UserProductViewDaily
+
+logger = logging.getLogger(__name__)
+
+
+class UserViewSink(BufferedWriter):
+    def __init__(self, *args, batch_size=500, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size
+        self._events = []
+
+    def record(self, user_id, product_id):
+        with self._lock:
+            self._events.append((user_id, product_id, timezone.now()))
+        self._added()
+
+    def _take(self):
+        events, self._events = self._events, []
+        return events
+
+    def _restore(self, snapshot):
+        self._events[:0] = snapshot
+
+    def _write(self, snapshot):
+        UserProductView.objects.bulk_create(
+            [UserProductView(user_id=user_id, product_id=product_id, view_date=viewed_at)
+             for user_id, product_id, viewed_at in snapshot],
+            batch_size=self.batch_size,
+        )
+
+
+def rollup_closed_days(until=None):
+    """
+    Agrège les vues brutes antérieures au jour `until` (aujourd'hui par défaut)
+    dans UserProductViewDaily puis supprime les lignes brutes agrégées.
+    Retourne le nombre de vues brutes traitées.
+    """
+    until = until or timezone.localdate()
+    cutoff = timezone.make_aware(datetime.combine(until, time.min))
+    raw = UserProductView.objects.filter(view_date__lt=cutoff)
+    with transaction.atomic():
+        # Borne fixée avant l'agrégation : les vues écrites pendant le traitement
+        # (même datées d'avant cutoff) restent pour le prochain passage
+        last_id = raw.aggregate(last_id=Max('id'))['last_id']
+        if last_id is None:
+            return 0
+        raw = raw.filter(id__lte=last_id)
+        rows = list(
+            raw.annotate(day=TruncDate('view_date'))
+            .values('user_id', 'product_id', 'day')
+            .annotate(view_count=Count('id'))
+        )
+        if not rows:
+            return 0
+        days = {row['day'] for row in rows}
+        existing = {
+            (daily.user_id, daily.product_id, daily.day): daily
+            for daily in UserProductViewDaily.objects.filter(day__in=days).select_for_update()
+        }
+        to_create, to_update = [], []
+        for row in rows:
+            daily = existing.get((row['user_id'], row['product_id'], row['day']))
+            if daily:
+                daily.view_count += row['view_count']
+                to_update.append(daily)
+            else:
+                to_create.append(UserProductViewDaily(**row))
+        UserProductViewDaily.objects.bulk_create(to_create, batch_size=1000)
+        UserProductViewDaily.objects.bulk_update(to_update, ['view_count'], batch_size=1000)
+        processed = sum(row['view_count'] for row in rows)
+        raw.delete()
+    logger.info(f"{processed} vues utilisateur agrégées en {len(rows)} lignes journalières")
+    return processed
+
+
+def prune_daily_views(retention_days=None):
+    """Supprime les agrégats plus anciens que la rétention (USER_VIEW_RETENTION_DAYS)."""
+    retention_days = retention_days or getattr(settings, 'USER_VIEW_RETENTION_DAYS', 180)
+    oldest = timezone.localdate() - timedelta(days=retention_days)
+    deleted, _ = UserProductViewDaily.objects.filter(day__lt=oldest).delete()
+    return deleted
+
+
+user_view_sink = UserViewSink(
+    flush_interval=getattr(settings, 'USER_VIEW_FLUSH_INTERVAL', 10.0),
+    max_pending=getattr(settings, 'USER_VIEW_BATCH_SIZE', 500),
+    batch_size=getattr(settings, 'USER_VIEW_BATCH_SIZE', 500),
+)
@@ -3,35 +3,48 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.db.models import Q, Sum, Avg, F, ExpressionWrapper, DecimalField
+from django.db.models import F, ExpressionWrapper, DecimalField
 from django.db import transaction
 from django.contrib.auth import get_user_model
 import stripe
-import requests
 import paypalrestsdk
 from django.conf import settings
-from .models import Product, ProductView, Cart, CartItem, Order, OrderItem, Favorite, Category, Review, Notification, Address, ShippingOption, SellerProfile, Conversation, Message, SellerRating, UserProductView, Subscription, ProductRequest, Discount
+from .models import Product, Cart, CartItem, Order, OrderItem, Favorite, Category, Review, Notification, Address, ShippingOption, SellerProfile, Conversation, Message, SellerRating, Subscription, ProductRequest, Discount, PhotoGeotagJob, prefetch_active_discount
 import logging
 from .forms import ProductForm, OrderStatusForm, ReviewForm, AddressForm, ApplyDiscountForm, SellerProfileForm, ProductRequestForm, ReportForm, ShippingMethodForm
 from django.db import OperationalError, IntegrityError
 from django.http import HttpResponse, JsonResponse
 import json
+import uuid
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.utils import timezone
 from django.urls import reverse
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from datetime import date, timedelta
-from marketing.models import LoyaltyPoint, PromoCode
-from admin_panel.models import ProductModeration
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import View
 from returns.models import ReturnRequest
 from returns.forms import ReturnRequestForm
 from delivery.forms import LocationForm
 from delivery.models import Delivery, Location
-from delivery.utils import get_exif_data, get_gps_info
+from . import search
+from .pagination import CursorPaginator, cursor_context
+from .facets import facet_index
+from .view_counter import view_counter
+from .view_events import user_view_sink
+from .similarity import similar_to
+from .recommendations import recommend_for_user
+from .fragment_cache import fragment_cache
+from .pricing import CartPricer, active_discount_snapshot, with_effective_price
+from .session_cart import SessionCart, user_cart
+from .inventory import InsufficientStock, release_reservations, reserve_cart
+from .checkout import PaymentFailed, charge, start_checkout
+from .payments import forget_stripe_customer, stripe_customer_id
+from .notifications import notify_users
+from .idempotency import abandon, begin, claim_webhook_event, complete, request_key
+from .geocoding import reverse_geocode
+from .media_jobs import enqueue_geotag
 
 # Configurer le logging
 logger = logging.getLogger(__name__)
@@ -62,6 +75,9 @@ def home(request):
         'unread_notifications': unread_notifications
     })
 
+# Colonnes de tri du catalogue utilisables par la pagination par curseur
+KEYSET_SORT_FIELDS = {'effective_price', 'created_at', 'popularity_score', 'id'}
+
 def product_list(request, category_slug=None):
     # Récupération des paramètres de filtrage
     query = request.GET.get('q', '')
@@ -75,33 +91,22 @@ def product_list(request, category_slug=None):
     color_filter = request.GET.get('color', '')
     material_filter = request.GET.get('material', '')
 
-    # Base queryset - Filtre uniquement les produits approuvés
-    products = Product.objects.filter(
-        sold_out=False,
-        is_sold=False,
-    ).select_related('category')
-
-    # Filtre pour les produits approuvés
-    approved_product_ids = ProductModeration.objects.filter(status='approved').values_list('product_id', flat=True)
-    products = products.filter(id__in=approved_product_ids)
+    # Base queryset - Produits approuvés, disponibles et en stock (colonne is_listed)
+    products = Product.objects.filter(is_listed=True).select_related('category').with_active_discount()
 
-    # Filtrage par recherche
+    # Filtrage par recherche (index plein texte, classé par pertinence)
     if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) | 
-            Q(brand__icontains=query) | 
-            Q(color__icontains=query) | 
-            Q(material__icontains=query)
-        )
+        products = search.filter_queryset(products, query, order_by_rank=sort_by == 'default')
 
     # Filtrage par catégorie
     selected_category = ''
+    selected_category_id = None
     if category_slug:
         try:
             category = get_object_or_404(Category, slug=category_slug)
             products = products.filter(category=category)
             selected_category = category.name
+            selected_category_id = category.id
         except OperationalError:
             pass
     elif category_name:
@@ -110,15 +115,17 @@ def product_list(request, category_slug=None):
             if category:
                 products = products.filter(category=category)
                 selected_category = category.name
+                selected_category_id = category.id
         except OperationalError:
             pass
 
-    # Filtrage par prix
+    # Filtrage par prix effectif (après réduction active)
+    products, price_field = with_effective_price(products)
     try:
         if price_min:
-            products = products.filter(price__gte=float(price_min))
+            products = products.filter(**{f'{price_field}__gte': float(price_min)})
         if price_max:
-            products = products.filter(price__lte=float(price_max))
+            products = products.filter(**{f'{price_field}__lte': float(price_max)})
     except ValueError:
         pass
 
@@ -142,18 +149,26 @@ def product_list(request, category_slug=None):
 
     # Tri
     sort_options = {
-        'price_asc': 'price',
-        'price_desc': '-price',
+        'price_asc': price_field,
+        'price_desc': f'-{price_field}',
         'views_desc': '-view_count',
         'date_desc': '-created_at',
-        'date_asc': 'created_at'
+        'date_asc': 'created_at',
+        'trending': '-popularity_score',
     }
-    products = products.order_by(sort_options.get(sort_by, 'id'))
-
-    # Pagination
-    paginator = Paginator(products, settings.PRODUCTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    ranked_by_search = bool(query) and sort_by == 'default'
+    ordering = sort_options.get(sort_by, 'id')
+    if not ranked_by_search:
+        products = products.order_by(ordering)
+
+    # Pagination : par curseur (keyset, sans COUNT ni OFFSET) quand ?cursor= est
+    # présent et que le tri porte sur une colonne, sinon par numéro de page
+    if 'cursor' in request.GET and not ranked_by_search and ordering.lstrip('-') in KEYSET_SORT_FIELDS:
+        page_obj = CursorPaginator(products, settings.PRODUCTS_PER_PAGE, ordering).get_page(request.GET['cursor'])
+    else:
+        paginator = Paginator(products, settings.PRODUCTS_PER_PAGE)
+        page_number = request.GET.get('page')
+        page_obj = paginator.get_page(page_number)
 
     now = timezone.now()
     # Préparation des données pour le template
@@ -171,7 +186,10 @@ def product_list(request, category_slug=None):
         'color_filter': color_filter,
         'material_filter': material_filter,
         'product_sizes': Product.SIZE_CHOICES,
-        'now': timezone.now()
+        # Compteurs par valeur de filtre, lus depuis l'index en mémoire (0 = option à désactiver)
+        'facets': facet_index.options(category_id=selected_category_id),
+        'now': timezone.now(),
+        **cursor_context(page_obj),
     }
 
     return render(request, 'store/product_list.html', context)
@@ -179,38 +197,42 @@ def product_list(request, category_slug=None):
 def product_detail(request, product_id):
     # Récupération du produit et mise à jour des vues
     product = get_object_or_404(Product, id=product_id)
-    product.views += 1
-    product.save()
-
-    # Enregistrement de la vue dans ProductView (stats journalières)
-    today = date.today()
-    product_view, created = ProductView.objects.get_or_create(
-        product=product,
-        view_date=today,
-        defaults={'view_count': 1}
+
+    # Réduction active (fragment 'price', invalidé par les changements de Discount)
+    percentage, end_date, _ = fragment_cache.get_or_set(
+        'price', product.id, lambda: active_discount_snapshot(product.id),
+        tags=[f'price:{product.id}'], timeout=lambda snapshot: fragment_cache.timeout_until(snapshot[2]),
     )
-    if not created:
-        product_view.view_count += 1
-        product_view.save()
+    product.best_discount_percentage, product.best_discount_end_date = percentage, end_date
+
+    # Vue comptée en mémoire puis écrite par lots (Product.views et ProductView journalier)
+    view_counter.record(product.id)
+    product.views += view_counter.pending_views(product.id)
 
     # Enregistrement de la vue utilisateur si authentifié
     if request.user.is_authenticated:
-        UserProductView.objects.create(user=request.user, product=product)
+        user_view_sink.record(request.user.id, product.id)
 
     # Gestion des favoris
-    favorite_count = Favorite.objects.filter(product=product).count()
+    favorite_count = fragment_cache.get_or_set(
+        'favorites', product.id, lambda: Favorite.objects.filter(product=product).count(),
+        tags=[f'favorites:{product.id}'],
+    )
     is_favorite = Favorite.objects.filter(user=request.user, product=product).exists() if request.user.is_authenticated else False
 
     # Calcul de la note moyenne
-    average_rating = product.reviews.aggregate(Avg('rating'))['rating__avg'] or 0
+    average_rating = product.average_rating
 
     # Gestion des avis
-    reviews = product.reviews.all().order_by('-created_at')
+    reviews = fragment_cache.get_or_set(
+        'reviews', product.id, lambda: list(product.reviews.select_related('user').order_by('-created_at')),
+        tags=[f'reviews:{product.id}'],
+    )
     can_review = False
     has_reviewed = False
     
     if request.user.is_authenticated:
-        has_reviewed = Review.objects.filter(product=product, user=request.user).exists()
+        has_reviewed = any(review.user_id == request.user.id for review in reviews)
         if request.user.user_type == 'buyer':
             has_purchased = OrderItem.objects.filter(
                 order__user=request.user,
@@ -246,56 +268,36 @@ def product_detail(request, product_id):
         review_form = ReviewForm()
 
     # Produits similaires
-    similar_products = Product.objects.filter(
-        Q(category=product.category) |
-        Q(brand=product.brand) |
-        Q(color=product.color) |
-        Q(material=product.material)
-    ).exclude(id=product.id).filter(
-        is_sold=False,
-        sold_out=False,
-        stock__gt=0
-    ).annotate(
-        avg_rating=Avg('reviews__rating')
-    ).order_by('-avg_rating', '-views')[:4]
-
-    # Produits recommandés (basés sur les favoris de l'utilisateur)
+    similar_products = fragment_cache.get_or_set(
+        'similar', product.id, lambda: list(similar_to(product).with_active_discount().with_rating()[:4]),
+        tags=['similar'],
+    )
+
+    # Produits recommandés (co-occurrences des favoris, achats et vues de l'utilisateur)
     recommended_products = []
     if request.user.is_authenticated:
-        favorite_categories = Favorite.objects.filter(user=request.user).values('product__category').distinct()
-        favorite_brands = Favorite.objects.filter(user=request.user).values('product__brand').distinct()
-        recommended_products = Product.objects.filter(
-            Q(category__in=favorite_categories) |
-            Q(brand__in=favorite_brands)
-        ).exclude(id=product.id).filter(
-            is_sold=False,
-            sold_out=False,
-            stock__gt=0
-        ).annotate(
-            avg_rating=Avg('reviews__rating')
-        ).order_by('-avg_rating', '-views')[:4]
-
-        if len(recommended_products) < 4:
-            popular_products = Product.objects.exclude(id=product.id).filter(
-                is_sold=False,
-                sold_out=False,
-                stock__gt=0
-            ).annotate(
-                avg_rating=Avg('reviews__rating')
-            ).order_by('-views')[:4 - len(recommended_products)]
-            recommended_products = list(recommended_products) + list(popular_products)
-
-    # Produits populaires (basés sur les vues des 30 derniers jours)
-    thirty_days_ago = today - timedelta(days=30)
-    popular_products = Product.objects.filter(
-        product_views__view_date__gte=thirty_days_ago,
-        is_sold=False,
-        sold_out=False,
-        stock__gt=0
-    ).exclude(id=product.id).annotate(
-        total_views=Sum('product_views__view_count'),
-        avg_rating=Avg('reviews__rating')
-    ).order_by('-total_views')[:4]
+        def compute_recommended():
+            recommended = list(recommend_for_user(request.user, exclude=[product.id]).with_active_discount()[:4])
+            if len(recommended) < 4:
+                recommended += list(Product.objects.exclude(
+                    id__in=[product.id] + [item.id for item in recommended]
+                ).filter(is_listed=True).with_active_discount().order_by('-views')[:4 - len(recommended)])
+            return recommended
+
+        recommended_products = fragment_cache.get_or_set(
+            'recommended', f'{request.user.id}:{product.id}', compute_recommended,
+            tags=['recommendations', f'favorites:user:{request.user.id}'],
+        )
+
+    # Produits populaires (score de popularité maintenu par store.popularity) : un seul fragment
+    # pour tout le catalogue, le produit affiché est retiré à la lecture
+    popular_products = fragment_cache.get_or_set(
+        'popular', 'all', lambda: list(Product.objects.filter(
+            is_listed=True, popularity_score__gt=0
+        ).with_active_discount().order_by('-popularity_score')[:5]),
+        tags=['popularity'],
+    )
+    popular_products = [popular for popular in popular_products if popular.id != product.id][:4]
 
     # Vérification si la réduction est active
     now = timezone.now()
@@ -353,14 +355,12 @@ def product_update(request, pk):
             has_image = product.image1 or product.image2 or product.image3
             logger.info(f"Product updated: {product.name}, Images: {has_image and 'Present' or 'None'}, Size: {product.size} (was {old_size}), Brand: {product.brand} (was {old_brand}), Color: {product.color} (was {old_color}), Material: {product.material} (was {old_material})")
             if product.price < old_price:
-                favorites = Favorite.objects.filter(product=product)
-                for favorite in favorites:
-                    Notification.objects.create(
-                        user=favorite.user,
-                        message=f"Le produit '{product.name}' que vous avez mis en favori est en promotion ! Nouveau prix : {product.discounted_price} €.",
-                        notification_type='product_discount',
-                        related_object_id=product.id
-                    )
+                notify_users(
+                    Favorite.objects.filter(product=product).values_list('user_id', flat=True),
+                    f"Le produit '{product.name}' que vous avez mis en favori est en promotion ! Nouveau prix : {product.discounted_price} €.",
+                    'product_discount',
+                    related_object_id=product.id,
+                )
             messages.success(request, f"Produit mis à jour avec succès ! Images: {has_image and 'Présentes' or 'Aucune'}")
             return redirect('store:product_detail', product_id=product.id)
         else:
@@ -383,60 +383,26 @@ def product_delete(request, pk):
         return redirect('store:product_list')
     return render(request, 'store/product_confirm_delete.html', {'product': product})
 
-@login_required
 def cart(request):
-    try:
-        cart = Cart.objects.get(user=request.user)
-        logger.info(f"Cart retrieved for user {request.user.username}: {cart.id}")
-    except Cart.DoesNotExist:
-        cart = Cart.objects.create(user=request.user)
-        logger.info(f"New cart created for user {request.user.username}: {cart.id}")
-    except Cart.MultipleObjectsReturned:
-        carts = Cart.objects.filter(user=request.user).order_by('created_at')
-        cart = carts.first()
-        logger.warning(f"Multiple carts found for user {request.user.username}, merging into {cart.id}")
-        for duplicate_cart in carts[1:]:
-            for item in duplicate_cart.items.all():
-                existing_item, created = CartItem.objects.get_or_create(cart=cart, product=item.product)
-                if not created:
-                    existing_item.quantity += item.quantity
-                    existing_item.save()
-            duplicate_cart.delete()
-
-    cart_items = cart.items.all()
-    logger.info(f"Cart items for user {request.user.username}: {cart_items.count()} items")
-    
-    # Calcul des montants en Decimal
-    subtotal = sum(item.subtotal for item in cart_items)
-    shipping_cost = Decimal('5.00')
-    discount_amount = Decimal('0.00')
-    
-    # Vérification d'un code promo existant dans la session
-    promo_code = request.session.get('promo_code')
-    if promo_code:
-        try:
-            code = PromoCode.objects.get(code=promo_code)
-            if code.is_valid(user=request.user):
-                discount_amount = code.apply(subtotal)
-            else:
-                del request.session['promo_code']
-                del request.session['discount_amount']
-        except PromoCode.DoesNotExist:
-            del request.session['promo_code']
-            del request.session['discount_amount']
+    if request.user.is_authenticated:
+        cart = user_cart(request.user)
+        # Lignes, produits et réductions en une requête ; code promo de la session revalidé
+        priced = CartPricer(request.user, request.session).price(cart)
+        logger.info(f"Cart items for user {request.user.username}: {len(priced)} items")
+    else:
+        # Visiteur anonyme : panier de session, fusionné à la connexion
+        cart = None
+        priced = SessionCart(request.session).price()
 
-    total = subtotal + shipping_cost - discount_amount
-    
     return render(request, 'store/cart.html', {
         'cart': cart,
-        'cart_items': cart_items,
-        'subtotal': subtotal,
-        'shipping_cost': shipping_cost,
-        'discount_amount': discount_amount,
-        'total': total
+        'cart_items': priced.lines,
+        'subtotal': priced.subtotal,
+        'shipping_cost': priced.shipping_cost,
+        'discount_amount': priced.discount_amount,
+        'total': priced.total
     })
 
-@login_required
 def add_to_cart(request, product_id):
     try:
         product = get_object_or_404(Product, id=product_id)
@@ -444,8 +410,18 @@ def add_to_cart(request, product_id):
             messages.error(request, "Ce produit est vendu ou en rupture de stock.")
             return redirect('store:product_detail', product_id=product.id)
 
+        if not request.user.is_authenticated:
+            session_cart = SessionCart(request.session)
+            quantity = session_cart.quantity(product.id) + 1
+            if quantity > product.stock:
+                messages.error(request, f"Stock insuffisant. Seulement {product.stock} unités disponibles.")
+                return redirect('store:cart')
+            session_cart.set(product.id, quantity)
+            messages.success(request, f"{product.name} ajouté au panier !")
+            return redirect('store:cart')
+
         with transaction.atomic():
-            cart, created = Cart.objects.get_or_create(user=request.user)
+            cart = user_cart(request.user)
             logger.info(f"Cart retrieved/created for user {request.user.username} in add_to_cart: {cart.id}")
 
             cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
@@ -472,16 +448,22 @@ def add_to_cart(request, product_id):
         messages.error(request, "Une erreur inattendue est survenue. Veuillez contacter le support.")
         return redirect('store:product_detail', product_id=product_id)
 
-@login_required
 def remove_from_cart(request, item_id):
+    if not request.user.is_authenticated:
+        # Panier de session : l'identifiant de ligne est celui du produit
+        SessionCart(request.session).remove(item_id)
+        messages.success(request, "Article retiré du panier.")
+        return redirect('store:cart')
     cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
     logger.info(f"Removed item {cart_item.product.name} from cart for user {request.user.username}")
     cart_item.delete()
+    release_reservations(request.user, [cart_item.product_id])
     messages.success(request, "Article retiré du panier.")
     return redirect('store:cart')
 
-@login_required
 def update_cart(request, item_id):
+    if not request.user.is_authenticated:
+        return update_session_cart(request, item_id)
     cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
@@ -496,10 +478,27 @@ def update_cart(request, item_id):
         else:
             logger.info(f"Removed item {cart_item.product.name} from cart for user {request.user.username}")
             cart_item.delete()
+            release_reservations(request.user, [cart_item.product_id])
             messages.success(request, "Article retiré du panier.")
         return redirect('store:cart')
     return render(request, 'store/update_cart.html', {'cart_item': cart_item})
 
+def update_session_cart(request, product_id):
+    session_cart = SessionCart(request.session)
+    if not session_cart.quantity(product_id):
+        return redirect('store:cart')
+    product = get_object_or_404(Product, id=product_id)
+    if request.method == 'POST':
+        quantity = int(request.POST.get('quantity', 1))
+        if quantity > product.stock:
+            messages.error(request, f"Stock insuffisant. Seulement {product.stock} unités disponibles.")
+            return redirect('store:cart')
+        session_cart.set(product.id, quantity)
+        messages.success(request, "Panier mis à jour." if quantity > 0 else "Article retiré du panier.")
+        return redirect('store:cart')
+    cart_item = CartItem(id=product.id, product=product, quantity=session_cart.quantity(product.id))
+    return render(request, 'store/update_cart.html', {'cart_item': cart_item})
+
 @login_required
 def add_address(request):
     if request.user.user_type != 'buyer':
@@ -524,30 +523,20 @@ def add_address(request):
 
 @login_required
 def checkout(request):
-    try:
-        cart = Cart.objects.get(user=request.user)
-        logger.info(f"Cart retrieved for user {request.user.username}: {cart.id}")
-    except Cart.DoesNotExist:
-        cart = Cart.objects.create(user=request.user)
-        logger.info(f"New cart created for user {request.user.username}: {cart.id}")
-    except Cart.MultipleObjectsReturned:
-        carts = Cart.objects.filter(user=request.user).order_by('created_at')
-        cart = carts.first()
-        logger.warning(f"Multiple carts found for user {request.user.username}, merging into {cart.id}")
-        for duplicate_cart in carts[1:]:
-            for item in duplicate_cart.cartitem_set.all():
-                existing_item, created = CartItem.objects.get_or_create(cart=cart, product=item.product)
-                if not created:
-                    existing_item.quantity += item.quantity
-                    existing_item.save()
-            duplicate_cart.delete()
+    cart = user_cart(request.user)
 
-    if not cart.items.exists():
+    priced = CartPricer(request.user, request.session).price(cart, shipping_cost=Decimal('0.00'))
+    if priced.is_empty:
         messages.error(request, "Votre panier est vide.")
         return redirect('store:cart')
 
-    cart_items = cart.items.all()
-    subtotal = sum(item.subtotal for item in cart_items)
+    # Le stock du panier est réservé le temps du paiement (prolongé à chaque affichage)
+    try:
+        reservation_expires_at = reserve_cart(request.user, priced.lines)
+    except InsufficientStock as e:
+        messages.error(request, f"Stock insuffisant pour {e.product.name}. Seulement {e.available} unités disponibles.")
+        return redirect('store:cart')
+
     addresses = Address.objects.filter(user=request.user)
     shipping_options = ShippingOption.objects.filter(is_active=True)
 
@@ -563,34 +552,18 @@ def checkout(request):
         messages.warning(request, "Veuillez ajouter une adresse avant de continuer.")
         return redirect('store:add_address', next=reverse('store:checkout'))
 
-    shipping_cost = Decimal('0.00')
     selected_shipping_option = None
-    discount_amount = Decimal(request.session.get('discount_amount', '0.00'))
-    promo_code = request.session.get('promo_code')
     latitude = None
     longitude = None
     geocoded_address = None
+    geotag_job = None
 
-    if promo_code and discount_amount > 0:
-        try:
-            code = PromoCode.objects.get(code=promo_code)
-            if not code.is_valid(user=request.user):
-                discount_amount = Decimal('0.00')
-                messages.error(request, "Code promo invalide ou expiré.")
-                del request.session['promo_code']
-                del request.session['discount_amount']
-        except PromoCode.DoesNotExist:
-            discount_amount = Decimal('0.00')
-            messages.error(request, "Code promo introuvable.")
-            del request.session['promo_code']
-            del request.session['discount_amount']
+    if priced.promo_error:
+        messages.error(request, priced.promo_error)
 
     if shipping_option_form.is_valid():
-        shipping_option_id = shipping_option_form.cleaned_data['shipping_option'].id
-        selected_shipping_option = ShippingOption.objects.get(id=shipping_option_id)
-        shipping_cost = selected_shipping_option.cost
-
-    total = subtotal + shipping_cost - discount_amount
+        selected_shipping_option = shipping_option_form.cleaned_data['shipping_option']
+        priced.shipping_cost = selected_shipping_option.cost
 
     if request.method == 'POST' and location_form.is_valid():
         photo = location_form.cleaned_data['photo']
@@ -599,71 +572,51 @@ def checkout(request):
         longitude = location_form.cleaned_data.get('longitude')
 
         if photo:
-            try:
-                exif_data = get_exif_data(photo)
-                gps_latitude, gps_longitude = get_gps_info(exif_data)
-                if gps_latitude is not None and gps_longitude is not None:
-                    latitude = gps_latitude
-                    longitude = gps_longitude
-                    logger.info(f"GPS coordinates extracted: lat={latitude}, lon={longitude}")
-                else:
-                    logger.warning("No GPS data found in photo")
-                    messages.warning(request, "Aucune donnée GPS trouvée dans la photo. Veuillez sélectionner une position sur la carte.")
-            except Exception as e:
-                logger.error(f"Error extracting GPS data: {e}")
-                messages.warning(request, "Erreur lors de l'extraction des données GPS. Veuillez sélectionner une position sur la carte.")
-        else:
-            logger.info("No photo provided, using form coordinates if available")
-
-        if latitude and longitude:
+            # Photo enregistrée tout de suite ; sa position GPS est extraite en arrière-plan (store.media_jobs)
             location = Location.objects.create(
                 user=request.user,
                 description=description,
                 latitude=latitude,
                 longitude=longitude,
-                photo=photo if photo else None
+                photo=photo
             )
-            # Convertir les coordonnées en adresse via Nominatim
-            try:
-                response = requests.get(
-                    'https://nominatim.openstreetmap.org/reverse',
-                    params={
-                        'lat': latitude,
-                        'lon': longitude,
-                        'format': 'json',
-                        'addressdetails': 1
-                    },
-                    headers={'User-Agent': 'EcommerceApp/1.0'}
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    address_data = data.get('address', {})
-                    geocoded_address = Address.objects.create(
-                        user=request.user,
-                        full_name=request.user.username,
-                        street_address=address_data.get('road', 'Inconnue'),
-                        city=address_data.get('city', '') or address_data.get('town', '') or address_data.get('village', ''),
-                        postal_code=address_data.get('postcode', ''),
-                        country=address_data.get('country', 'Inconnue'),
-                        is_default=False
-                    )
-                    messages.success(request, "Adresse extraite des coordonnées GPS.")
-                    addresses = Address.objects.filter(user=request.user)  # Rafraîchir la liste des adresses
-                else:
-                    messages.warning(request, "Impossible de convertir les coordonnées en adresse.")
-            except Exception as e:
-                logger.error(f"Error geocoding coordinates: {e}")
-                messages.warning(request, "Erreur lors de la conversion des coordonnées en adresse.")
+            geotag_job = enqueue_geotag(location)
+            messages.info(request, "Photo reçue : sa position GPS est en cours d'extraction.")
         else:
+            logger.info("No photo provided, using form coordinates if available")
+
+        if latitude and longitude:
+            if not photo:
+                location = Location.objects.create(
+                    user=request.user,
+                    description=description,
+                    latitude=latitude,
+                    longitude=longitude,
+                    photo=None
+                )
+            # Convertir les coordonnées en adresse (cache local, puis Nominatim ou gazetier)
+            address_data = reverse_geocode(latitude, longitude)
+            if address_data:
+                geocoded_address = Address.objects.create(
+                    user=request.user,
+                    full_name=request.user.username,
+                    is_default=False,
+                    **address_data
+                )
+                messages.success(request, "Adresse extraite des coordonnées GPS.")
+                addresses = Address.objects.filter(user=request.user)  # Rafraîchir la liste des adresses
+            else:
+                messages.warning(request, "Impossible de convertir les coordonnées en adresse.")
+        elif not photo:
             messages.warning(request, "Veuillez fournir une photo avec des données GPS ou sélectionner une position sur la carte.")
 
     context = {
         'cart': cart,
-        'cart_items': cart_items,
-        'subtotal': subtotal,
-        'shipping_cost': shipping_cost,
-        'discount_amount': discount_amount,
-        'total': total,
+        'cart_items': priced.lines,
+        'subtotal': priced.subtotal,
+        'shipping_cost': priced.shipping_cost,
+        'discount_amount': priced.discount_amount,
+        'total': priced.total,
         'addresses': addresses,
         'shipping_options': shipping_options,
         'address_form': address_form,
@@ -672,9 +625,13 @@ def checkout(request):
         'latitude': latitude,
         'longitude': longitude,
         'geocoded_address': geocoded_address,
+        'geotag_job': geotag_job,
         'stripe_publishable_key': settings.STRIPE_PUBLISHABLE_KEY,
         'paypal_client_id': settings.PAYPAL_CLIENT_ID,
-        'promo_code': promo_code,
+        'promo_code': priced.promo_code,
+        'reservation_expires_at': reservation_expires_at,
+        # Renvoyée avec le formulaire de paiement : une double soumission ne crée qu'une commande
+        'idempotency_key': uuid.uuid4().hex,
     }
 
     return render(request, 'store/checkout.html', context)
@@ -693,8 +650,9 @@ paypalrestsdk.configure({
 })
 
 @login_required
-@transaction.atomic
 def process_payment(request):
+    # Pas de transaction englobante : les appels à Stripe/PayPal se font hors
+    # transaction, entre deux transactions courtes (store.checkout)
     if request.method != 'POST':
         messages.error(request, "Méthode non autorisée.")
         return redirect('store:checkout')
@@ -706,27 +664,68 @@ def process_payment(request):
         messages.error(request, "Votre panier est vide.")
         return redirect('store:cart')
 
-    cart_items = cart.items.all()
-    if not cart_items.exists():
+    # Formulaire soumis deux fois : la seconde requête relit l'issue de la première
+    key = request_key(
+        request,
+        sorted(cart.items.values_list('product_id', 'quantity')),
+        *(request.POST.get(field) for field in ('address', 'shipping_option', 'payment_method', 'payment_method_id', 'paypal_order_id')),
+    )
+    record, first = begin('process_payment', key, request.user)
+    if not first:
+        logger.info(f"Paiement rejoué pour {request.user.username}, clé {key[:12]}")
+        if record.status == 'completed':
+            return redirect(record.response_location)
+        messages.info(request, "Votre paiement est déjà en cours de traitement.")
+        return redirect('store:order_history')
+
+    # Une fois le paiement accepté, la clé reste acquise même si la suite
+    # échoue : la libérer ferait débiter une seconde fois au rejeu
+    try:
+        response, order = _process_payment(request, cart, record)
+    except Exception:
+        if record.status != 'completed':
+            abandon(record)
+        raise
+    if record.status != 'completed':
+        abandon(record)
+    return response
+
+def _process_payment(request, cart, record):
+    """
+    Paiement proprement dit ; retourne (réponse, commande ou None si aucune n'a
+    été créée). La clé d'idempotence record est complétée dès que le
+    prestataire a accepté le paiement.
+    """
+    pricer = CartPricer(request.user, request.session)
+    priced = pricer.price(cart)
+    if priced.is_empty:
         messages.error(request, "Votre panier est vide.")
-        return redirect('store:cart')
+        return redirect('store:cart'), None
 
     address_id = request.POST.get('address')
     shipping_option_form = ShippingMethodForm(request.POST)
     payment_method = request.POST.get('payment_method')
-    payment_method_id = request.POST.get('payment_method_id')
-    paypal_order_id = request.POST.get('paypal_order_id')
+    payment_tokens = {
+        'card': request.POST.get('payment_method_id'),
+        'paypal': request.POST.get('paypal_order_id'),
+    }
 
     if not address_id or not shipping_option_form.is_valid() or not payment_method:
         messages.error(request, "Veuillez remplir tous les champs requis.")
-        return redirect('store:checkout')
+        return redirect('store:checkout'), None
+
+    payment_token = payment_tokens.get(payment_method)
+    if not payment_token:
+        logger.error(f"Méthode de paiement ou ID manquant pour {request.user.username}: {payment_method}")
+        messages.error(request, "Méthode de paiement ou ID de paiement manquant.")
+        return redirect('store:checkout'), None
 
     try:
         address = Address.objects.get(id=address_id, user=request.user)
         shipping_option = shipping_option_form.cleaned_data['shipping_option']
     except (Address.DoesNotExist):
         messages.error(request, "Adresse invalide.")
-        return redirect('store:checkout')
+        return redirect('store:checkout'), None
 
     address_form = AddressForm(request.POST)
     if address_form.is_valid():
@@ -739,67 +738,43 @@ def process_payment(request):
     location_form = LocationForm(request.POST, request.FILES)
     if not location_form.is_valid():
         messages.error(request, "Erreur dans le formulaire de localisation.")
-        return redirect('store:checkout')
+        return redirect('store:checkout'), None
 
-    subtotal = sum(item.subtotal for item in cart_items)
-    shipping_cost = shipping_option.cost
-    discount_amount = Decimal(request.session.get('discount_amount', '0.00'))
+    priced.shipping_cost = shipping_option.cost
 
-    promo_code = request.session.get('promo_code')
-    if promo_code and discount_amount > 0:
-        try:
-            code = PromoCode.objects.get(code=promo_code)
-            if not code.is_valid(user=request.user):
-                discount_amount = Decimal('0.00')
-                del request.session['promo_code']
-                del request.session['discount_amount']
-        except PromoCode.DoesNotExist:
-            discount_amount = Decimal('0.00')
-            del request.session['promo_code']
-            del request.session['discount_amount']
-
-    total = subtotal + shipping_cost - discount_amount
-
-    for item in cart_items:
-        product = Product.objects.select_for_update().get(id=item.product.id)
-        if item.quantity > product.stock or product.is_sold_out:
-            messages.error(request, f"Stock insuffisant pour {item.product.name}.")
-            return redirect('store:cart')
-
-    order = Order.objects.create(
-        user=request.user,
-        total=total,
-        shipping_address=address,
-        shipping_option=shipping_option,
-        subtotal=subtotal,
-        shipping_cost=shipping_cost,
-        discount_amount=discount_amount,
-        status='pending',
-        payment_method=payment_method
-    )
-    logger.info(f"Commande créée pour l'utilisateur {request.user.username}: #{order.id}, Total: {total} €")
-
-    for item in cart_items:
-        product = Product.objects.get(id=item.product.id)
-        order_item = OrderItem.objects.create(
-            order=order,
-            product=product,
-            quantity=item.quantity,
-            price=product.discounted_price,
-            seller=product.seller
+    # 1. Transaction courte : réservations converties, commande en attente
+    try:
+        saga = start_checkout(
+            request.user,
+            priced,
+            payment_method,
+            payment_token,
+            shipping_address=address,
+            shipping_option=shipping_option
         )
-        product.stock -= item.quantity
-        product.save()
+    except InsufficientStock as e:
+        messages.error(request, f"Stock insuffisant pour {e.product.name}.")
+        return redirect('store:cart'), None
+    order = saga.order
+
+    # 2. Appel au prestataire hors transaction, puis 3. confirmation ou compensation
+    try:
+        charge(saga, return_url=request.build_absolute_uri(reverse('store:payment_success', kwargs={'order_id': order.id})))
+    except PaymentFailed as e:
+        logger.error(f"Erreur de paiement pour la commande #{order.id}: {str(e)}")
+        messages.error(request, f"Erreur lors du paiement : {str(e)}")
+        order.refresh_from_db(fields=['status'])
+        return redirect('store:checkout'), order
+
+    complete(record, reverse('store:payment_success', kwargs={'order_id': order.id}), order=order)
+    pricer.forget_promo()
+    cart.delete()
 
     location = location_form.save(commit=False)
-    if location.photo:
-        exif_data = get_exif_data(location.photo)
-        latitude, longitude = get_gps_info(exif_data)
-        if latitude and longitude:
-            location.latitude = latitude
-            location.longitude = longitude
     location.user = request.user
     location.save()
+    if location.photo:
+        enqueue_geotag(location)
 
     delivery = Delivery.objects.create(
         order=order,
@@ -807,116 +782,8 @@ def process_payment(request):
         status='pending'
     )
 
-    points = int(total // 10)
-    if points > 0:
-        LoyaltyPoint.objects.create(
-            user=request.user,
-            points=points,
-            description=f"Points pour commande #{order.id}"
-        )
-        logger.info(f"{points} points de fidélité attribués à {request.user.username}")
-
-    if 'promo_code' in request.session:
-        del request.session['promo_code']
-        del request.session['discount_amount']
-
-    charge_id = None
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    if payment_method == 'card' and payment_method_id:
-        try:
-            customers = stripe.Customer.list(email=request.user.email, limit=1)
-            if customers.data:
-                stripe_customer = customers.data[0]
-            else:
-                stripe_customer = stripe.Customer.create(email=request.user.email)
-            stripe.PaymentMethod.attach(payment_method_id, customer=stripe_customer.id)
-            intent = stripe.PaymentIntent.create(
-                amount=int(total * 100),
-                currency='eur',
-                customer=stripe_customer.id,
-                payment_method=payment_method_id,
-                confirmation_method='manual',
-                confirm=True,
-                return_url=request.build_absolute_uri(reverse('store:payment_success', kwargs={'order_id': order.id}))
-            )
-            if intent.status == 'succeeded':
-                charges = stripe.Charge.list(payment_intent=intent.id, limit=1)
-                if charges.data:
-                    charge_id = charges.data[0].id
-                    logger.info(f"Charge ID récupéré pour la commande #{order.id}: {charge_id}")
-                else:
-                    logger.error(f"Aucune charge trouvée pour PaymentIntent {intent.id} pour la commande #{order.id}")
-                    raise stripe.error.InvalidRequestError(
-                        "Aucune charge associée au PaymentIntent.", 
-                        param='payment_intent'
-                    )
-                order.charge_id = charge_id
-                order.status = 'processing'
-                order.save()
-                logger.info(f"Paiement Stripe réussi pour la commande #{order.id}, charge_id: {charge_id}")
-            else:
-                logger.error(f"PaymentIntent {intent.id} non finalisé pour la commande #{order.id}, statut: {intent.status}")
-                raise stripe.error.CardError("Paiement non finalisé", 'payment_intent', intent.status)
-        except stripe.error.StripeError as e:
-            logger.error(f"Erreur Stripe pour la commande #{order.id}: {str(e)}")
-            order.charge_id = None
-            order.status = 'pending'
-            order.save()
-            messages.error(request, f"Erreur lors du paiement : {str(e)}")
-            return redirect('store:checkout')
-
-    elif payment_method == 'paypal' and paypal_order_id:
-        try:
-            payment = paypalrestsdk.Payment.find(paypal_order_id)
-            if payment.state == 'approved':
-                charge_id = payment.transactions[0].related_resources[0].sale.id
-                order.charge_id = charge_id
-                order.status = 'processing'
-                order.save()
-                logger.info(f"Paiement PayPal réussi pour la commande #{order.id}, sale_id: {charge_id}")
-            else:
-                logger.error(f"Paiement PayPal non approuvé pour la commande #{order.id}: {payment.state}")
-                order.charge_id = None
-                order.status = 'pending'
-                order.save()
-                messages.error(request, "Le paiement PayPal n’a pas été approuvé.")
-                return redirect('store:checkout')
-        except paypalrestsdk.exceptions.ResourceNotFound as e:
-            logger.error(f"Erreur PayPal pour la commande #{order.id}: {str(e)}")
-            order.charge_id = None
-            order.status = 'pending'
-            order.save()
-            messages.error(request, f"Erreur lors du paiement PayPal : {str(e)}")
-            return redirect('store:checkout')
-        except Exception as e:
-            logger.error(f"Erreur inattendue PayPal pour la commande #{order.id}: {str(e)}")
-            order.charge_id = None
-            order.status = 'pending'
-            order.save()
-            messages.error(request, f"Erreur inattendue lors du paiement PayPal : {str(e)}")
-            return redirect('store:checkout')
-
-    else:
-        logger.error(f"Méthode de paiement ou ID manquant pour la commande #{order.id}")
-        order.charge_id = None
-        order.status = 'pending'
-        order.save()
-        messages.error(request, "Méthode de paiement ou ID de paiement manquant.")
-        return redirect('store:checkout')
-
-    if order.seller:
-        Notification.objects.create(
-            user=order.seller,
-            message=f"Une nouvelle commande (#{order.id}) contient votre produit.",
-            notification_type='new_order',
-            related_object_id=order.id
-        )
-    else:
-        logger.warning(f"Aucun seller principal défini pour la commande #{order.id}")
-
-    cart.delete()
     messages.success(request, "Commande passée avec succès !")
-    return redirect('store:payment_success', order_id=order.id)
+    return redirect('store:payment_success', order_id=order.id), order
 
 @login_required
 def payment_success(request, order_id):
@@ -997,14 +864,12 @@ def apply_discount_for_product(request, product_id):
             )
 
             # Notification pour les favoris
-            favorites = Favorite.objects.filter(product=product)
-            for favorite in favorites:
-                Notification.objects.create(
-                    user=favorite.user,
-                    message=f"Le produit '{product.name}' que vous avez mis en favori est en promotion ! Nouveau prix : {product.discounted_price} €.",
-                    notification_type='product_discount',
-                    related_object_id=product.id
-                )
+            notify_users(
+                Favorite.objects.filter(product=product).values_list('user_id', flat=True),
+                f"Le produit '{product.name}' que vous avez mis en favori est en promotion ! Nouveau prix : {product.discounted_price} €.",
+                'product_discount',
+                related_object_id=product.id,
+            )
 
             logger.info(f"Discount applied by user {request.user.username}: {percentage}% on product {product.id}")
             messages.success(request, "Réduction appliquée avec succès !")
@@ -1023,18 +888,13 @@ def apply_discount(request):
     if request.method == 'POST':
         code = request.POST.get('code', '').strip()
         cart = Cart.objects.get(user=request.user)
-        subtotal = sum(item.subtotal for item in cart.items.all())
-        try:
-            promo_code = PromoCode.objects.get(code=code)
-            if promo_code.is_valid(user=request.user):
-                discount_amount = promo_code.apply(subtotal)
-                request.session['promo_code'] = code
-                request.session['discount_amount'] = float(discount_amount)
-                messages.success(request, f"Code promo '{code}' appliqué avec succès ! Réduction : {discount_amount:.2f} €")
-            else:
-                messages.error(request, "Code promo invalide ou expiré.")
-        except PromoCode.DoesNotExist:
-            messages.error(request, "Code promo introuvable.")
+        pricer = CartPricer(request.user, request.session)
+        priced = pricer.price(cart, promo_code=code)
+        if priced.promo_error:
+            messages.error(request, priced.promo_error)
+        else:
+            pricer.remember_promo(priced)
+            messages.success(request, f"Code promo '{code}' appliqué avec succès ! Réduction : {priced.discount_amount:.2f} €")
         return redirect('store:cart')
     return redirect('store:cart')
 
@@ -1268,7 +1128,7 @@ def reply_to_review(request, review_id):
 
 @login_required
 def favorites(request):
-    favorites = Favorite.objects.filter(user=request.user).select_related('product')
+    favorites = Favorite.objects.filter(user=request.user).prefetch_related(prefetch_active_discount())
     return render(request, 'store/favorites.html', {'favorites': favorites})
 
 @login_required
@@ -1424,7 +1284,7 @@ def seller_public_profile(request, username):
     User = get_user_model()
     seller = get_object_or_404(User, username=username, user_type='seller')
     profile = get_object_or_404(SellerProfile, user=seller)
-    products = Product.objects.filter(seller=seller, is_sold=False, sold_out=False)
+    products = Product.objects.filter(seller=seller, is_sold=False, sold_out=False).with_active_discount()
     ratings = SellerRating.objects.filter(seller=seller).order_by('-created_at')
     return render(request, 'accounts/seller_public_profile.html', {
         'profile': profile,
@@ -1475,12 +1335,8 @@ def create_subscription(request):
             return redirect('store:product_list')
         
         try:
-            customer = stripe.Customer.create(
-                email=request.user.email,
-                metadata={'user_id': request.user.id}
-            )
             session = stripe.checkout.Session.create(
-                customer=customer.id,
+                customer=stripe_customer_id(request.user),
                 payment_method_types=['card'],
                 line_items=[{
                     'price': settings.STRIPE_PRO_PRICE_ID,
@@ -1531,43 +1387,53 @@ def stripe_webhook(request):
         logger.error("Invalid webhook signature")
         return HttpResponse(status=400)
 
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        customer_id = session.get('customer')
-        subscription_id = session.get('subscription')
-        user_id = session.get('metadata', {}).get('user_id')
+    # Stripe renvoie un événement tant qu'il n'a pas reçu de 200 : chaque id n'est traité qu'une fois
+    with transaction.atomic():
+        if not claim_webhook_event(event['id'], event['type']):
+            logger.info(f"Webhook event {event['id']} already processed")
+            return HttpResponse(status=200)
+
+        if event['type'] == 'checkout.session.completed':
+            session = event['data']['object']
+            customer_id = session.get('customer')
+            subscription_id = session.get('subscription')
+            user_id = session.get('metadata', {}).get('user_id')
         
-        if user_id:
-            user = get_object_or_404(get_user_model(), id=user_id)
-            Subscription.objects.filter(user=user, active=True).update(active=False)
-            subscription, created = Subscription.objects.get_or_create(
-                user=user,
-                plan='pro',
-                defaults={
-                    'stripe_subscription_id': subscription_id,
-                    'active': True
-                }
-            )
-            if not created:
-                subscription.stripe_subscription_id = subscription_id
-                subscription.active = True
-                subscription.save()
+            if user_id:
+                user = get_object_or_404(get_user_model(), id=user_id)
+                Subscription.objects.filter(user=user, active=True).update(active=False)
+                subscription, created = Subscription.objects.get_or_create(
+                    user=user,
+                    plan='pro',
+                    defaults={
+                        'stripe_subscription_id': subscription_id,
+                        'active': True
+                    }
+                )
+                if not created:
+                    subscription.stripe_subscription_id = subscription_id
+                    subscription.active = True
+                    subscription.save()
                 
-            logger.info(f"Subscription activated for user {user.username}: Pro plan")
+                logger.info(f"Subscription activated for user {user.username}: Pro plan")
     
-    elif event['type'] == 'customer.subscription.deleted':
-        subscription_id = event['data']['object']['id']
-        subscription = Subscription.objects.filter(stripe_subscription_id=subscription_id).first()
-        if subscription:
-            subscription.active = False
-            subscription.end_date = timezone.now()
-            subscription.save()
-            Subscription.objects.get_or_create(
-                user=subscription.user,
-                plan='free',
-                defaults={'active': True}
-            )
-            logger.info(f"Subscription cancelled for user {subscription.user.username}")
+        elif event['type'] == 'customer.deleted':
+            if forget_stripe_customer(event['data']['object']['id']):
+                logger.info(f"Stripe customer {event['data']['object']['id']} deleted, cached id cleared")
+
+        elif event['type'] == 'customer.subscription.deleted':
+            subscription_id = event['data']['object']['id']
+            subscription = Subscription.objects.filter(stripe_subscription_id=subscription_id).first()
+            if subscription:
+                subscription.active = False
+                subscription.end_date = timezone.now()
+                subscription.save()
+                Subscription.objects.get_or_create(
+                    user=subscription.user,
+                    plan='free',
+                    defaults={'active': True}
+                )
+                logger.info(f"Subscription cancelled for user {subscription.user.username}")
 
     return HttpResponse(status=200)
 
@@ -1635,28 +1501,19 @@ def apply_promo_code(request):
             return JsonResponse({'success': False, 'message': 'Code promo requis.'})
 
         cart = Cart.objects.get(user=request.user)
-        if not cart.items.exists():
+        pricer = CartPricer(request.user, request.session)
+        priced = pricer.price(cart, promo_code=promo_code)
+        if priced.is_empty:
             return JsonResponse({'success': False, 'message': 'Panier vide.'})
-
-        subtotal = sum(item.subtotal for item in cart.items.all())
-        shipping_cost = Decimal('5.00')
-        try:
-            code = PromoCode.objects.get(code=promo_code)
-            if not code.is_valid(user=request.user):
-                return JsonResponse({'success': False, 'message': 'Code promo invalide ou expiré.'})
-
-            discount_amount = code.apply(subtotal)
-            new_total = subtotal + shipping_cost - discount_amount
-
-            request.session['promo_code'] = promo_code
-            request.session['discount_amount'] = float(discount_amount)
-            return JsonResponse({
-                'success': True,
-                'discount_amount': float(discount_amount),
-                'new_total': float(new_total)
-            })
-        except PromoCode.DoesNotExist:
-            return JsonResponse({'success': False, 'message': 'Code promo introuvable.'})
+        if priced.promo_error:
+            return JsonResponse({'success': False, 'message': priced.promo_error})
+
+        pricer.remember_promo(priced)
+        return JsonResponse({
+            'success': True,
+            'discount_amount': float(priced.discount_amount),
+            'new_total': float(priced.total)
+        })
     except Exception as e:
         logger.error(f"Erreur lors de l'application du code promo pour {request.user.username}: {str(e)}")
         return JsonResponse({'success': False, 'message': 'Erreur lors de l’application du code.'})
@@ -1722,12 +1579,7 @@ def autocomplete_search(request):
     query = request.GET.get('q', '').strip()
     suggestions = []
     if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) | 
-            Q(brand__icontains=query)
-        ).values('id', 'name', 'brand')[:5]
-        suggestions = list(products)
+        suggestions = search.autocomplete(query, limit=5)
     return JsonResponse({'suggestions': suggestions})
 
 @login_required
@@ -1771,14 +1623,12 @@ def apply_discount_multiple(request):
                     is_active=True
                 )
                 # Notification pour les favoris
-                favorites = Favorite.objects.filter(product=product)
-                for favorite in favorites:
-                    Notification.objects.create(
-                        user=favorite.user,
-                        message=f"Le produit '{product.name}' que vous avez mis en favori est en promotion ! Nouveau prix : {product.discounted_price} €.",
-                        notification_type='product_discount',
-                        related_object_id=product.id
-                    )
+                notify_users(
+                    Favorite.objects.filter(product=product).values_list('user_id', flat=True),
+                    f"Le produit '{product.name}' que vous avez mis en favori est en promotion ! Nouveau prix : {product.discounted_price} €.",
+                    'product_discount',
+                    related_object_id=product.id,
+                )
 
             logger.info(f"Discount applied by user {request.user.username}: {percentage}% on {len(products)} products")
             messages.success(request, f"Réduction de {percentage}% appliquée avec succès à {len(products)} produits !")
@@ -1792,32 +1642,27 @@ def apply_discount_multiple(request):
     return render(request, 'store/apply_discount.html', {'form': form})
 
 
+@login_required
+def photo_geotag_status(request, job_id):
+    """État de l'extraction GPS d'une photo, interrogé par la page de paiement."""
+    job = get_object_or_404(PhotoGeotagJob, id=job_id, user=request.user)
+    return JsonResponse({
+        'status': job.status,
+        'finished': job.status in PhotoGeotagJob.FINISHED,
+        'latitude': job.latitude,
+        'longitude': job.longitude,
+    })
+
 @login_required
 def geocode(request):
-    """Convertir latitude/longitude en adresse via Nominatim."""
+    """Convertir latitude/longitude en adresse (store.geocoding)."""
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             latitude = float(data.get('latitude'))
             longitude = float(data.get('longitude'))
-            response = requests.get(
-                'https://nominatim.openstreetmap.org/reverse',
-                params={
-                    'lat': latitude,
-                    'lon': longitude,
-                    'format': 'json',
-                    'addressdetails': 1
-                },
-                headers={'User-Agent': 'EcommerceApp/1.0'}
-            )
-            if response.status_code == 200:
-                address_data = response.json().get('address', {})
-                address = {
-                    'street_address': address_data.get('road', 'Inconnue'),
-                    'city': address_data.get('city', '') or address_data.get('town', '') or address_data.get('village', ''),
-                    'postal_code': address_data.get('postcode', ''),
-                    'country': address_data.get('country', 'Inconnue')
-                }
+            address = reverse_geocode(latitude, longitude)
+            if address:
                 return JsonResponse({'status': 'success', 'address': address})
             else:
                 return JsonResponse({'status': 'error', 'message': 'Erreur lors de la conversion des coordonnées.'}, status=400)
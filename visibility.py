@@ -0,0 +1,60 @@
+"""
+Visibilité des produits dans le catalogue.
+
+Product.is_listed résume « modération approuvée, ni vendu ni épuisé, stock non réservé > 0 »
+dans une colonne indexée, recalculée par le SGBD à chaque changement de stock
+ou de modération.
+"""
+import logging
+
+from django.db.models import BooleanField, Case, Exists, F, OuterRef, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from admin_panel.models import ProductModeration
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# Envoyé après chaque recalcul ; product_ids vaut None pour un recalcul complet
+listing_changed = Signal()
+
+# Champs de Product dont dépend is_listed
+LISTING_FIELDS = frozenset(['stock', 'reserved_stock', 'sold_out', 'is_sold'])
+
+
+def listed_expression():
+    """Expression SQL calculant is_listed pour chaque ligne de Product."""
+    approved = ProductModeration.objects.filter(product_id=OuterRef('pk'), status='approved')
+    return Case(
+        When(Exists(approved), stock__gt=F('reserved_stock'), sold_out=False, is_sold=False, then=Value(True)),
+        default=Value(False),
+        output_field=BooleanField(),
+    )
+
+
+def refresh_listing(product_ids=None):
+    """Recalcule is_listed en un seul UPDATE pour les produits donnés (ou tous)."""
+    queryset = Product.objects.all()
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return 0
+        queryset = queryset.filter(id__in=product_ids)
+    updated = queryset.update(is_listed=listed_expression())
+    listing_changed.send(sender=Product, product_ids=product_ids)
+    return updated
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_listing(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not LISTING_FIELDS.intersection(update_fields):
+        return
+    refresh_listing([instance.id])
+
+
+@receiver(post_save, sender=ProductModeration)
+@receiver(post_delete, sender=ProductModeration)
+def refresh_moderated_product_listing(sender, instance, **kwargs):
+    if Product.objects.filter(id=instance.product_id).exists():
+        refresh_listing([instance.product_id])